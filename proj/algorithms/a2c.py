@@ -18,6 +18,11 @@ def a2c(
     total_steps=TOTAL_STEPS_DEFAULT,
     steps=20,
     n_envs=16,
+    env_backend="numpy",
+    pin_cpus=False,
+    tune_envs=False,
+    env_pool=None,
+    env_addresses=None,
     gamma=0.99,
     optimizer=None,
     max_grad_norm=0.5,
@@ -26,6 +31,28 @@ def a2c(
     log_interval=100,
     **saver_kwargs
 ):
+    """
+    Advantage Actor-Critic
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    val_fn (optional): instance of proj.common.models.ValueFunction
+    total_steps: total number of environment steps to take
+    steps: number of steps to take in each environment per iteration
+    n_envs: number of environment copies to run in parallel
+    env_backend: either "numpy" or "torch" (tensors in, tensors out)
+    pin_cpus: whether to pin env workers and the learner to disjoint CPU sets
+    tune_envs: whether to auto-tune the number of env workers (cached per host)
+    env_pool (optional): name of the env pool to use (see VecEnvMaker)
+    env_addresses (optional): list of 'host:port' env servers to sample from
+    gamma: discount factor
+    optimizer (optional): dictionary containing optimizer kwargs and/or class
+    max_grad_norm: maximum norm of the gradients, which are clipped to it
+    ent_coeff: weight of the entropy bonus in the loss
+    vf_loss_coeff: weight of the critic loss in the loss
+    log_interval: number of updates between logging statistics
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
     assert val_fn is None or not issubclass(
         policy["class"], WeightSharingAC
     ), "Choose between a weight sharing model or separate policy and val_fn"
@@ -44,7 +71,14 @@ def a2c(
     logu.save_config(locals())
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
-    vec_env = VecEnvMaker(env)(n_envs)
+    vec_env = VecEnvMaker(env).on_policy(
+        n_envs,
+        backend=env_backend,
+        pin_cpus=pin_cpus,
+        tune=tune_envs,
+        pool=env_pool,
+        addresses=env_addresses,
+    )
     policy = policy.pop("class")(vec_env, **policy)
     param_list = torch.nn.ParameterList(policy.parameters())
     if val_fn is not None:
@@ -91,6 +125,7 @@ def a2c(
             logger.logkv("Epoch", updates // log_interval + 1)
             logger.logkv("TotalNSamples", samples)
             logu.log_reward_statistics(vec_env)
+            logu.log_env_pool_statistics(vec_env)
             logu.log_val_fn_statistics(all_vals.flatten(), all_rets.flatten())
             logu.log_action_distribution_statistics(all_dists)
             logger.dumpkvs()
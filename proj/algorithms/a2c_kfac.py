@@ -19,6 +19,11 @@ def a2c_kfac(
     total_steps=TOTAL_STEPS_DEFAULT,
     steps=20,
     n_envs=16,
+    env_backend="numpy",
+    pin_cpus=False,
+    tune_envs=False,
+    env_pool=None,
+    env_addresses=None,
     kfac=None,
     ent_coeff=0.01,
     vf_loss_coeff=0.5,
@@ -27,6 +32,29 @@ def a2c_kfac(
     warm_start=None,
     **saver_kwargs
 ):
+    """
+    Advantage Actor-Critic with K-FAC
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    val_fn (optional): instance of proj.common.models.ValueFunction
+    total_steps: total number of environment steps to take
+    steps: number of steps to take in each environment per iteration
+    n_envs: number of environment copies to run in parallel
+    env_backend: either "numpy" or "torch" (tensors in, tensors out)
+    pin_cpus: whether to pin env workers and the learner to disjoint CPU sets
+    tune_envs: whether to auto-tune the number of env workers (cached per host)
+    env_pool (optional): name of the env pool to use (see VecEnvMaker)
+    env_addresses (optional): list of 'host:port' env servers to sample from
+    kfac (optional): dictionary containing KFACOptimizer kwargs
+    ent_coeff: weight of the entropy bonus in the loss
+    vf_loss_coeff: weight of the critic loss in the loss
+    gamma: discount factor
+    log_interval: number of updates between logging statistics
+    warm_start (optional): log directory of a previous run to load models and
+        optimizers from, optionally followed by ':<snapshot index>'
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
     assert val_fn is None or not issubclass(
         policy["class"], WeightSharingAC
     ), "Choose between a weight sharing model or separate policy and val_fn"
@@ -42,7 +70,14 @@ def a2c_kfac(
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
     # initialize models and optimizer
-    vec_env = VecEnvMaker(env)(n_envs)
+    vec_env = VecEnvMaker(env).on_policy(
+        n_envs,
+        backend=env_backend,
+        pin_cpus=pin_cpus,
+        tune=tune_envs,
+        pool=env_pool,
+        addresses=env_addresses,
+    )
     policy = policy.pop("class")(vec_env, **policy)
     module_list = torch.nn.ModuleList(policy.modules())
     if val_fn is not None:
@@ -141,6 +176,7 @@ def a2c_kfac(
             logger.logkv("Epoch", updates // log_interval + 1)
             logger.logkv("TotalNSamples", samples)
             logu.log_reward_statistics(vec_env)
+            logu.log_env_pool_statistics(vec_env)
             logu.log_val_fn_statistics(all_vals, all_rets)
             logu.log_action_distribution_statistics(all_dists)
             logger.dumpkvs()
@@ -27,6 +27,12 @@ def acktr(
     total_steps=TOTAL_STEPS_DEFAULT,
     steps=125,
     n_envs=16,
+    double_buffer=False,
+    env_backend="numpy",
+    pin_cpus=False,
+    tune_envs=False,
+    env_pool=None,
+    env_addresses=None,
     gamma=0.99,
     gaelam=0.96,
     val_iters=20,
@@ -36,6 +42,31 @@ def acktr(
     linesearch=True,
     **saver_kwargs
 ):
+    """
+    Actor-Critic using Kronecker-Factored Trust Region
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    val_fn (optional): instance of proj.common.models.ValueFunction
+    total_steps: total number of environment steps to take
+    steps: number of steps to take in each environment per iteration
+    n_envs: number of environment copies to run in parallel
+    double_buffer: whether to overlap policy inference and environment stepping
+    env_backend: either "numpy" or "torch" (tensors in, tensors out)
+    pin_cpus: whether to pin env workers and the learner to disjoint CPU sets
+    tune_envs: whether to auto-tune the number of env workers (cached per host)
+    env_pool (optional): name of the env pool to use (see VecEnvMaker)
+    env_addresses (optional): list of 'host:port' env servers to sample from
+    gamma: GAE discount parameter
+    gaelam: GAE lambda exponential average parameter
+    val_iters: number of optimization steps to update the critic per iteration
+    pikfac (optional): dictionary containing KFACOptimizer kwargs for the policy
+    vfkfac (optional): dictionary containing KFACOptimizer kwargs for the critic
+    warm_start (optional): log directory of a previous run to load models and
+        optimizers from, optionally followed by ':<snapshot index>'
+    linesearch: whether to backtrack until the KL constraint is satisfied
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
     # handling default values
     pikfac = pikfac or {}
     vfkfac = vfkfac or {}
@@ -46,7 +77,14 @@ def acktr(
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
     # initialize models and optimizer
-    vec_env = VecEnvMaker(env)(n_envs)
+    vec_env = VecEnvMaker(env).on_policy(
+        n_envs,
+        backend=env_backend,
+        pin_cpus=pin_cpus,
+        tune=tune_envs,
+        pool=env_pool,
+        addresses=env_addresses,
+    )
     policy = policy.pop("class")(vec_env, **policy)
     val_fn = val_fn.pop("class")(vec_env, **val_fn)
     pol_optim = KFACOptimizer(policy, **{**DEFAULT_PIKFAC, **pikfac})
@@ -68,7 +106,9 @@ def acktr(
             val_optim.load_state_dict(state["val_optim"])
 
     # Algorithm main loop
-    collector = parallel_samples_collector(vec_env, policy, steps)
+    collector = parallel_samples_collector(
+        vec_env, policy, steps, double_buffer=double_buffer
+    )
     beg, end, stp = steps * n_envs, total_steps + steps * n_envs, steps * n_envs
     for samples in trange(beg, end, stp, desc="Training", unit="step"):
         logger.info("Starting iteration {}".format(samples // stp))
@@ -144,6 +184,7 @@ def acktr(
         logger.info("Logging information")
         logger.logkv("TotalNSamples", samples)
         logu.log_reward_statistics(vec_env)
+        logu.log_env_pool_statistics(vec_env)
         logu.log_val_fn_statistics(all_vals, all_rets)
         logu.log_action_distribution_statistics(old_dists)
         logu.log_average_kl_divergence(old_dists, policy, all_obs)
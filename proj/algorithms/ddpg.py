@@ -1,12 +1,22 @@
+import os
 import torch
 import numpy as np
 from baselines import logger
-from proj.utils.saver import SnapshotSaver
+from proj.utils.saver import SnapshotSaver, ReplayCheckpointer
 from proj.utils.tqdm_util import trange
-from proj.utils.torch_util import update_polyak
+from proj.utils.torch_util import update_polyak, weighted_mse_loss
 from proj.common.models import ContinuousQFunction
-from proj.common.sampling import ReplayBuffer
-from proj.common.log_utils import save_config, log_reward_statistics
+from proj.common.sampling import (
+    make_replay_buffer,
+    terminal_source,
+    PrioritizedReplayBuffer,
+    BatchPrefetcher,
+)
+from proj.common.log_utils import (
+    save_config,
+    log_reward_statistics,
+    log_env_pool_statistics,
+)
 from proj.common.env_makers import VecEnvMaker
 
 
@@ -19,8 +29,10 @@ def ddpg(
     policy,
     q_func=None,
     total_steps=TOTAL_STEPS_DEFAULT,
+    n_envs=1,
     gamma=0.99,
     replay_size=REPLAY_SIZE_DEFAULT,
+    replay_buffer="ReplayBuffer",
     polyak=0.995,
     start_steps=10000,
     epoch=5000,
@@ -30,8 +42,39 @@ def ddpg(
     act_noise=0.1,
     max_ep_length=1000,
     updates_per_step=1.0,
+    prefetch=0,
+    pin_memory=False,
+    save_replay=False,
+    warm_start=None,
     **saver_kwargs
 ):
+    """
+    Deep Deterministic Policy Gradient
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    q_func (optional): instance of proj.common.models.ContinuousQFunction
+    total_steps: total number of environment steps to take
+    n_envs: number of environment copies to run in parallel
+    gamma: discount factor
+    replay_size: maximum number of transitions kept in the replay buffer
+    replay_buffer: name of the replay buffer class (see make_replay_buffer)
+    polyak: interpolation factor of the target networks' updates
+    start_steps: number of initial steps taking uniformly random actions
+    epoch: number of steps between each test, log and snapshot
+    pi_lr: learning rate for policy optimizer
+    qf_lr: learning rate for Q function optimizer
+    mb_size: minibatch size for updates
+    act_noise: standard deviation of the Gaussian exploration noise
+    max_ep_length: maximum number of steps between update phases
+    updates_per_step: number of updates per environment step
+    prefetch: number of minibatches to sample ahead on a background thread
+    pin_memory: whether prefetched minibatches go in page-locked memory
+    save_replay: whether to checkpoint the replay buffer with each snapshot
+    warm_start (optional): log directory of a previous run to resume from, with
+        its replay buffer if it was saved with save_replay
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
 
     # Set and save experiment hyperparameters
     q_func = q_func or ContinuousQFunction.from_policy(policy)
@@ -39,17 +82,28 @@ def ddpg(
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
     # Initialize environments, models and replay buffer
-    vec_env = VecEnvMaker(env)()
+    vec_env = VecEnvMaker(env)(n_envs)
     test_env = VecEnvMaker(env)(train=False)
     ob_space, ac_space = vec_env.observation_space, vec_env.action_space
     pi_class, pi_args = policy.pop("class"), policy
     qf_class, qf_args = q_func.pop("class"), q_func
     policy = pi_class(vec_env, **pi_args)
     q_func = qf_class(vec_env, **qf_args)
-    replay = ReplayBuffer(replay_size, ob_space, ac_space)
+    replay = make_replay_buffer(
+        replay_buffer,
+        replay_size,
+        ob_space,
+        ac_space,
+        n_envs=n_envs,
+        path=os.path.join(logger.get_dir(), "replay_memmap"),
+    )
+    # Prioritized buffers also return importance sampling weights and indices
+    prioritized = isinstance(replay, PrioritizedReplayBuffer)
+    sampler = BatchPrefetcher(
+        replay, mb_size, n_batches=prefetch, pin_memory=pin_memory
+    )
 
     # Initialize optimizers and target networks
-    loss_fn = torch.nn.MSELoss()
     pi_optim = torch.optim.Adam(policy.parameters(), lr=pi_lr)
     qf_optim = torch.optim.Adam(q_func.parameters(), lr=qf_lr)
     pi_targ = pi_class(vec_env, **pi_args)
@@ -57,11 +111,34 @@ def ddpg(
     pi_targ.load_state_dict(policy.state_dict())
     qf_targ.load_state_dict(q_func.state_dict())
 
+    # Load state and replay buffer if provided
+    start = 0
+    if warm_start is not None:
+        warm_saver = SnapshotSaver(warm_start)
+        _, state = warm_saver.get_state()
+        modules = dict(
+            policy=policy,
+            q_func=q_func,
+            pi_optim=pi_optim,
+            qf_optim=qf_optim,
+            pi_targ=pi_targ,
+            qf_targ=qf_targ,
+        )
+        for name, module in modules.items():
+            if name in state:
+                module.load_state_dict(state[name])
+        start = state["alg"]["samples"]
+        replay_ckpt = ReplayCheckpointer(warm_saver.replay_folder)
+        if os.path.exists(replay_ckpt.manifest_path):
+            replay_ckpt.restore(replay)
+    if save_replay:
+        replay_saver = ReplayCheckpointer(saver.replay_folder)
+
     # Save initial state
-    saver.save_state(
+    saved = saver.save_state(
         index=0,
         state=dict(
-            alg=dict(samples=0),
+            alg=dict(samples=start),
             policy=policy.state_dict(),
             q_func=q_func.state_dict(),
             pi_optim=pi_optim.state_dict(),
@@ -69,6 +146,8 @@ def ddpg(
             qf_targ=qf_targ.state_dict(),
         ),
     )
+    if save_replay and saved:
+        replay_saver.save(replay)
 
     # Setup and run policy tests
     ob, don = test_env.reset(), False
@@ -100,33 +179,47 @@ def ddpg(
         return np.clip(acts.numpy(), ac_space.low, ac_space.high)
 
     # Algorithm main loop
+    terminals = terminal_source(vec_env)
     obs1, ep_length = vec_env.reset(), 0
-    for samples in trange(1, total_steps + 1, desc="Training", unit="iter"):
+    for samples in trange(
+        start + n_envs, total_steps + 1, n_envs, desc="Training", unit="iter"
+    ):
         if samples <= start_steps:
             actions = rand_uniform_actions
         else:
             actions = noisy_policy_actions
 
         acts = actions(obs1)
-        obs2, rews, dones, _ = vec_env.step(acts)
+        next_obs, rews, dones, _ = vec_env.step(acts)
         ep_length += 1
-        dones[0] = False if ep_length == max_ep_length else dones[0]
+        # Finished episodes transition into their true last observation, which
+        # is only terminal if they weren't cut short by a time limit
+        obs2, terms = next_obs, dones
+        if terminals is not None and dones.any():
+            obs2, terms = next_obs.copy(), dones & ~terminals.truncated
+            obs2[dones] = terminals.terminal_obs[dones]
 
-        as_tensors = map(torch.from_numpy, (obs1, acts, rews, obs2, dones.astype("f")))
-        for ob1, act, rew, ob2, done in zip(*as_tensors):
-            replay.store(ob1, act, rew, ob2, done)
-        obs1 = obs2
+        replay.store_batch(obs1, acts, rews, obs2, terms, resets=dones)
+        obs1 = next_obs
 
-        if (dones[0] or ep_length == max_ep_length) and replay.size >= mb_size:
-            for _ in range(int(ep_length * updates_per_step)):
-                ob_1, act_, rew_, ob_2, done_ = replay.sample(mb_size)
+        # Update phases follow the end of any episode, or max_ep_length steps,
+        # with as many updates as there were transitions since the last one
+        update_phase = dones.any() or ep_length == max_ep_length
+        if update_phase and replay.can_sample(mb_size):
+            n_updates = int(ep_length * n_envs * updates_per_step)
+            if prioritized:
+                replay.anneal_beta(samples / total_steps)
+            for ob_1, act_, rew_, ob_2, done_, *prio in sampler.batches(n_updates):
+                weights = prio[0] if prioritized else None
                 with torch.no_grad():
                     targs = rew_ + gamma * (1 - done_) * qf_targ(ob_2, pi_targ(ob_2))
                 qf_optim.zero_grad()
                 qf_val = q_func(ob_1, act_)
-                qf_loss = loss_fn(qf_val, targs)
+                qf_loss = weighted_mse_loss(qf_val, targs, weights)
                 qf_loss.backward()
                 qf_optim.step()
+                if prioritized:
+                    sampler.update_priorities(prio[1], (qf_val - targs).detach())
 
                 pi_optim.zero_grad()
                 qpi_val = q_func(ob_1, policy(ob_1)).mean()
@@ -142,16 +235,19 @@ def ddpg(
                 logger.logkv_mean("QPiVal", qpi_val.item())
                 logger.logkv_mean("PiLoss", pi_loss.item())
 
+        if update_phase:
             ep_length = 0
 
-        if samples % epoch == 0:
+        if samples % epoch < n_envs:
             test_policy()
             logger.logkv("Epoch", samples // epoch)
             logger.logkv("TotalNSamples", samples)
             log_reward_statistics(vec_env)
+            log_env_pool_statistics(vec_env)
+            logger.logkvs(sampler.get_stats())
             logger.dumpkvs()
 
-            saver.save_state(
+            saved = saver.save_state(
                 index=samples // epoch,
                 state=dict(
                     alg=dict(samples=samples),
@@ -163,3 +259,5 @@ def ddpg(
                     qf_targ=qf_targ.state_dict(),
                 ),
             )
+            if save_replay and saved:
+                replay_saver.save(replay)
@@ -27,6 +27,12 @@ def natural(
     total_steps=TOTAL_STEPS_DEFAULT,
     steps=125,
     n_envs=16,
+    double_buffer=False,
+    env_backend="numpy",
+    pin_cpus=False,
+    tune_envs=False,
+    env_pool=None,
+    env_addresses=None,
     gamma=0.99,
     gaelam=0.97,
     kl_frac=1.0,
@@ -44,6 +50,12 @@ def natural(
     total_steps: total number of environment steps to take
     steps: number of steps to take in each environment per iteration
     n_envs: number of environment copies to run in parallel
+    double_buffer: whether to overlap policy inference and environment stepping
+    env_backend: either "numpy" or "torch" (tensors in, tensors out)
+    pin_cpus: whether to pin env workers and the learner to disjoint CPU sets
+    tune_envs: whether to auto-tune the number of env workers (cached per host)
+    env_pool (optional): name of the env pool to use (see VecEnvMaker)
+    env_addresses (optional): list of 'host:port' env servers to sample from
     gamma: GAE discount parameter
     gaelam: GAE lambda exponential average parameter
     kl_frac:
@@ -56,14 +68,23 @@ def natural(
     logu.save_config(locals())
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
-    vec_env = VecEnvMaker(env)(n_envs)
+    vec_env = VecEnvMaker(env).on_policy(
+        n_envs,
+        backend=env_backend,
+        pin_cpus=pin_cpus,
+        tune=tune_envs,
+        pool=env_pool,
+        addresses=env_addresses,
+    )
     policy = policy.pop("class")(vec_env, **policy)
     val_fn = val_fn.pop("class")(vec_env, **val_fn)
     val_optim = torch.optim.Adam(val_fn.parameters(), lr=val_lr)
     loss_fn = torch.nn.MSELoss()
 
     # Algorithm main loop
-    collector = parallel_samples_collector(vec_env, policy, steps)
+    collector = parallel_samples_collector(
+        vec_env, policy, steps, double_buffer=double_buffer
+    )
     beg, end, stp = steps * n_envs, total_steps + steps * n_envs, steps * n_envs
     for samples in trange(beg, end, stp, desc="Training", unit="step"):
         logger.info("Starting iteration {}".format(samples // stp))
@@ -112,6 +133,7 @@ def natural(
         logger.info("Logging information")
         logger.logkv("TotalNSamples", samples)
         logu.log_reward_statistics(vec_env)
+        logu.log_env_pool_statistics(vec_env)
         logu.log_val_fn_statistics(all_vals, all_rets)
         logu.log_action_distribution_statistics(old_dists)
         logu.log_average_kl_divergence(old_dists, policy, all_obs)
@@ -24,6 +24,12 @@ def ppo(
     total_steps=TOTAL_STEPS_DEFAULT,
     steps=125,
     n_envs=16,
+    double_buffer=False,
+    env_backend="numpy",
+    pin_cpus=False,
+    tune_envs=False,
+    env_pool=None,
+    env_addresses=None,
     gamma=0.99,
     gaelam=0.96,
     clip_ratio=0.2,
@@ -35,12 +41,46 @@ def ppo(
     mb_size=100,
     **saver_kwargs
 ):
+    """
+    Proximal Policy Optimization
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    val_fn (optional): instance of proj.common.models.ValueFunction
+    total_steps: total number of environment steps to take
+    steps: number of steps to take in each environment per iteration
+    n_envs: number of environment copies to run in parallel
+    double_buffer: whether to overlap policy inference and environment stepping
+    env_backend: either "numpy" or "torch" (tensors in, tensors out)
+    pin_cpus: whether to pin env workers and the learner to disjoint CPU sets
+    tune_envs: whether to auto-tune the number of env workers (cached per host)
+    env_pool (optional): name of the env pool to use (see VecEnvMaker)
+    env_addresses (optional): list of 'host:port' env servers to sample from
+    gamma: GAE discount parameter
+    gaelam: GAE lambda exponential average parameter
+    clip_ratio: clipping range of the probability ratios in the surrogate loss
+    pol_iters: maximum number of passes over the samples to update the policy
+    val_iters: number of optimization steps to update the critic per iteration
+    pol_lr: learning rate for policy optimizer
+    val_lr: learning rate for critic optimizer
+    target_kl: policy updates stop early once the KL divergence exceeds
+        1.5 times this value
+    mb_size: number of samples per minibatch of policy updates
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
     val_fn = val_fn or ValueFunction.from_policy(policy)
 
     logu.save_config(locals())
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
-    vec_env = VecEnvMaker(env)(n_envs)
+    vec_env = VecEnvMaker(env).on_policy(
+        n_envs,
+        backend=env_backend,
+        pin_cpus=pin_cpus,
+        tune=tune_envs,
+        pool=env_pool,
+        addresses=env_addresses,
+    )
     policy = policy.pop("class")(vec_env, **policy)
     val_fn = val_fn.pop("class")(vec_env, **val_fn)
     pol_optim = torch.optim.Adam(policy.parameters(), lr=pol_lr)
@@ -48,7 +88,9 @@ def ppo(
     loss_fn = torch.nn.MSELoss()
 
     # Algorithm main loop
-    collector = parallel_samples_collector(vec_env, policy, steps)
+    collector = parallel_samples_collector(
+        vec_env, policy, steps, double_buffer=double_buffer
+    )
     beg, end, stp = steps * n_envs, total_steps + steps * n_envs, steps * n_envs
     for samples in trange(beg, end, stp, desc="Training", unit="step"):
         logger.info("Starting iteration {}".format(samples // stp))
@@ -95,6 +137,7 @@ def ppo(
         logger.info("Logging information")
         logger.logkv("TotalNSamples", samples)
         logu.log_reward_statistics(vec_env)
+        logu.log_env_pool_statistics(vec_env)
         logu.log_val_fn_statistics(all_vals, all_rets)
         logu.log_action_distribution_statistics(old_dists)
         logger.logkv("MeanKL", mean_kl)
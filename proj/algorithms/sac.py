@@ -1,12 +1,22 @@
+import os
 import torch
 import numpy as np
 from baselines import logger
-from proj.utils.saver import SnapshotSaver
+from proj.utils.saver import SnapshotSaver, ReplayCheckpointer
 from proj.utils.tqdm_util import trange
-from proj.utils.torch_util import update_polyak
+from proj.utils.torch_util import update_polyak, weighted_mse_loss
 from proj.common.models import ContinuousQFunction, ValueFunction
-from proj.common.sampling import ReplayBuffer
-from proj.common.log_utils import save_config, log_reward_statistics
+from proj.common.sampling import (
+    make_replay_buffer,
+    terminal_source,
+    PrioritizedReplayBuffer,
+    BatchPrefetcher,
+)
+from proj.common.log_utils import (
+    save_config,
+    log_reward_statistics,
+    log_env_pool_statistics,
+)
 from proj.common.env_makers import VecEnvMaker
 
 
@@ -20,8 +30,10 @@ def sac(
     q_func=None,
     val_fn=None,
     total_steps=TOTAL_STEPS_DEFAULT,
+    n_envs=1,
     gamma=0.99,
     replay_size=REPLAY_SIZE_DEFAULT,
+    replay_buffer="ReplayBuffer",
     polyak=0.995,
     start_steps=10000,
     epoch=5000,
@@ -31,9 +43,42 @@ def sac(
     target_entropy=None,
     reward_scale=1.0,
     updates_per_step=1.0,
+    prefetch=0,
+    pin_memory=False,
+    save_replay=False,
+    warm_start=None,
     max_ep_length=1000,
     **saver_kwargs
 ):
+    """
+    Soft Actor-Critic
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    q_func (optional): instance of proj.common.models.ContinuousQFunction
+    val_fn (optional): instance of proj.common.models.ValueFunction
+    total_steps: total number of environment steps to take
+    n_envs: number of environment copies to run in parallel
+    gamma: discount factor
+    replay_size: maximum number of transitions kept in the replay buffer
+    replay_buffer: name of the replay buffer class (see make_replay_buffer)
+    polyak: interpolation factor of the target value function's updates
+    start_steps: number of initial steps taking uniformly random actions
+    epoch: number of steps between each test, log and snapshot
+    mb_size: minibatch size for updates
+    lr: learning rate for all optimizers
+    alpha: entropy regularization coefficient, unless tuned
+    target_entropy (optional): entropy (or "auto") to tune the coefficient for
+    reward_scale: factor by which rewards are multiplied
+    updates_per_step: number of updates per environment step
+    prefetch: number of minibatches to sample ahead on a background thread
+    pin_memory: whether prefetched minibatches go in page-locked memory
+    save_replay: whether to checkpoint the replay buffer with each snapshot
+    warm_start (optional): log directory of a previous run to resume from, with
+        its replay buffer if it was saved with save_replay
+    max_ep_length: maximum number of steps between update phases
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
 
     # Set and save experiment hyperparameters
     q_func = q_func or ContinuousQFunction.from_policy(policy)
@@ -42,7 +87,7 @@ def sac(
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
     # Initialize environments, models and replay buffer
-    vec_env = VecEnvMaker(env)()
+    vec_env = VecEnvMaker(env)(n_envs)
     test_env = VecEnvMaker(env)(train=False)
     ob_space, ac_space = vec_env.observation_space, vec_env.action_space
     pi_class, pi_args = policy.pop("class"), policy
@@ -52,7 +97,19 @@ def sac(
     q1func = qf_class(vec_env, **qf_args)
     q2func = qf_class(vec_env, **qf_args)
     val_fn = vf_class(vec_env, **vf_args)
-    replay = ReplayBuffer(replay_size, ob_space, ac_space)
+    replay = make_replay_buffer(
+        replay_buffer,
+        replay_size,
+        ob_space,
+        ac_space,
+        n_envs=n_envs,
+        path=os.path.join(logger.get_dir(), "replay_memmap"),
+    )
+    # Prioritized buffers also return importance sampling weights and indices
+    prioritized = isinstance(replay, PrioritizedReplayBuffer)
+    sampler = BatchPrefetcher(
+        replay, mb_size, n_batches=prefetch, pin_memory=pin_memory
+    )
     if target_entropy is not None:
         log_alpha = torch.nn.Parameter(torch.zeros([]))
         if target_entropy == "auto":
@@ -70,9 +127,37 @@ def sac(
     if target_entropy is not None:
         al_optim = torch.optim.Adam([log_alpha], lr=lr)
 
+    # Load state and replay buffer if provided
+    start = 0
+    if warm_start is not None:
+        warm_saver = SnapshotSaver(warm_start)
+        _, state = warm_saver.get_state()
+        modules = dict(
+            policy=policy,
+            q1func=q1func,
+            q2func=q2func,
+            val_fn=val_fn,
+            pi_optim=pi_optim,
+            qf_optim=qf_optim,
+            vf_optim=vf_optim,
+            vf_targ=vf_targ,
+        )
+        for name, module in modules.items():
+            if name in state:
+                module.load_state_dict(state[name])
+        if target_entropy is not None and "log_alpha" in state:
+            log_alpha.data.copy_(state["log_alpha"])
+            al_optim.load_state_dict(state["al_optim"])
+        start = state["alg"]["samples"]
+        replay_ckpt = ReplayCheckpointer(warm_saver.replay_folder)
+        if os.path.exists(replay_ckpt.manifest_path):
+            replay_ckpt.restore(replay)
+    if save_replay:
+        replay_saver = ReplayCheckpointer(saver.replay_folder)
+
     # Save initial state
     state = dict(
-        alg=dict(samples=0),
+        alg=dict(samples=start),
         policy=policy.state_dict(),
         q1func=q1func.state_dict(),
         q2func=q2func.state_dict(),
@@ -85,7 +170,9 @@ def sac(
     if target_entropy is not None:
         state["log_alpha"] = log_alpha
         state["al_optim"] = al_optim.state_dict()
-    saver.save_state(index=0, state=state)
+    saved = saver.save_state(index=0, state=state)
+    if save_replay and saved:
+        replay_saver.save(replay)
 
     # Setup and run policy tests
     ob, don = test_env.reset(), False
@@ -116,26 +203,36 @@ def sac(
         return policy.actions(torch.from_numpy(obs)).numpy()
 
     # Algorithm main loop
+    terminals = terminal_source(vec_env)
     obs1, ep_length = vec_env.reset(), 0
-    for samples in trange(1, total_steps + 1, desc="Training", unit="step"):
+    for samples in trange(
+        start + n_envs, total_steps + 1, n_envs, desc="Training", unit="step"
+    ):
         if samples <= start_steps:
             actions = rand_uniform_actions
         else:
             actions = stoch_policy_actions
 
         acts = actions(obs1)
-        obs2, rews, dones, _ = vec_env.step(acts)
+        next_obs, rews, dones, _ = vec_env.step(acts)
         ep_length += 1
-        dones[0] = False if ep_length == max_ep_length else dones[0]
+        # Finished episodes transition into their true last observation, which
+        # is only terminal if they weren't cut short by a time limit
+        obs2, terms = next_obs, dones
+        if terminals is not None and dones.any():
+            obs2, terms = next_obs.copy(), dones & ~terminals.truncated
+            obs2[dones] = terminals.terminal_obs[dones]
 
-        as_tensors = map(torch.from_numpy, (obs1, acts, rews, obs2, dones.astype("f")))
-        for ob1, act, rew, ob2, done in zip(*as_tensors):
-            replay.store(ob1, act, rew, ob2, done)
-        obs1 = obs2
+        replay.store_batch(obs1, acts, rews, obs2, terms, resets=dones)
+        obs1 = next_obs
 
-        if (dones[0] or ep_length == max_ep_length) and replay.size >= mb_size:
-            for _ in range(int(ep_length * updates_per_step)):
-                ob_1, act_, rew_, ob_2, done_ = replay.sample(mb_size)
+        update_phase = dones.any() or ep_length == max_ep_length
+        if update_phase and replay.can_sample(mb_size):
+            n_updates = int(ep_length * n_envs * updates_per_step)
+            if prioritized:
+                replay.anneal_beta(samples / total_steps)
+            for ob_1, act_, rew_, ob_2, done_, *prio in sampler.batches(n_updates):
+                weights = prio[0] if prioritized else None
                 dist = policy(ob_1)
                 pi_a = dist.rsample()
                 logp = dist.log_prob(pi_a)
@@ -158,10 +255,12 @@ def sac(
                 qf_optim.zero_grad()
                 q1_val = q1func(ob_1, act_)
                 q2_val = q2func(ob_1, act_)
-                q1_loss = loss_fn(q1_val, y_qf).div(2)
-                q2_loss = loss_fn(q2_val, y_qf).div(2)
+                q1_loss = weighted_mse_loss(q1_val, y_qf, weights).div(2)
+                q2_loss = weighted_mse_loss(q2_val, y_qf, weights).div(2)
                 q1_loss.add(q2_loss).backward()
                 qf_optim.step()
+                if prioritized:
+                    sampler.update_priorities(prio[1], (q1_val - y_qf).detach())
 
                 vf_optim.zero_grad()
                 vf_val = val_fn(ob_1)
@@ -189,13 +288,16 @@ def sac(
                 logger.logkv_mean("PiLoss", pi_loss.item())
                 logger.logkv_mean("Alpha", alpha)
 
+        if update_phase:
             ep_length = 0
 
-        if samples % epoch == 0:
+        if samples % epoch < n_envs:
             test_policy()
             logger.logkv("Epoch", samples // epoch)
             logger.logkv("TotalNSamples", samples)
             log_reward_statistics(vec_env)
+            log_env_pool_statistics(vec_env)
+            logger.logkvs(sampler.get_stats())
             logger.dumpkvs()
 
             state = dict(
@@ -212,4 +314,6 @@ def sac(
             if target_entropy is not None:
                 state["log_alpha"] = log_alpha
                 state["al_optim"] = al_optim.state_dict()
-            saver.save_state(index=samples // epoch, state=state)
+            saved = saver.save_state(index=samples // epoch, state=state)
+            if save_replay and saved:
+                replay_saver.save(replay)
@@ -1,13 +1,23 @@
+import os
 from itertools import chain
 import torch
 import numpy as np
 from baselines import logger
-from proj.utils.saver import SnapshotSaver
+from proj.utils.saver import SnapshotSaver, ReplayCheckpointer
 from proj.utils.tqdm_util import trange
-from proj.utils.torch_util import update_polyak
+from proj.utils.torch_util import update_polyak, weighted_mse_loss
 from proj.common.models import ContinuousQFunction
-from proj.common.sampling import ReplayBuffer
-from proj.common.log_utils import save_config, log_reward_statistics
+from proj.common.sampling import (
+    make_replay_buffer,
+    terminal_source,
+    PrioritizedReplayBuffer,
+    BatchPrefetcher,
+)
+from proj.common.log_utils import (
+    save_config,
+    log_reward_statistics,
+    log_env_pool_statistics,
+)
 from proj.common.env_makers import VecEnvMaker
 
 
@@ -20,8 +30,10 @@ def td3(
     policy,
     q_func=None,
     total_steps=TOTAL_STEPS_DEFAULT,
+    n_envs=1,
     gamma=0.99,
     replay_size=REPLAY_SIZE_DEFAULT,
+    replay_buffer="ReplayBuffer",
     polyak=0.995,
     start_steps=10000,
     epoch=5000,
@@ -34,15 +46,50 @@ def td3(
     noise_clip=0.5,
     policy_delay=2,
     updates_per_step=1.0,
+    prefetch=0,
+    pin_memory=False,
+    save_replay=False,
+    warm_start=None,
     **saver_kwargs
 ):
+    """
+    Twin Delayed Deep Deterministic Policy Gradient
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    q_func (optional): instance of proj.common.models.ContinuousQFunction
+    total_steps: total number of environment steps to take
+    n_envs: number of environment copies to run in parallel
+    gamma: discount factor
+    replay_size: maximum number of transitions kept in the replay buffer
+    replay_buffer: name of the replay buffer class (see make_replay_buffer)
+    polyak: interpolation factor of the target networks' updates
+    start_steps: number of initial steps taking uniformly random actions
+    epoch: number of steps between each test, log and snapshot
+    pi_lr: learning rate for policy optimizer
+    qf_lr: learning rate for Q functions optimizer
+    mb_size: minibatch size for updates
+    act_noise: standard deviation of the Gaussian exploration noise
+    max_ep_length: maximum number of steps between update phases
+    target_noise: standard deviation of the target policy smoothing noise
+    noise_clip: bound on the absolute value of the target policy noise
+    policy_delay: number of Q function updates per policy update
+    updates_per_step: number of updates per environment step
+    prefetch: number of minibatches to sample ahead on a background thread
+    pin_memory: whether prefetched minibatches go in page-locked memory
+    save_replay: whether to checkpoint the replay buffer with each snapshot
+    warm_start (optional): log directory of a previous run to resume from, with
+        its replay buffer if it was saved with save_replay
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
+
     # Set and save experiment hyperparameters
     q_func = q_func or ContinuousQFunction.from_policy(policy)
     save_config(locals())
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
     # Initialize environments, models and replay buffer
-    vec_env = VecEnvMaker(env)()
+    vec_env = VecEnvMaker(env)(n_envs)
     test_env = VecEnvMaker(env)(train=False)
     ob_space, ac_space = vec_env.observation_space, vec_env.action_space
     pi_class, pi_args = policy.pop("class"), policy
@@ -50,10 +97,21 @@ def td3(
     policy = pi_class(vec_env, **pi_args)
     q1func = qf_class(vec_env, **qf_args)
     q2func = qf_class(vec_env, **qf_args)
-    replay = ReplayBuffer(replay_size, ob_space, ac_space)
+    replay = make_replay_buffer(
+        replay_buffer,
+        replay_size,
+        ob_space,
+        ac_space,
+        n_envs=n_envs,
+        path=os.path.join(logger.get_dir(), "replay_memmap"),
+    )
+    # Prioritized buffers also return importance sampling weights and indices
+    prioritized = isinstance(replay, PrioritizedReplayBuffer)
+    sampler = BatchPrefetcher(
+        replay, mb_size, n_batches=prefetch, pin_memory=pin_memory
+    )
 
     # Initialize optimizers and target networks
-    loss_fn = torch.nn.MSELoss()
     pi_optim = torch.optim.Adam(policy.parameters(), lr=pi_lr)
     qf_optim = torch.optim.Adam(
         chain(q1func.parameters(), q2func.parameters()), lr=qf_lr
@@ -65,11 +123,36 @@ def td3(
     q1_targ.load_state_dict(q1func.state_dict())
     q2_targ.load_state_dict(q2func.state_dict())
 
+    # Load state and replay buffer if provided
+    start = 0
+    if warm_start is not None:
+        warm_saver = SnapshotSaver(warm_start)
+        _, state = warm_saver.get_state()
+        modules = dict(
+            policy=policy,
+            q1func=q1func,
+            q2func=q2func,
+            pi_optim=pi_optim,
+            qf_optim=qf_optim,
+            pi_targ=pi_targ,
+            q1_targ=q1_targ,
+            q2_targ=q2_targ,
+        )
+        for name, module in modules.items():
+            if name in state:
+                module.load_state_dict(state[name])
+        start = state["alg"]["samples"]
+        replay_ckpt = ReplayCheckpointer(warm_saver.replay_folder)
+        if os.path.exists(replay_ckpt.manifest_path):
+            replay_ckpt.restore(replay)
+    if save_replay:
+        replay_saver = ReplayCheckpointer(saver.replay_folder)
+
     # Save initial state
-    saver.save_state(
+    saved = saver.save_state(
         index=0,
         state=dict(
-            alg=dict(samples=0),
+            alg=dict(samples=start),
             policy=policy.state_dict(),
             q1func=q1func.state_dict(),
             q2func=q2func.state_dict(),
@@ -80,6 +163,8 @@ def td3(
             q2_targ=q2_targ.state_dict(),
         ),
     )
+    if save_replay and saved:
+        replay_saver.save(replay)
 
     # Setup and run policy tests
     ob, don = test_env.reset(), False
@@ -112,26 +197,36 @@ def td3(
         return np.clip(acts.numpy(), ac_space.low, ac_space.high)
 
     # Algorithm main loop
+    terminals = terminal_source(vec_env)
     obs1, ep_length, critic_updates = vec_env.reset(), 0, 0
-    for samples in trange(1, total_steps + 1, desc="Training", unit="step"):
+    for samples in trange(
+        start + n_envs, total_steps + 1, n_envs, desc="Training", unit="step"
+    ):
         if samples <= start_steps:
             actions = rand_uniform_actions
         else:
             actions = noisy_policy_actions
 
         acts = actions(obs1)
-        obs2, rews, dones, _ = vec_env.step(acts)
+        next_obs, rews, dones, _ = vec_env.step(acts)
         ep_length += 1
-        dones[0] = False if ep_length == max_ep_length else dones[0]
+        # Finished episodes transition into their true last observation, which
+        # is only terminal if they weren't cut short by a time limit
+        obs2, terms = next_obs, dones
+        if terminals is not None and dones.any():
+            obs2, terms = next_obs.copy(), dones & ~terminals.truncated
+            obs2[dones] = terminals.terminal_obs[dones]
 
-        as_tensors = map(torch.from_numpy, (obs1, acts, rews, obs2, dones.astype("f")))
-        for ob1, act, rew, ob2, done in zip(*as_tensors):
-            replay.store(ob1, act, rew, ob2, done)
-        obs1 = obs2
+        replay.store_batch(obs1, acts, rews, obs2, terms, resets=dones)
+        obs1 = next_obs
 
-        if (dones[0] or ep_length == max_ep_length) and replay.size >= mb_size:
-            for _ in range(int(ep_length * updates_per_step)):
-                ob_1, act_, rew_, ob_2, done_ = replay.sample(mb_size)
+        update_phase = dones.any() or ep_length == max_ep_length
+        if update_phase and replay.can_sample(mb_size):
+            n_updates = int(ep_length * n_envs * updates_per_step)
+            if prioritized:
+                replay.anneal_beta(samples / total_steps)
+            for ob_1, act_, rew_, ob_2, done_, *prio in sampler.batches(n_updates):
+                weights = prio[0] if prioritized else None
                 with torch.no_grad():
                     atarg = pi_targ(ob_2)
                     atarg += torch.clamp(
@@ -145,10 +240,12 @@ def td3(
                 qf_optim.zero_grad()
                 q1_val = q1func(ob_1, act_)
                 q2_val = q2func(ob_1, act_)
-                q1_loss = loss_fn(q1_val, targs).div(2)
-                q2_loss = loss_fn(q2_val, targs).div(2)
+                q1_loss = weighted_mse_loss(q1_val, targs, weights).div(2)
+                q2_loss = weighted_mse_loss(q2_val, targs, weights).div(2)
                 q1_loss.add(q2_loss).backward()
                 qf_optim.step()
+                if prioritized:
+                    sampler.update_priorities(prio[1], (q1_val - targs).detach())
 
                 critic_updates += 1
                 if critic_updates % policy_delay == 0:
@@ -170,16 +267,19 @@ def td3(
                 logger.logkv_mean("Q1Loss", q1_loss.item())
                 logger.logkv_mean("Q2Loss", q2_loss.item())
 
+        if update_phase:
             ep_length = 0
 
-        if samples % epoch == 0:
+        if samples % epoch < n_envs:
             test_policy()
             logger.logkv("Epoch", samples // epoch)
             logger.logkv("TotalNSamples", samples)
             log_reward_statistics(vec_env)
+            log_env_pool_statistics(vec_env)
+            logger.logkvs(sampler.get_stats())
             logger.dumpkvs()
 
-            saver.save_state(
+            saved = saver.save_state(
                 index=samples // epoch,
                 state=dict(
                     alg=dict(samples=samples),
@@ -193,3 +293,5 @@ def td3(
                     q2_targ=q2_targ.state_dict(),
                 ),
             )
+            if save_replay and saved:
+                replay_saver.save(replay)
@@ -26,6 +26,12 @@ def trpo(
     total_steps=TOTAL_STEPS_DEFAULT,
     steps=125,
     n_envs=16,
+    double_buffer=False,
+    env_backend="numpy",
+    pin_cpus=False,
+    tune_envs=False,
+    env_pool=None,
+    env_addresses=None,
     gamma=0.99,
     gaelam=0.97,
     kl_frac=1.0,
@@ -35,18 +41,51 @@ def trpo(
     linesearch=True,
     **saver_kwargs
 ):
+    """
+    Trust Region Policy Optimization
+
+    env: instance of proj.common.env_makers.VecEnvMaker
+    policy: instance of proj.common.models.Policy
+    val_fn (optional): instance of proj.common.models.ValueFunction
+    total_steps: total number of environment steps to take
+    steps: number of steps to take in each environment per iteration
+    n_envs: number of environment copies to run in parallel
+    double_buffer: whether to overlap policy inference and environment stepping
+    env_backend: either "numpy" or "torch" (tensors in, tensors out)
+    pin_cpus: whether to pin env workers and the learner to disjoint CPU sets
+    tune_envs: whether to auto-tune the number of env workers (cached per host)
+    env_pool (optional): name of the env pool to use (see VecEnvMaker)
+    env_addresses (optional): list of 'host:port' env servers to sample from
+    gamma: GAE discount parameter
+    gaelam: GAE lambda exponential average parameter
+    kl_frac: fraction of samples used in Fisher-vector products
+    delta: bound on the average KL divergence between successive policies
+    val_iters: number of optimization steps to update the critic per iteration
+    val_lr: learning rate for critic optimizer
+    linesearch: whether to backtrack until the KL constraint is satisfied
+    saver_kwargs: keyword arguments for proj.utils.saver.SnapshotSaver
+    """
     val_fn = val_fn or ValueFunction.from_policy(policy)
     logu.save_config(locals())
     saver = SnapshotSaver(logger.get_dir(), locals(), **saver_kwargs)
 
-    vec_env = VecEnvMaker(env)(n_envs)
+    vec_env = VecEnvMaker(env).on_policy(
+        n_envs,
+        backend=env_backend,
+        pin_cpus=pin_cpus,
+        tune=tune_envs,
+        pool=env_pool,
+        addresses=env_addresses,
+    )
     policy = policy.pop("class")(vec_env, **policy)
     val_fn = val_fn.pop("class")(vec_env, **val_fn)
     val_optim = torch.optim.Adam(val_fn.parameters(), lr=val_lr)
     loss_fn = torch.nn.MSELoss()
 
     # Algorithm main loop
-    collector = parallel_samples_collector(vec_env, policy, steps)
+    collector = parallel_samples_collector(
+        vec_env, policy, steps, double_buffer=double_buffer
+    )
     beg, end, stp = steps * n_envs, total_steps + steps * n_envs, steps * n_envs
     for samples in trange(beg, end, stp, desc="Training", unit="step"):
         logger.info("Starting iteration {}".format(samples // stp))
@@ -123,6 +162,7 @@ def trpo(
         logger.info("Logging information")
         logger.logkv("TotalNSamples", samples)
         logu.log_reward_statistics(vec_env)
+        logu.log_env_pool_statistics(vec_env)
         logu.log_val_fn_statistics(all_vals, all_rets)
         logu.log_action_distribution_statistics(old_dists)
         logu.log_average_kl_divergence(old_dists, policy, all_obs)
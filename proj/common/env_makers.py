@@ -1,15 +1,33 @@
 """
 Implements several factories for both single and vectorized environments.
 """
+
 import os
+import json
+import time
+import socket
+import tempfile
 import gym
 import numpy as np
+import torch
 from baselines import logger
 from baselines.common.atari_wrappers import make_atari, wrap_deepmind
 from baselines.common.vec_env.dummy_vec_env import DummyVecEnv as _DummyVecEnv
 from baselines.common.vec_env.vec_frame_stack import VecFrameStack
-from baselines.common.vec_env.vec_monitor import VecMonitor
-from proj.common.env_pool import EnvPool, ShmEnvPool
+from baselines.common.vec_env import VecEnvWrapper
+from baselines.common.vec_env.vec_monitor import VecMonitor as _VecMonitor
+from proj.common.env_pool import (
+    EnvPool,
+    ShmEnvPool,
+    ThreadVecEnv,
+    RemoteEnvPool,
+    allowed_cpus,
+    _zeros_leaves,
+    _nest_leaves,
+    _write_leaves,
+    _is_truncated,
+)
+from proj.envs import VEC_ENVS, TORCH_VEC_ENVS
 
 
 class EnvMaker:
@@ -45,29 +63,120 @@ class VecEnvMaker:
     """
     Used to store an environment id and apply the appropriate vectorized
     environment wrappers when constructing the vectorized environment.
+
+    With `backend="torch"`, the vectorized environment takes and returns
+    tensors (see proj.envs.torch_vec_env.TorchVecEnv), using a native PyTorch
+    implementation if available or falling back to converting the inputs and
+    outputs of the usual NumPy environments.
+
+    With `pin_cpus=True`, subprocess based pools pin their workers and the
+    learner to disjoint CPU sets (see proj.common.env_pool.cpu_placement).
+
+    With `tune=True`, the pool class and number of workers are chosen by
+    briefly timing a few candidates (see `calibrate_vec_env`). The winner is
+    cached on disk per host, environment id and number of environments and
+    reused in later runs.
+
+    `info_policy` is handed to subprocess based pools to choose which info
+    entries are sent back on each step (see proj.common.env_pool.EnvPool). The
+    environments of on-policy algorithms, made with `on_policy`, drop them.
+
+    Environments without a native vectorized implementation may be run with a
+    specific kind of pool by passing its name as `pool` (one of `POOLS`).
+    Otherwise, an EnvPool is used unless `tune=True`. If a list of `host:port`
+    `addresses` of env servers is given, a RemoteEnvPool is used instead.
     """
 
     def __init__(self, env_id):
         self.env_id = env_id
         self.__name__ = repr(self)
 
-    def __call__(self, n_envs=1, *, train=True):
+    def on_policy(self, n_envs, **kwargs):
+        """
+        Construct the vectorized environment of an on-policy algorithm. These
+        don't use infos, so pools drop them by default.
+        """
+        kwargs.setdefault("info_policy", "drop")
+        return self(n_envs, **kwargs)
+
+    def __call__(
+        self,
+        n_envs=1,
+        *,
+        train=True,
+        backend="numpy",
+        pin_cpus=False,
+        tune=False,
+        info_policy="full",
+        pool=None,
+        addresses=None,
+    ):
+        assert backend in ("numpy", "torch"), "Unknown backend: {}".format(backend)
         env_fn = EnvMaker(self.env_id)
 
-        if (
+        if backend == "torch" and self.env_id in TORCH_VEC_ENVS:
+            spec = gym.spec(self.env_id)
+            vec_env = TORCH_VEC_ENVS[self.env_id](
+                n_envs, max_episode_steps=spec.max_episode_steps, **spec._kwargs
+            )
+        elif self.env_id in VEC_ENVS:
+            spec = gym.spec(self.env_id)
+            vec_env = VEC_ENVS[self.env_id](
+                n_envs, max_episode_steps=spec.max_episode_steps, **spec._kwargs
+            )
+        elif (
             "AtariEnv" in gym.spec(self.env_id)._entry_point
             and "-ram-" not in self.env_id
         ):
-            if n_envs == 1:
+            if addresses:
+                vec_env = RemoteEnvPool(
+                    env_fn, addresses, n_envs=n_envs, info_policy=info_policy
+                )
+            elif n_envs == 1:
                 vec_env = DummyVecEnv([env_fn])
             else:
-                vec_env = ShmEnvPool(env_fn, n_envs=n_envs)
+                # VecFrameStack copies observations into its own buffer, so
+                # the pool may hand out views of its shared memory
+                n_parallel = None
+                if tune:
+                    _, n_parallel = tuned_vec_env(
+                        self.env_id, env_fn, n_envs, pools=("ShmEnvPool",)
+                    )
+                vec_env = ShmEnvPool(
+                    env_fn,
+                    n_envs=n_envs,
+                    n_parallel=n_parallel,
+                    copy_obs=False,
+                    pin_cpus=pin_cpus,
+                    info_policy=info_policy,
+                )
             vec_env = VecFrameStack(vec_env, 4)
         else:
-            if n_envs == 1:
+            if addresses:
+                vec_env = RemoteEnvPool(
+                    env_fn, addresses, n_envs=n_envs, info_policy=info_policy
+                )
+            elif n_envs == 1:
                 vec_env = DummyVecEnv([env_fn])
+            elif pool is not None or tune:
+                n_parallel = None
+                if pool is None:
+                    pool, n_parallel = tuned_vec_env(self.env_id, env_fn, n_envs)
+                vec_env = _make_vec_env(
+                    pool,
+                    env_fn,
+                    n_envs,
+                    n_parallel,
+                    pin_cpus=pin_cpus,
+                    info_policy=info_policy,
+                )
             else:
-                vec_env = EnvPool(env_fn, n_envs=n_envs)
+                vec_env = EnvPool(
+                    env_fn, n_envs=n_envs, pin_cpus=pin_cpus, info_policy=info_policy
+                )
+
+        if backend == "torch" and not getattr(vec_env, "torch_api", False):
+            vec_env = VecTorchAdapter(vec_env)
 
         monitor_dir = os.path.join(
             logger.get_dir(), ("train" if train else "eval") + "_monitor"
@@ -80,6 +189,106 @@ class VecEnvMaker:
         return "VecEnvMaker('{}')".format(self.env_id)
 
 
+# ==============================
+# Calibration
+# ==============================
+
+POOLS = ("DummyVecEnv", "EnvPool", "ShmEnvPool", "ThreadVecEnv")
+
+TUNING_CACHE = os.path.join(
+    os.path.expanduser("~"), ".cache", "deep-rl", "vec_env_tuning.json"
+)
+
+
+def tuned_vec_env(env_id, env_fn, n_envs, pools=POOLS):
+    """
+    Return the cached (pool class name, n_parallel) setting for this host,
+    environment id and number of environments, calibrating it if needed.
+    """
+    key = "{}:{}:{}".format(socket.gethostname(), env_id, n_envs)
+    cache = _read_tuning_cache()
+    if key not in cache or cache[key]["pool"] not in pools:
+        (pool, n_parallel), results = calibrate_vec_env(env_fn, n_envs, pools=pools)
+        setting = {
+            "pool": pool,
+            "n_parallel": n_parallel,
+            "envs_per_worker": -(-n_envs // n_parallel),
+            "steps_per_sec": results[(pool, n_parallel)],
+        }
+        # Other runs may have added their own settings while calibrating
+        cache = _read_tuning_cache()
+        cache[key] = setting
+        _write_tuning_cache(cache)
+    logger.info("Using vectorized environment setting {}".format(cache[key]))
+    return cache[key]["pool"], cache[key]["n_parallel"]
+
+
+def _read_tuning_cache():
+    # A missing or corrupt cache is treated as empty
+    try:
+        with open(TUNING_CACHE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_tuning_cache(cache):
+    # Write to a temporary file which atomically replaces the cache, so that
+    # concurrent runs never read a partially written one
+    os.makedirs(os.path.dirname(TUNING_CACHE), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(TUNING_CACHE))
+    with os.fdopen(fd, "wt") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, TUNING_CACHE)
+
+
+def calibrate_vec_env(env_fn, n_envs, pools=POOLS, steps=100):
+    """
+    Time the steps per second of `n_envs` environments for each pool class and
+    power of two number of workers up to the number of CPUs available.
+
+    :return: A tuple with the best (pool class name, n_parallel) pair and a
+        dict with the steps per second of each candidate.
+    """
+    max_parallel = min(n_envs, len(allowed_cpus()))
+    candidates = [("DummyVecEnv", 1)] if "DummyVecEnv" in pools else []
+    n_parallel = 1
+    while n_parallel <= max_parallel:
+        candidates += [(p, n_parallel) for p in pools if p != "DummyVecEnv"]
+        n_parallel *= 2
+
+    results = {}
+    for pool, n_parallel in candidates:
+        vec_env = _make_vec_env(pool, env_fn, n_envs, n_parallel)
+        try:
+            ac_space = vec_env.action_space
+            actions = np.stack([ac_space.sample() for _ in range(n_envs)])
+            vec_env.reset()
+            vec_env.step(actions)
+            start = time.time()
+            for _ in range(steps):
+                vec_env.step(actions)
+            results[(pool, n_parallel)] = steps * n_envs / (time.time() - start)
+        finally:
+            vec_env.close()
+        logger.info(
+            "{} with {} workers: {:.1f} steps/s".format(
+                pool, n_parallel, results[(pool, n_parallel)]
+            )
+        )
+    return max(results, key=results.get), results
+
+
+def _make_vec_env(pool, env_fn, n_envs, n_parallel, **kwargs):
+    assert pool in POOLS, "Unknown pool: {}".format(pool)
+    if pool == "DummyVecEnv":
+        return DummyVecEnv([env_fn] * n_envs)
+    if pool == "ThreadVecEnv":
+        return ThreadVecEnv(env_fn, n_envs=n_envs, n_parallel=n_parallel)
+    pool_cls = {"EnvPool": EnvPool, "ShmEnvPool": ShmEnvPool}[pool]
+    return pool_cls(env_fn, n_envs=n_envs, n_parallel=n_parallel, **kwargs)
+
+
 # ==============================
 # Reproducible DummyVecEnv
 # ==============================
@@ -89,16 +298,42 @@ class DummyVecEnv(_DummyVecEnv):
     """
     Extends baselines.common.vec_env.dummy_vec_env.DummyVecEnv to allow seeding
     and perform it on initialization. Plus, properly cleans up when closed.
+
+    Also keeps the true last observations of finished episodes and their time
+    limit flags in `terminal_obs` and `truncated`, like the pools of
+    proj.common.env_pool.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.terminal_leaves = _zeros_leaves(self.observation_space, self.num_envs)
+        self.truncated = np.zeros(self.num_envs, dtype=np.bool_)
         # set initial seeds
         seeds = np.random.randint(
             low=0, high=np.iinfo(np.int32).max, size=self.num_envs
         )
         self.seed(seeds)
 
+    def step_wait(self):
+        for e, env in enumerate(self.envs):
+            obs, rew, done, info = env.step(self.actions[e])
+            self.buf_rews[e], self.buf_dones[e], self.buf_infos[e] = rew, done, info
+            self.truncated[e] = done and _is_truncated(env, info)
+            if done:
+                _write_leaves(self.terminal_leaves, e, obs)
+                obs = env.reset()
+            self._save_obs(e, obs)
+        return (
+            self._obs_from_buf(),
+            np.copy(self.buf_rews),
+            np.copy(self.buf_dones),
+            self.buf_infos.copy(),
+        )
+
+    @property
+    def terminal_obs(self):
+        return _nest_leaves(self.observation_space, self.terminal_leaves)
+
     def seed(self, seeds):
         for env, seed in zip(self.envs, seeds):
             env.seed(int(seed))
@@ -108,6 +343,88 @@ class DummyVecEnv(_DummyVecEnv):
             env.close()
 
 
+# ==============================
+# Asynchronous VecMonitor
+# ==============================
+
+
+class VecMonitor(_VecMonitor):
+    """
+    Extends baselines.common.vec_env.vec_monitor.VecMonitor to also record the
+    episodes of environments stepped through the asynchronous `send`/`recv`
+    interface of proj.common.env_pool pools and of environments with the
+    tensor interface of proj.envs.torch_vec_env.TorchVecEnv.
+    """
+
+    def step_wait(self):
+        if not getattr(self.venv, "torch_api", False):
+            return super().step_wait()
+        obs, rews, dones, infos = self.venv.step_wait()
+        env_ids = np.arange(self.num_envs)
+        infos = self._record(env_ids, rews.numpy(), dones.numpy(), infos)
+        return obs, rews, dones, infos
+
+    def send(self, actions, env_ids=None):
+        assert not isinstance(
+            self.venv, VecEnvWrapper
+        ), "Asynchronous stepping is not supported through other wrappers"
+        self.venv.send(actions, env_ids)
+
+    def recv(self, min_ready=1):
+        env_ids, obs, rews, dones, infos = self.venv.recv(min_ready)
+        return env_ids, obs, rews, dones, self._record(env_ids, rews, dones, infos)
+
+    def _record(self, env_ids, rews, dones, infos):
+        self.eprets[env_ids] += rews
+        self.eplens[env_ids] += 1
+        newinfos = list(infos)
+        for idx, env_id in enumerate(env_ids):
+            if dones[idx]:
+                info = infos[idx].copy()
+                epinfo = {
+                    "r": self.eprets[env_id],
+                    "l": self.eplens[env_id],
+                    "t": round(time.time() - self.tstart, 6),
+                }
+                info["episode"] = epinfo
+                self.epcount += 1
+                self.eprets[env_id] = 0
+                self.eplens[env_id] = 0
+                if self.results_writer:
+                    self.results_writer.write_row(epinfo)
+                newinfos[idx] = info
+        return newinfos
+
+
+# ==============================
+# Torch backend fallback
+# ==============================
+
+
+class VecTorchAdapter(VecEnvWrapper):
+    """
+    Exposes the tensor interface of proj.envs.torch_vec_env.TorchVecEnv for
+    vectorized environments without a native PyTorch implementation.
+    """
+
+    torch_api = True
+
+    def reset(self):
+        return torch.as_tensor(self.venv.reset())
+
+    def step_async(self, actions):
+        self.venv.step_async(actions.numpy())
+
+    def step_wait(self):
+        obs, rews, dones, infos = self.venv.step_wait()
+        return (
+            torch.as_tensor(obs),
+            torch.as_tensor(rews),
+            torch.as_tensor(dones),
+            infos,
+        )
+
+
 # ==============================
 # Wrappers
 # ==============================
@@ -1,38 +1,420 @@
 """
 Vectorized environment wrappers.
 """
-import numpy as np
+
+import os
+import mmap
+import copy
+import glob
+import time
+import pickle
+import socket
+import ipaddress
+import tempfile
+import cloudpickle
 import multiprocessing as mp
-import ctypes
+import multiprocessing.connection
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from gym import spaces
+from baselines import logger
 from baselines.common.vec_env import VecEnv
 
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = resource_tracker = None
+
+# ==============================
+# CPU placement
+# ==============================
+
+_ALLOWED_CPUS = None
+_LEARNER_PINNED = False
+
+
+def allowed_cpus():
+    """
+    CPUs this process was allowed to run on before any pinning, grouped by NUMA
+    node so that contiguous chunks of the list stay within a node. Platforms
+    without CPU affinity (e.g., macOS) report all of their CPUs.
+    """
+    global _ALLOWED_CPUS
+    if _ALLOWED_CPUS is None:
+        if hasattr(os, "sched_getaffinity"):
+            cpus = os.sched_getaffinity(0)
+        else:
+            cpus = set(range(os.cpu_count() or 1))
+        nodes = []
+        for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+            with open(path) as file:
+                node_cpus = [c for c in _parse_cpulist(file.read()) if c in cpus]
+            if node_cpus:
+                nodes.append(node_cpus)
+        ordered = [c for node in nodes for c in node]
+        _ALLOWED_CPUS = ordered + sorted(cpus.difference(ordered))
+    return _ALLOWED_CPUS
+
+
+def _parse_cpulist(cpulist):
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if part:
+            beg, _, end = part.partition("-")
+            cpus.extend(range(int(beg), int(end or beg) + 1))
+    return cpus
+
+
+def cpu_placement(n_workers, learner_threads):
+    """
+    Split the allowed CPUs between the learner's intra-op threads and
+    `n_workers` environment workers, giving each worker its own core set when
+    there are enough cores.
+
+    :return: A tuple with the learner's CPUs and a list with each worker's.
+    """
+    cpus = allowed_cpus()
+    learner_threads = min(learner_threads, max(len(cpus) - n_workers, 1))
+    learner_cpus, worker_pool = cpus[:learner_threads], cpus[learner_threads:]
+    worker_pool = worker_pool or cpus
+    if len(worker_pool) >= n_workers:
+        worker_cpus = [c.tolist() for c in np.array_split(worker_pool, n_workers)]
+    else:
+        worker_cpus = [[worker_pool[i % len(worker_pool)]] for i in range(n_workers)]
+    return learner_cpus, worker_cpus
+
+
+def _worker_cpus(pin_cpus, n_workers):
+    """
+    Learner and worker CPUs for a pool of `n_workers`. Unpinned workers are
+    left alone (None), unless an earlier pool pinned the learner, in which case
+    they are given back all the CPUs it would pass on to forks.
+    """
+    if pin_cpus:
+        assert hasattr(os, "sched_setaffinity"), "Can't pin CPUs on this platform"
+    learner_cpus, worker_cpus = cpu_placement(n_workers, torch.get_num_threads())
+    if not pin_cpus:
+        worker_cpus = [allowed_cpus() if _LEARNER_PINNED else None] * n_workers
+    return learner_cpus, worker_cpus
+
+
+def _pin_learner(learner_cpus, worker_cpus):
+    global _LEARNER_PINNED
+    _LEARNER_PINNED = True
+    os.sched_setaffinity(0, learner_cpus)
+    torch.set_num_threads(len(learner_cpus))
+    logger.info("Learner pinned to CPUs {}".format(learner_cpus))
+    for idx, cpus in enumerate(worker_cpus):
+        logger.info("Env worker {} pinned to CPUs {}".format(idx, cpus))
+
+
+# ==============================
+# Info policies
+# ==============================
+
+
+def _info_keys(info_policy):
+    """
+    Normalize an info policy: "full" pickles whole info dicts (no key filter),
+    "drop" discards them (no keys) and a sequence of keys keeps only those
+    numeric entries.
+    """
+    if info_policy == "full":
+        return None
+    if info_policy == "drop":
+        return ()
+    return tuple(info_policy)
+
+
+def _encode_info(info, info_keys):
+    if info_keys is None:
+        return info
+    if not info_keys:
+        return None
+    return [float(info.get(key, np.nan)) for key in info_keys]
+
+
+def _decode_infos(infos, info_keys):
+    """Rebuild info dicts from encoded ones, omitting the missing keys."""
+    if info_keys is None:
+        return tuple(infos)
+    if not info_keys:
+        return tuple({} for _ in infos)
+    return tuple(
+        {key: val for key, val in zip(info_keys, row) if not np.isnan(val)}
+        for row in infos
+    )
+
+
+def _is_truncated(env, info):
+    """
+    Whether the episode `env` just finished ended because of a time limit (see
+    gym's TimeLimit). Versions of gym which don't flag it in `info` (e.g., 0.12)
+    are handled by comparing the step count of the innermost wrapper keeping
+    one with its limit, which can't tell episodes also ending on their own on
+    the last step apart.
+    """
+    if "TimeLimit.truncated" in info:
+        return bool(info["TimeLimit.truncated"])
+    while env is not None:
+        max_steps = getattr(env, "_max_episode_steps", None)
+        if max_steps is not None:
+            return (getattr(env, "_elapsed_steps", None) or 0) >= max_steps
+        env = getattr(env, "env", None)
+    return False
+
+
+# ==============================
+# Telemetry
+# ==============================
+
+STEP, RESET = 0, 1
+
+
+class EnvStats:
+    """
+    Histograms of each environment's step and reset latencies (8 log-spaced
+    bins per decade between 1us and 10s) along with each worker's busy time,
+    kept in shared memory so that workers can record them without messaging.
+    """
+
+    BIN_EDGES = np.logspace(-6, 1, 57)
+
+    def __init__(self, n_envs, n_workers):
+        self.hist_buf = _ShmArray((n_envs, 2, len(self.BIN_EDGES) + 1), np.int64)
+        self.time_buf = _ShmArray((n_envs, 2), np.float64)
+        self.busy_buf = _ShmArray((n_workers,), np.float64)
+        self._last = (0, 0, 0, time.perf_counter())
+
+    def for_worker(self, widx, env_slice):
+        stats = copy.copy(self)
+        stats.widx, stats.env_slice = widx, env_slice
+        return stats
+
+    def attach(self):
+        """Called in a worker before recording its environments' latencies."""
+        self.hist = self.hist_buf.view()[self.env_slice]
+        self.time = self.time_buf.view()[self.env_slice]
+        self.busy = self.busy_buf.view()
+        return self
+
+    def record(self, idx, kind, duration):
+        self.hist[idx, kind, np.searchsorted(self.BIN_EDGES, duration)] += 1
+        self.time[idx, kind] += duration
+
+    def record_busy(self, duration):
+        self.busy[self.widx] += duration
+
+    def unlink(self):
+        for buf in (self.hist_buf, self.time_buf, self.busy_buf):
+            buf.unlink()
+
+    def summary(self):
+        """
+        Statistics since the previous call (or since creation): step and reset
+        latency percentiles, the average fraction of time workers were idle and
+        the environment with the highest mean step latency (the straggler),
+        along with the ratio between its mean and the median env's mean.
+        """
+        current = (
+            self.hist_buf.view().copy(),
+            self.time_buf.view().copy(),
+            self.busy_buf.view().copy(),
+            time.perf_counter(),
+        )
+        hist, times, busy, elapsed = (c - l for c, l in zip(current, self._last))
+        self._last = current
+
+        counts = hist.sum(-1)
+        means = times[:, STEP] / np.maximum(counts[:, STEP], 1)
+        straggler = int(np.argmax(means))
+        return {
+            "EnvStepP50": self._percentile(hist[:, STEP], 0.5),
+            "EnvStepP99": self._percentile(hist[:, STEP], 0.99),
+            "EnvResetP50": self._percentile(hist[:, RESET], 0.5),
+            "EnvResetP99": self._percentile(hist[:, RESET], 0.99),
+            "WorkerIdleFrac": float(np.mean(1 - busy / max(elapsed, 1e-8))),
+            "StragglerEnv": straggler,
+            "StragglerRatio": float(means[straggler] / max(np.median(means), 1e-8)),
+        }
+
+    def _percentile(self, hist, q):
+        cum = np.cumsum(hist.sum(0))
+        if cum[-1] == 0:
+            return float("nan")
+        # Report the upper edge of the bin in which the percentile falls
+        idx = np.searchsorted(cum, q * cum[-1])
+        return float(self.BIN_EDGES[min(idx, len(self.BIN_EDGES) - 1)])
+
+
+# ==============================
+# Pre-forked workers
+# ==============================
+
+_WORKER_SERVER = None
+
+
+def start_worker_server(n_workers=0, preload=("gym", "baselines", "proj.envs")):
+    """
+    Start a forkserver which imports `preload` once and have the env pools of
+    this process take their workers from a set of persistent processes forked
+    from it, instead of forking the learner for each pool. Workers go back to
+    the set when their pool is closed, and `n_workers` of them are started
+    right away. Environment makers must be picklable.
+
+    The server imports `preload` (and PyTorch) anew, which takes seconds, so
+    this only pays off for processes creating many pools, e.g., when
+    calibrating with `proj.common.env_makers.calibrate_vec_env`.
+    """
+    global _WORKER_SERVER
+    if _WORKER_SERVER is None:
+        _WORKER_SERVER = _WorkerServer(preload)
+    _WORKER_SERVER.idle.extend(
+        _PreforkedProcess(_WORKER_SERVER.ctx) for _ in range(n_workers)
+    )
+
+
+class _WorkerServer:
+    def __init__(self, preload):
+        self.ctx = mp.get_context("forkserver")
+        self.ctx.set_forkserver_preload(list(preload))
+        self.idle = []
+
+    def acquire(self):
+        while self.idle:
+            worker = self.idle.pop()
+            if worker.is_alive():
+                return worker
+        return _PreforkedProcess(self.ctx)
+
+
+class _PreforkedProcess:
+    """
+    Persistent process which runs one worker loop at a time, exposing the parts
+    of the mp.Process interface used by the env pools.
+    """
 
-def env_worker(env_maker, conn, n_envs):
+    def __init__(self, ctx):
+        self.conn, worker_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_preforked_worker, args=(worker_conn,))
+        self.process.daemon = True
+        self.process.start()
+        worker_conn.close()
+        self.running = False
+
+    def run(self, target, args):
+        self.conn.send((target, args))
+        self.running = True
+
+    def join(self):
+        # Wait for the worker loop to return and hand the process back
+        if self.running:
+            try:
+                self.conn.recv()
+            except EOFError:
+                self.process.join()
+                return
+            self.running = False
+            _WORKER_SERVER.idle.append(self)
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        self.process.terminate()
+
+    def kill(self):
+        self.process.kill()
+
+
+def _preforked_worker(conn):
+    cpus = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    try:
+        while True:
+            target, args = conn.recv()
+            target(*args)
+            # The worker loop may have pinned this process
+            if cpus is not None and os.sched_getaffinity(0) != cpus:
+                os.sched_setaffinity(0, cpus)
+            conn.send(None)
+    except (EOFError, KeyboardInterrupt):
+        pass
+
+
+def _start_process(target, args):
+    if _WORKER_SERVER is not None:
+        worker = _WORKER_SERVER.acquire()
+        worker.run(target, args)
+    else:
+        worker = mp.Process(target=target, args=args)
+        worker.daemon = True
+        worker.start()
+    return worker
+
+
+# ==============================
+# Pipe based pool
+# ==============================
+
+
+def env_worker(env_maker, conn, n_envs, stats, cpus=None, info_keys=None):
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
     envs = [env_maker() for _ in range(n_envs)]
+    stats = stats.attach()
+
+    def _reset(idx):
+        start = time.perf_counter()
+        ob = envs[idx].reset()
+        stats.record(idx, RESET, time.perf_counter() - start)
+        return ob
+
+    def _step(idxs, actions):
+        results = []
+        for idx, action in zip(idxs, actions):
+            start = time.perf_counter()
+            next_ob, rew, done, info = envs[idx].step(action)
+            stats.record(idx, STEP, time.perf_counter() - start)
+            terminal = None
+            if done:
+                # The true last observation is sent along with the reset one
+                terminal = (next_ob, _is_truncated(envs[idx], info))
+                next_ob = _reset(idx)
+            info = _encode_info(info, info_keys)
+            results.append((next_ob, rew, done, info, terminal))
+        return results
+
     try:
         while True:
             command, data = conn.recv()
+            start = time.perf_counter()
             if command == "reset":
-                conn.send([env.reset() for env in envs])
+                conn.send([_reset(idx) for idx in range(n_envs)])
             elif command == "seed":
                 for env, seed in zip(envs, data):
                     env.seed(int(seed))
             elif command == "step":
-                results = []
-                for env, action in zip(envs, data):
-                    next_ob, rew, done, info = env.step(action)
-                    if done:
-                        next_ob = env.reset()
-                    results.append((next_ob, rew, done, info))
-                conn.send(results)
+                conn.send(_step(range(n_envs), data))
+            elif command == "step_subset":
+                conn.send(_step(*data))
             elif command == "get_spaces":
                 conn.send((envs[0].observation_space, envs[0].action_space))
             elif command == "render":
                 conn.send([env.render(mode="rgb_array") for env in envs])
+            elif command == "attach_frames":
+                frames_buf, frames_slice = data
+                frames = frames_buf.view()[frames_slice]
+            elif command == "render_shared":
+                for idx, env in enumerate(envs):
+                    frames[idx] = env.render(mode="rgb_array")
+                conn.send(None)
             elif command == "close":
                 break
             else:
                 raise ValueError("Unrecognized command: {}".format(command))
+            stats.record_busy(time.perf_counter() - start)
     except KeyboardInterrupt:
         print("EnvPool worker: got KeyboardInterrupt")
     finally:
@@ -41,16 +423,111 @@ def env_worker(env_maker, conn, n_envs):
             env.close()
 
 
-class EnvPool(VecEnv):
+class _SupervisedPool:
+    """
+    Restarts the dead or hung workers of a pool. Pools keep their `workers`,
+    the `conns` to them, the last of the `commands` sent to each, a `timeout`
+    and the count of `n_restarts`, and implement `_start_worker(widx)`, which
+    (re)starts a worker, and `_restart_results(widx, idxs)`, which resets a
+    restarted worker and returns stand-in results of stepping its (local)
+    environments `idxs`.
+    """
+
+    def _send(self, widx, command, data):
+        self.commands[widx] = (command, data)
+        try:
+            self.conns[widx].send((command, data))
+        except (BrokenPipeError, ConnectionResetError):
+            # The worker is dead, which is handled when receiving its reply
+            pass
+
+    def _recv(self, widx):
+        conn = self.conns[widx]
+        try:
+            if conn.poll(self.timeout):
+                return conn.recv()
+        except (EOFError, ConnectionResetError):
+            pass
+        return self._respawn(widx)
+
+    def _respawn(self, widx):
+        """
+        Replace a dead or hung worker with a freshly seeded one and return a
+        stand-in for the reply to its last command.
+        """
+        command, data = self.commands[widx]
+        self.workers[widx].terminate()
+        self.workers[widx].join()
+        self.conns[widx].close()
+        self.n_restarts += 1
+        logger.warn(
+            "{} worker {} died or hung while running '{}', restarting it "
+            "({} restarts so far)".format(
+                type(self).__name__, widx, command, self.n_restarts
+            )
+        )
+
+        self._start_worker(widx)
+        num_envs = self.worker_env_seps[widx + 1] - self.worker_env_seps[widx]
+        seeds = np.random.randint(low=0, high=np.iinfo(np.int32).max, size=num_envs)
+        self._send(widx, "seed", seeds)
+        if command == "step":
+            return self._restart_results(widx, range(num_envs))
+        if command == "step_subset":
+            # Local ids of the stepped environments, maybe along with actions
+            idxs = data[0] if isinstance(data, tuple) else data
+            return self._restart_results(widx, idxs)
+        self._send(widx, command, data)
+        return self._recv(widx)
+
+
+class EnvPool(_SupervisedPool, VecEnv):
     """
     Uses a pool of workers to run multiple environments in parallel using
     mp.Pipe (pickles data). This implementation supports multiple environments
     per worker to be as flexible as possible.
+
+    Besides the synchronous VecEnv interface, environments may be stepped
+    asynchronously with `send(actions, env_ids)` and `recv(min_ready)`, which
+    returns results as soon as the workers of at least `min_ready` environments
+    are done. Note that wrappers (e.g., VecMonitor) are bypassed in this case.
+
+    If `pin_cpus` is True (Linux only), each worker is pinned to its own set of
+    cores and the learner process (along with PyTorch's intra-op threads) to a
+    disjoint set, as computed by `cpu_placement`. Otherwise, CPU affinity is
+    left alone, except that workers may run on any of the `allowed_cpus` even
+    if an earlier pool pinned the learner.
+
+    Workers which die (or, if `timeout` is given, don't reply within `timeout`
+    seconds) are restarted with a fresh seed. Their pending environments are
+    reported as done, with a "worker_restart" info flag, and the number of
+    restarts so far is kept in `n_restarts`.
+
+    `info_policy` controls how the info dicts of each step are transported:
+    "full" pickles them whole, "drop" returns empty dicts and a sequence of
+    keys only sends those (numeric) entries, packed as floats.
+
+    After the first call to `get_images`, which learns the frame shape, workers
+    render into a shared (n_envs, H, W, 3) block and a read-only view of it is
+    returned, which is only valid until the next call.
+
+    Since finished episodes are reset right away, the true last observation of
+    each environment whose episode ended on its last step is kept in
+    `terminal_obs`, and whether it was cut short by a time limit in `truncated`
+    (both indexed by environment id), so that collectors can bootstrap from it.
     """
 
-    def __init__(self, env_maker, n_envs=None, n_parallel=None):
+    def __init__(
+        self,
+        env_maker,
+        n_envs=None,
+        n_parallel=None,
+        pin_cpus=False,
+        timeout=None,
+        info_policy="full",
+    ):
         n_envs = n_envs or mp.cpu_count()
-        n_parallel = n_parallel or mp.cpu_count() / 2
+        n_parallel = n_parallel or max(len(allowed_cpus()) // 2, 1)
         # No point in having more parallel workers than environments
         self.n_parallel = n_envs if n_parallel > n_envs else n_parallel
         # try to split evenly, but this isn't always possible
@@ -58,23 +535,33 @@ class EnvPool(VecEnv):
             len(d) for d in np.array_split(np.arange(n_envs), self.n_parallel)
         ]
         self.worker_env_seps = np.concatenate([[0], np.cumsum(num_worker_envs)])
+        self.env_workers = np.repeat(np.arange(len(num_worker_envs)), num_worker_envs)
 
-        self.workers, self.conns = [], []
-        for num_envs in self.worker_env_seps[1:] - self.worker_env_seps[:-1]:
-            worker_conn, master_conn = mp.Pipe()
-            worker = mp.Process(
-                target=env_worker, args=(env_maker, worker_conn, num_envs)
-            )
-            worker.daemon = True
-            worker.start()
-            self.workers.append(worker)
-            self.conns.append(master_conn)
+        learner_cpus, worker_cpus = _worker_cpus(pin_cpus, len(num_worker_envs))
+        if resource_tracker is not None:
+            resource_tracker.ensure_running()
+
+        self.env_maker, self.worker_cpus, self.timeout = env_maker, worker_cpus, timeout
+        self.workers = [None] * len(num_worker_envs)
+        self.conns = [None] * len(num_worker_envs)
+        self.commands = [None] * len(num_worker_envs)
+        self.n_restarts = 0
+        self.stats = EnvStats(n_envs, len(num_worker_envs))
+        self.info_keys = _info_keys(info_policy)
+        self.frames_buf = None
+        for widx in range(len(num_worker_envs)):
+            self._start_worker(widx)
+        if pin_cpus:
+            _pin_learner(learner_cpus, worker_cpus)
 
-        self.conns[0].send(("get_spaces", None))
-        ob_space, ac_space = self.conns[0].recv()
+        self._send(0, "get_spaces", None)
+        ob_space, ac_space = self._recv(0)
         super().__init__(n_envs, ob_space, ac_space)
+        self.terminal_leaves = _zeros_leaves(ob_space, n_envs)
+        self.truncated = np.zeros(n_envs, dtype=np.bool_)
 
         self.waiting = False
+        self.pending = {}
         self.closed = False
 
         # set initial seeds
@@ -85,96 +572,411 @@ class EnvPool(VecEnv):
         assert not self.closed
         if self.waiting:
             self.step_wait()
-        for conn in self.conns:
-            conn.send(("reset", None))
+        if self.pending:
+            self.recv(min_ready=self.num_envs)
+        for widx in range(len(self.conns)):
+            self._send(widx, "reset", None)
         obs = []
-        for conn in self.conns:
-            obs.extend(conn.recv())
-        return np.stack(obs)
+        for widx in range(len(self.conns)):
+            obs.extend(self._recv(widx))
+        return _stack_obs(self.observation_space, obs)
 
     def step_async(self, actions):
-        assert not self.waiting and not self.closed
-        for conn, acts in zip(
-            self.conns, np.split(actions, self.worker_env_seps[1:-1])
-        ):
-            conn.send(("step", acts))
+        assert not self.waiting and not self.pending and not self.closed
+        for widx, acts in enumerate(np.split(actions, self.worker_env_seps[1:-1])):
+            self._send(widx, "step", acts)
         self.waiting = True
 
     def step_wait(self):
         assert self.waiting and not self.closed
         results = []
-        for conn in self.conns:
-            results.extend(conn.recv())
-        next_obs, rews, dones, infos = zip(*results)
+        for widx in range(len(self.conns)):
+            results.extend(self._recv(widx))
+        next_obs, rews, dones, infos, terminals = zip(*results)
         self.waiting = False
-        return np.stack(next_obs), np.stack(rews), np.stack(dones), infos
+        self._set_terminals(np.arange(self.num_envs), terminals)
+        infos = _decode_infos(infos, self.info_keys)
+        return (
+            _stack_obs(self.observation_space, next_obs),
+            np.stack(rews),
+            np.stack(dones),
+            infos,
+        )
 
-    def seed(self, seeds):
+    def send(self, actions, env_ids=None):
+        """
+        Start stepping the given environments (all by default) without waiting.
+        The environments of a worker can't be sent new actions until their
+        previous results are received.
+        """
         assert not self.waiting and not self.closed
-        for conn, data in zip(self.conns, np.split(seeds, self.worker_env_seps[1:-1])):
-            conn.send(("seed", data))
+        env_ids, worker_ids = _split_env_ids(self, env_ids)
+        for widx in np.unique(worker_ids):
+            ids = env_ids[worker_ids == widx]
+            acts = actions[worker_ids == widx]
+            local_ids = ids - self.worker_env_seps[widx]
+            self._send(widx, "step_subset", (local_ids, acts))
+            self.pending[widx] = ids
+
+    def recv(self, min_ready=1):
+        """
+        Wait until at least `min_ready` of the sent environments are done
+        stepping, returning the ids of all that are ready and their results.
+        """
+        assert self.pending and not self.closed
+        env_ids, results = [], []
+        for ids, worker_results in _wait_ready(self, min_ready):
+            env_ids.append(ids)
+            results.extend(worker_results)
+        env_ids = np.concatenate(env_ids)
+        next_obs, rews, dones, infos, terminals = zip(*results)
+        self._set_terminals(env_ids, terminals)
+        return (
+            env_ids,
+            _stack_obs(self.observation_space, next_obs),
+            np.stack(rews),
+            np.stack(dones),
+            _decode_infos(infos, self.info_keys),
+        )
+
+    def seed(self, seeds):
+        assert not self.waiting and not self.pending and not self.closed
+        for widx, data in enumerate(np.split(seeds, self.worker_env_seps[1:-1])):
+            self._send(widx, "seed", data)
 
     def close_extras(self):
         if self.waiting:
             self.step_wait()
-        for conn in self.conns:
-            conn.send(("close", None))
+        if self.pending:
+            self.recv(min_ready=self.num_envs)
+        for widx, conn in enumerate(self.conns):
+            self._send(widx, "close", None)
             conn.close()
         for worker in self.workers:
             worker.join()
+        self.stats.unlink()
+        if self.frames_buf is not None:
+            self.frames_buf.unlink()
 
     def get_images(self):
-        assert not self.waiting and not self.closed
-        for conn in self.conns:
-            conn.send(("render", None))
-        imgs = []
-        for conn in self.conns:
-            imgs.extend(conn.recv())
-        return imgs
+        assert not self.waiting and not self.pending and not self.closed
+        if self.frames_buf is None:
+            for widx in range(len(self.conns)):
+                self._send(widx, "render", None)
+            imgs = []
+            for widx in range(len(self.conns)):
+                imgs.extend(self._recv(widx))
+            self.frames_buf = _ShmArray((self.num_envs,) + imgs[0].shape, np.uint8)
+            for widx in range(len(self.conns)):
+                self._attach_frames(widx)
+            return imgs
 
+        for widx in range(len(self.conns)):
+            self._send(widx, "render_shared", None)
+        for widx in range(len(self.conns)):
+            self._recv(widx)
+        frames = self.frames_buf.view()
+        frames.flags.writeable = False
+        return frames
 
-_NP_TO_CT = {
-    np.float32: ctypes.c_float,
-    np.int32: ctypes.c_int32,
-    np.int8: ctypes.c_int8,
-    np.uint8: ctypes.c_char,
-    np.bool: ctypes.c_bool,
-}
+    def get_stats(self):
+        """
+        Environment latency and worker utilization statistics since the last
+        call (see `EnvStats.summary`), plus the number of worker restarts.
+        """
+        return {**self.stats.summary(), "EnvRestarts": self.n_restarts}
 
+    @property
+    def terminal_obs(self):
+        return _nest_leaves(self.observation_space, self.terminal_leaves)
 
-def shm_worker(env_maker, conn, n_envs, obs_bufs, obs_shape, obs_dtype):
-    envs = [env_maker() for _ in range(n_envs)]
+    def _set_terminals(self, env_ids, terminals):
+        self.truncated[env_ids] = False
+        for env_id, terminal in zip(env_ids, terminals):
+            if terminal is not None:
+                ob, self.truncated[env_id] = terminal
+                _write_leaves(self.terminal_leaves, env_id, ob)
+
+    def _start_worker(self, widx):
+        beg, end = self.worker_env_seps[widx], self.worker_env_seps[widx + 1]
+        worker_conn, master_conn = mp.Pipe()
+        worker = _start_process(
+            env_worker,
+            (
+                self.env_maker,
+                worker_conn,
+                end - beg,
+                self.stats.for_worker(widx, slice(beg, end)),
+                self.worker_cpus[widx],
+                self.info_keys,
+            ),
+        )
+        # Only the worker should hold its end, so that we get EOF if it dies
+        worker_conn.close()
+        self.workers[widx], self.conns[widx] = worker, master_conn
+        if self.frames_buf is not None:
+            self._attach_frames(widx)
+
+    def _attach_frames(self, widx):
+        beg, end = self.worker_env_seps[widx], self.worker_env_seps[widx + 1]
+        self._send(widx, "attach_frames", (self.frames_buf, slice(beg, end)))
+
+    def _restart_results(self, widx, idxs):
+        self._send(widx, "reset", None)
+        obs = self._recv(widx)
+        info = _encode_info({"worker_restart": True}, self.info_keys)
+        # The true last observations are lost, so there's no bootstrapping
+        return [(obs[idx], 0.0, True, info, (obs[idx], False)) for idx in idxs]
+
+
+def _split_env_ids(pool, env_ids):
+    env_ids = np.arange(pool.num_envs) if env_ids is None else np.asarray(env_ids)
+    worker_ids = pool.env_workers[env_ids]
+    assert len(np.unique(env_ids)) == len(env_ids), "Repeated environment ids"
+    assert not any(
+        widx in pool.pending for widx in worker_ids
+    ), "Some environments are still stepping"
+    return env_ids, worker_ids
+
+
+def _wait_ready(pool, min_ready):
+    """
+    Collect the replies of pending workers as they arrive until those of at
+    least `min_ready` environments (or all pending) have been received.
+    """
+    min_ready = min(min_ready, sum(len(ids) for ids in pool.pending.values()))
+    timeout = getattr(pool, "timeout", None)
+    n_ready = 0
+    while n_ready < min_ready:
+        conns = [pool.conns[widx] for widx in pool.pending]
+        ready = mp.connection.wait(conns, timeout)
+        for conn in ready or conns:
+            widx = pool.conns.index(conn)
+            ids = pool.pending.pop(widx)
+            n_ready += len(ids)
+            if not ready:
+                # None of the pending workers replied in time
+                yield ids, pool._respawn(widx)
+            else:
+                yield ids, pool._recv(widx)
+
+
+# ==============================
+# Shared memory pool
+# ==============================
+
+
+class _ShmArray:
+    """
+    Named shared memory block which can be handed to worker processes, either
+    when starting them or later through their pipes, and viewed as a numpy
+    array of fixed shape and dtype on both ends. Pools start the resource
+    tracker before their workers, so that the latter share it and don't report
+    the block as leaked when they exit.
+
+    Before Python 3.8, which lacks multiprocessing.shared_memory, the block is
+    a file in /dev/shm (or the temporary folder) mapped by each process.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shm, self.path = None, None
+        if shared_memory is not None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            folder = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            fd, self.path = tempfile.mkstemp(dir=folder)
+            os.ftruncate(fd, size)
+            os.close(fd)
+        self._mmap = None
+
+    def __getstate__(self):
+        # Each process maps the file on its own
+        return {**self.__dict__, "_mmap": None}
 
-    def _write_obs(obs):
-        for ob, obs_buf in zip(obs, obs_bufs):
-            dst = obs_buf.get_obj()
-            dst_np = np.frombuffer(dst, dtype=obs_dtype).reshape(obs_shape)
-            np.copyto(dst_np, ob)
+    def view(self):
+        if self.shm is not None:
+            return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        if self._mmap is None:
+            with open(self.path, "r+b") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._mmap)
+
+    def unlink(self):
+        # Views may still be around, so the block is only unmapped once they
+        # are garbage collected
+        if self.shm is not None:
+            self.shm.unlink()
+        else:
+            os.unlink(self.path)
+
+
+def _leaf_spaces(space, path=()):
+    """
+    Yield the path (sequence of keys/indices) and space of each leaf of a
+    possibly nested Dict or Tuple space. A flat space is its own leaf.
+    """
+    if isinstance(space, spaces.Dict):
+        for key, subspace in space.spaces.items():
+            yield from _leaf_spaces(subspace, path + (key,))
+    elif isinstance(space, spaces.Tuple):
+        for idx, subspace in enumerate(space.spaces):
+            yield from _leaf_spaces(subspace, path + (idx,))
+    else:
+        yield path, space
+
+
+def _nest_leaves(space, leaves, path=()):
+    """
+    Inverse of `_leaf_spaces`, rebuilding the structure of `space` from a dict
+    of leaf paths to values.
+    """
+    if isinstance(space, spaces.Dict):
+        return OrderedDict(
+            (key, _nest_leaves(subspace, leaves, path + (key,)))
+            for key, subspace in space.spaces.items()
+        )
+    if isinstance(space, spaces.Tuple):
+        return tuple(
+            _nest_leaves(subspace, leaves, path + (idx,))
+            for idx, subspace in enumerate(space.spaces)
+        )
+    return leaves[path]
+
+
+def _zeros_leaves(space, n):
+    """Zeroed (n, *shape) arrays for each leaf of `space`, by leaf path."""
+    return OrderedDict(
+        (path, np.zeros((n,) + subspace.shape, subspace.dtype))
+        for path, subspace in _leaf_spaces(space)
+    )
+
+
+def _write_leaves(leaves, idx, ob):
+    """Write each leaf of observation `ob` at index `idx` of its array."""
+    for path, arr in leaves.items():
+        leaf = ob
+        for key in path:
+            leaf = leaf[key]
+        arr[idx] = leaf
+
+
+def _stack_obs(space, obs):
+    """Stack a sequence of (possibly nested) observations leaf by leaf."""
+    leaves = _zeros_leaves(space, len(obs))
+    for idx, ob in enumerate(obs):
+        _write_leaves(leaves, idx, ob)
+    return _nest_leaves(space, leaves)
+
+
+def shm_worker(
+    env_maker,
+    conn,
+    env_slice,
+    obs_bufs,
+    terminal_bufs,
+    stats,
+    step_bufs=None,
+    cpus=None,
+    info_keys=None,
+    infos_buf=None,
+):
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    envs = [env_maker() for _ in range(env_slice.stop - env_slice.start)]
+    stats = stats.attach()
+    # This worker's environments write (each leaf of) their observations in
+    # place into their slice of the shared observation blocks
+    obs_nps = [(path, buf.view()[env_slice]) for path, buf in obs_bufs.items()]
+    # So do the true last observations of finished episodes, before their
+    # reset, along with their time limit flags
+    terminal_obs_bufs, truncated_buf = terminal_bufs
+    terminal_nps = [
+        (path, buf.view()[env_slice]) for path, buf in terminal_obs_bufs.items()
+    ]
+    truncated_np = truncated_buf.view()[env_slice]
+    # Whitelisted info entries are written into their shared block as well
+    infos_np = infos_buf.view()[env_slice] if infos_buf is not None else None
+
+    def _write_ob(idx, ob, nps=obs_nps):
+        for path, obs_np in nps:
+            leaf = ob
+            for key in path:
+                leaf = leaf[key]
+            obs_np[idx] = leaf
+
+    def _reset(idx):
+        start = time.perf_counter()
+        _write_ob(idx, envs[idx].reset())
+        stats.record(idx, RESET, time.perf_counter() - start)
+
+    def _step(idxs, actions):
+        results = []
+        for idx, action in zip(idxs, actions):
+            start = time.perf_counter()
+            ob, rew, done, info = envs[idx].step(action)
+            stats.record(idx, STEP, time.perf_counter() - start)
+            truncated_np[idx] = done and _is_truncated(envs[idx], info)
+            if done:
+                _write_ob(idx, ob, terminal_nps)
+                _reset(idx)
+            else:
+                _write_ob(idx, ob)
+            info = _encode_info(info, info_keys)
+            if infos_np is not None:
+                infos_np[idx], info = info, None
+            results.append((rew, done, info))
+        if step_bufs is None:
+            return results
+        rews, dones, infos = zip(*results)
+        rews_np[idxs], dones_np[idxs] = rews, dones
+        # Only pay for pickling infos when some env reported any
+        return infos if any(infos) else None
+
+    if step_bufs is not None:
+        # Actions are read from and rewards and dones written to this worker's
+        # slice of the shared step buffers
+        acts_buf, rews_buf, dones_buf = step_bufs
+        acts_np, rews_np, dones_np = (
+            acts_buf.view()[env_slice],
+            rews_buf.view()[env_slice],
+            dones_buf.view()[env_slice],
+        )
 
     try:
         while True:
             command, data = conn.recv()
+            start = time.perf_counter()
             if command == "reset":
-                conn.send(_write_obs([env.reset() for env in envs]))
+                for idx in range(len(envs)):
+                    _reset(idx)
+                conn.send(None)
             elif command == "seed":
                 for env, seed in zip(envs, data):
                     env.seed(int(seed))
             elif command == "step":
-                results, obs = [], []
-                for env, action in zip(envs, data):
-                    ob, rew, done, info = env.step(action)
-                    if done:
-                        ob = env.reset()
-                    results.append((rew, done, info))
-                    obs.append(ob)
-                _write_obs(obs)
-                conn.send(results)
+                if step_bufs is not None:
+                    data = acts_np.copy()
+                conn.send(_step(np.arange(len(envs)), data))
+            elif command == "step_subset":
+                if step_bufs is not None:
+                    data = (data, acts_np[data])
+                conn.send(_step(*data))
             elif command == "render":
                 conn.send([env.render(mode="rgb_array") for env in envs])
+            elif command == "attach_frames":
+                frames_buf = data
+                frames = frames_buf.view()[env_slice]
+            elif command == "render_shared":
+                for idx, env in enumerate(envs):
+                    frames[idx] = env.render(mode="rgb_array")
+                conn.send(None)
             elif command == "close":
                 break
             else:
                 raise RuntimeError("Unrecognized command: {}".format(command))
+            stats.record_busy(time.perf_counter() - start)
     except KeyboardInterrupt:
         print("ShmEnvPool worker: got KeyboardInterrupt")
     finally:
@@ -183,16 +985,50 @@ def shm_worker(env_maker, conn, n_envs, obs_bufs, obs_shape, obs_dtype):
             env.close()
 
 
-class ShmEnvPool(VecEnv):
+class ShmEnvPool(_SupervisedPool, VecEnv):
     """
     Uses a pool of workers to run multiple environments in parallel using shared
     memory to pass observations. This implementation supports multiple
     environments per worker to be as flexible as possible.
+
+    All observations live in a single (n_envs, *obs_shape) shared block which
+    workers write into by slice. If `copy_obs` is False, `reset` and `step_wait`
+    return a read-only view of this block, which is only valid until the next
+    call to either of them. Callers which keep observations around should copy
+    them into their own buffers (e.g., with `np.copyto`).
+
+    Dict and Tuple observation spaces get one such block per leaf space, and
+    observations are returned as (ordered) dicts or tuples of batched arrays.
+
+    By default (`shared_step=True`), actions, rewards and done flags are also
+    exchanged through shared arrays and the pipes only carry the step signal
+    (plus the info dicts, when nonempty). Otherwise, they're pickled through
+    the pipes like with EnvPool.
+
+    Supports the same asynchronous `send`/`recv` interface, `pin_cpus`,
+    `timeout` and `info_policy` options, restarts of dead or hung workers and
+    shared frame buffers for `get_images` as EnvPool.
+    Whitelisted info entries are exchanged through an (n_envs, n_keys) shared
+    block of floats.
+
+    Like EnvPool, keeps the true last observations of finished episodes in
+    `terminal_obs` and their time limit flags in `truncated`, here as views of
+    shared blocks which are only valid until the next step.
     """
 
-    def __init__(self, env_maker, n_envs=None, n_parallel=None):
+    def __init__(
+        self,
+        env_maker,
+        n_envs=None,
+        n_parallel=None,
+        shared_step=True,
+        copy_obs=True,
+        pin_cpus=False,
+        timeout=None,
+        info_policy="full",
+    ):
         n_envs = n_envs or mp.cpu_count()
-        n_parallel = n_parallel or mp.cpu_count() / 2
+        n_parallel = n_parallel or max(len(allowed_cpus()) // 2, 1)
         dummy = env_maker()
         ob_space, ac_space = dummy.observation_space, dummy.action_space
         del dummy
@@ -205,34 +1041,51 @@ class ShmEnvPool(VecEnv):
             len(d) for d in np.array_split(np.arange(n_envs), self.n_parallel)
         ]
         self.worker_env_seps = np.concatenate([[0], np.cumsum(num_worker_envs)])
+        self.env_workers = np.repeat(np.arange(len(num_worker_envs)), num_worker_envs)
 
-        self.obs_dtype, self.obs_shape = ob_space.dtype, ob_space.shape
-        self.obs_bufs = []
-        for _ in range(n_envs):
-            self.obs_bufs.append(
-                mp.Array(_NP_TO_CT[ob_space.dtype.type], int(np.prod(ob_space.shape)))
-            )
+        self.copy_obs = copy_obs
+        self.obs_bufs = OrderedDict(
+            (path, _ShmArray((n_envs,) + space.shape, space.dtype))
+            for path, space in _leaf_spaces(ob_space)
+        )
+        self.terminal_bufs = OrderedDict(
+            (path, _ShmArray((n_envs,) + space.shape, space.dtype))
+            for path, space in _leaf_spaces(ob_space)
+        )
+        self.truncated_buf = _ShmArray((n_envs,), np.bool_)
 
-        self.workers, self.conns = [], []
-        for beg, end in zip(self.worker_env_seps[:-1], self.worker_env_seps[1:]):
-            worker_conn, master_conn = mp.Pipe()
-            worker = mp.Process(
-                target=shm_worker,
-                args=(
-                    env_maker,
-                    worker_conn,
-                    end - beg,
-                    self.obs_bufs[beg:end],
-                    ob_space.shape,
-                    ob_space.dtype,
-                ),
-            )
-            worker.daemon = True
-            worker.start()
-            self.workers.append(worker)
-            self.conns.append(master_conn)
+        self.shared_step = shared_step
+        step_bufs = None
+        if shared_step:
+            self.acts_buf = _ShmArray((n_envs,) + ac_space.shape, ac_space.dtype)
+            self.rews_buf = _ShmArray((n_envs,), np.float64)
+            self.dones_buf = _ShmArray((n_envs,), np.bool_)
+            step_bufs = (self.acts_buf, self.rews_buf, self.dones_buf)
+
+        self.info_keys = _info_keys(info_policy)
+        self.infos_buf = None
+        if self.info_keys:
+            self.infos_buf = _ShmArray((n_envs, len(self.info_keys)), np.float64)
+        self.frames_buf = None
+
+        learner_cpus, worker_cpus = _worker_cpus(pin_cpus, len(num_worker_envs))
+        if resource_tracker is not None:
+            resource_tracker.ensure_running()
+
+        self.env_maker, self.worker_cpus, self.timeout = env_maker, worker_cpus, timeout
+        self.step_bufs = step_bufs
+        self.workers = [None] * len(num_worker_envs)
+        self.conns = [None] * len(num_worker_envs)
+        self.commands = [None] * len(num_worker_envs)
+        self.n_restarts = 0
+        self.stats = EnvStats(n_envs, len(num_worker_envs))
+        for widx in range(len(num_worker_envs)):
+            self._start_worker(widx)
+        if pin_cpus:
+            _pin_learner(learner_cpus, worker_cpus)
 
         self.waiting = False
+        self.pending = {}
         self.closed = False
 
         # set initial seeds
@@ -243,56 +1096,451 @@ class ShmEnvPool(VecEnv):
         assert not self.closed
         if self.waiting:
             self.step_wait()
-        for conn in self.conns:
-            conn.send(("reset", None))
-        for conn in self.conns:
-            conn.recv()
+        if self.pending:
+            self.recv(min_ready=self.num_envs)
+        for widx in range(len(self.conns)):
+            self._send(widx, "reset", None)
+        for widx in range(len(self.conns)):
+            self._recv(widx)
         return self._decode_obses()
 
     def step_async(self, actions):
-        assert not self.waiting and not self.closed
-        for conn, acts in zip(
-            self.conns, np.split(actions, self.worker_env_seps[1:-1])
-        ):
-            conn.send(("step", acts))
+        assert not self.waiting and not self.pending and not self.closed
+        if self.shared_step:
+            np.copyto(self.acts_buf.view(), actions)
+            for widx in range(len(self.conns)):
+                self._send(widx, "step", None)
+        else:
+            for widx, acts in enumerate(np.split(actions, self.worker_env_seps[1:-1])):
+                self._send(widx, "step", acts)
         self.waiting = True
 
     def step_wait(self):
         assert self.waiting and not self.closed
-        results = []
-        for conn in self.conns:
-            results.extend(conn.recv())
-        rews, dones, infos = zip(*results)
+        if self.shared_step:
+            infos = []
+            for widx, (beg, end) in enumerate(
+                zip(self.worker_env_seps[:-1], self.worker_env_seps[1:])
+            ):
+                worker_infos = self._recv(widx)
+                infos.extend(worker_infos or [{} for _ in range(end - beg)])
+            rews, dones = self.rews_buf.view().copy(), self.dones_buf.view().copy()
+        else:
+            results = []
+            for widx in range(len(self.conns)):
+                results.extend(self._recv(widx))
+            rews, dones, infos = zip(*results)
+            rews, dones = np.stack(rews), np.stack(dones)
         self.waiting = False
-        return self._decode_obses(), np.stack(rews), np.stack(dones), infos
+        infos = self._get_infos(slice(None), infos)
+        return self._decode_obses(), rews, dones, infos
 
-    def seed(self, seeds):
+    def send(self, actions, env_ids=None):
+        """
+        Start stepping the given environments (all by default) without waiting.
+        The environments of a worker can't be sent new actions until their
+        previous results are received.
+        """
         assert not self.waiting and not self.closed
-        for conn, data in zip(self.conns, np.split(seeds, self.worker_env_seps[1:-1])):
-            conn.send(("seed", data))
+        env_ids, worker_ids = _split_env_ids(self, env_ids)
+        if self.shared_step:
+            self.acts_buf.view()[env_ids] = actions
+        for widx in np.unique(worker_ids):
+            ids = env_ids[worker_ids == widx]
+            local_ids = ids - self.worker_env_seps[widx]
+            if self.shared_step:
+                self._send(widx, "step_subset", local_ids)
+            else:
+                acts = actions[worker_ids == widx]
+                self._send(widx, "step_subset", (local_ids, acts))
+            self.pending[widx] = ids
+
+    def recv(self, min_ready=1):
+        """
+        Wait until at least `min_ready` of the sent environments are done
+        stepping, returning the ids of all that are ready and their results.
+        """
+        assert self.pending and not self.closed
+        env_ids, infos, results = [], [], []
+        for ids, worker_results in _wait_ready(self, min_ready):
+            env_ids.append(ids)
+            if self.shared_step:
+                infos.extend(worker_results or [{} for _ in ids])
+            else:
+                results.extend(worker_results)
+        env_ids = np.concatenate(env_ids)
+        if self.shared_step:
+            rews, dones = self.rews_buf.view()[env_ids], self.dones_buf.view()[env_ids]
+        else:
+            rews, dones, infos = zip(*results)
+            rews, dones = np.stack(rews), np.stack(dones)
+        obs = _nest_leaves(
+            self.observation_space,
+            {path: buf.view()[env_ids] for path, buf in self.obs_bufs.items()},
+        )
+        return env_ids, obs, rews, dones, self._get_infos(env_ids, infos)
+
+    def seed(self, seeds):
+        assert not self.waiting and not self.pending and not self.closed
+        for widx, data in enumerate(np.split(seeds, self.worker_env_seps[1:-1])):
+            self._send(widx, "seed", data)
 
     def close_extras(self):
         if self.waiting:
             self.step_wait()
-        for conn in self.conns:
-            conn.send(("close", None))
+        if self.pending:
+            self.recv(min_ready=self.num_envs)
+        for widx, conn in enumerate(self.conns):
+            self._send(widx, "close", None)
             conn.close()
         for worker in self.workers:
             worker.join()
-        self.obs_bufs.clear()
+        self.stats.unlink()
+        bufs = [*self.obs_bufs.values(), *self.terminal_bufs.values()]
+        bufs += [self.truncated_buf, self.infos_buf, self.frames_buf]
+        if self.shared_step:
+            bufs += [self.acts_buf, self.rews_buf, self.dones_buf]
+        for buf in bufs:
+            if buf is not None:
+                buf.unlink()
 
     def get_images(self):
-        assert not self.waiting and not self.closed
-        for conn in self.conns:
-            conn.send(("render", None))
-        imgs = []
-        for conn in self.conns:
-            imgs.extend(conn.recv())
-        return imgs
+        assert not self.waiting and not self.pending and not self.closed
+        if self.frames_buf is None:
+            for widx in range(len(self.conns)):
+                self._send(widx, "render", None)
+            imgs = []
+            for widx in range(len(self.conns)):
+                imgs.extend(self._recv(widx))
+            self.frames_buf = _ShmArray((self.num_envs,) + imgs[0].shape, np.uint8)
+            for widx in range(len(self.conns)):
+                self._send(widx, "attach_frames", self.frames_buf)
+            return imgs
+
+        for widx in range(len(self.conns)):
+            self._send(widx, "render_shared", None)
+        for widx in range(len(self.conns)):
+            self._recv(widx)
+        frames = self.frames_buf.view()
+        frames.flags.writeable = False
+        return frames
+
+    def get_stats(self):
+        """
+        Environment latency and worker utilization statistics since the last
+        call (see `EnvStats.summary`).
+        """
+        return self.stats.summary()
+
+    @property
+    def terminal_obs(self):
+        leaves = {path: buf.view() for path, buf in self.terminal_bufs.items()}
+        return _nest_leaves(self.observation_space, leaves)
+
+    @property
+    def truncated(self):
+        return self.truncated_buf.view()
+
+    def _start_worker(self, widx):
+        beg, end = self.worker_env_seps[widx], self.worker_env_seps[widx + 1]
+        worker_conn, master_conn = mp.Pipe()
+        worker = _start_process(
+            shm_worker,
+            (
+                self.env_maker,
+                worker_conn,
+                slice(beg, end),
+                self.obs_bufs,
+                (self.terminal_bufs, self.truncated_buf),
+                self.stats.for_worker(widx, slice(beg, end)),
+                self.step_bufs,
+                self.worker_cpus[widx],
+                self.info_keys,
+                self.infos_buf,
+            ),
+        )
+        # Only the worker should hold its end, so that we get EOF if it dies
+        worker_conn.close()
+        self.workers[widx], self.conns[widx] = worker, master_conn
+        if self.frames_buf is not None:
+            self._send(widx, "attach_frames", self.frames_buf)
+
+    def _restart_results(self, widx, idxs):
+        self._send(widx, "reset", None)
+        self._recv(widx)
+        env_ids = self.worker_env_seps[widx] + np.asarray(idxs, dtype=np.int64)
+        # The true last observations are lost, so there's no bootstrapping
+        for path, buf in self.obs_bufs.items():
+            self.terminal_bufs[path].view()[env_ids] = buf.view()[env_ids]
+        self.truncated_buf.view()[env_ids] = False
+        info = _encode_info({"worker_restart": True}, self.info_keys)
+        if self.infos_buf is not None:
+            self.infos_buf.view()[env_ids], info = info, None
+        if not self.shared_step:
+            return [(0.0, True, info) for _ in env_ids]
+        self.rews_buf.view()[env_ids] = 0.0
+        self.dones_buf.view()[env_ids] = True
+        return [info for _ in env_ids] if info else None
+
+    def _get_infos(self, env_ids, infos):
+        if self.info_keys:
+            infos = self.infos_buf.view()[env_ids]
+        return _decode_infos(infos, self.info_keys)
 
     def _decode_obses(self):
-        results = [
-            np.frombuffer(b.get_obj(), dtype=self.obs_dtype).reshape(self.obs_shape)
-            for b in self.obs_bufs
+        leaves = {}
+        for path, buf in self.obs_bufs.items():
+            obs = buf.view()
+            if self.copy_obs:
+                obs = obs.copy()
+            else:
+                obs.flags.writeable = False
+            leaves[path] = obs
+        return _nest_leaves(self.observation_space, leaves)
+
+
+# ==============================
+# Thread based pool
+# ==============================
+
+
+class ThreadVecEnv(VecEnv):
+    """
+    Steps multiple environments on a pool of threads, which only pays off for
+    environments whose `step` releases the GIL (e.g., physics simulators or
+    image decoding implemented in C) since no data has to cross process
+    boundaries. Each thread steps a fixed chunk of environments, which write
+    their results into preallocated batch arrays.
+
+    Keeps the true last observations of finished episodes in `terminal_obs`
+    and their time limit flags in `truncated`, as EnvPool does.
+    """
+
+    def __init__(self, env_maker, n_envs=None, n_parallel=None):
+        n_envs = n_envs or mp.cpu_count()
+        n_parallel = n_parallel or len(allowed_cpus())
+        self.envs = [env_maker() for _ in range(n_envs)]
+        ob_space, ac_space = self.envs[0].observation_space, self.envs[0].action_space
+        super().__init__(n_envs, ob_space, ac_space)
+
+        # No point in having more threads than environments
+        self.n_parallel = n_envs if n_parallel > n_envs else n_parallel
+        self.env_chunks = np.array_split(np.arange(n_envs), self.n_parallel)
+        self.executor = ThreadPoolExecutor(self.n_parallel)
+
+        self.obs_leaves = OrderedDict(
+            (path, np.empty((n_envs,) + space.shape, space.dtype))
+            for path, space in _leaf_spaces(ob_space)
+        )
+        self.terminal_leaves = _zeros_leaves(ob_space, n_envs)
+        self.truncated = np.zeros(n_envs, dtype=np.bool_)
+        self.rews = np.empty(n_envs, dtype=np.float64)
+        self.dones = np.empty(n_envs, dtype=np.bool_)
+        self.infos = [{} for _ in range(n_envs)]
+        self.futures = None
+
+        # set initial seeds
+        seeds = np.random.randint(low=0, high=np.iinfo(np.int32).max, size=n_envs)
+        self.seed(seeds)
+
+    def reset(self):
+        if self.futures is not None:
+            self.step_wait()
+        for _ in self.executor.map(self._reset_chunk, self.env_chunks):
+            pass
+        return self._decode_obses()
+
+    def step_async(self, actions):
+        assert self.futures is None
+        self.futures = [
+            self.executor.submit(self._step_chunk, idxs, actions)
+            for idxs in self.env_chunks
         ]
-        return np.stack(results)
+
+    def step_wait(self):
+        assert self.futures is not None
+        for future in self.futures:
+            future.result()
+        self.futures = None
+        return (
+            self._decode_obses(),
+            self.rews.copy(),
+            self.dones.copy(),
+            tuple(self.infos),
+        )
+
+    def seed(self, seeds):
+        assert self.futures is None
+        for env, seed in zip(self.envs, seeds):
+            env.seed(int(seed))
+
+    def close_extras(self):
+        if self.futures is not None:
+            self.step_wait()
+        self.executor.shutdown()
+        for env in self.envs:
+            env.close()
+
+    def get_images(self):
+        assert self.futures is None
+        return [env.render(mode="rgb_array") for env in self.envs]
+
+    @property
+    def terminal_obs(self):
+        return _nest_leaves(self.observation_space, self.terminal_leaves)
+
+    def _write_ob(self, idx, ob, leaves=None):
+        _write_leaves(self.obs_leaves if leaves is None else leaves, idx, ob)
+
+    def _reset_chunk(self, idxs):
+        for idx in idxs:
+            self._write_ob(idx, self.envs[idx].reset())
+
+    def _step_chunk(self, idxs, actions):
+        for idx in idxs:
+            ob, rew, done, info = self.envs[idx].step(actions[idx])
+            self.truncated[idx] = done and _is_truncated(self.envs[idx], info)
+            if done:
+                self._write_ob(idx, ob, self.terminal_leaves)
+                ob = self.envs[idx].reset()
+            self._write_ob(idx, ob)
+            self.rews[idx], self.dones[idx], self.infos[idx] = rew, done, info
+
+    def _decode_obses(self):
+        leaves = {path: obs.copy() for path, obs in self.obs_leaves.items()}
+        return _nest_leaves(self.observation_space, leaves)
+
+
+# ==============================
+# Remote pool
+# ==============================
+
+# Environment variable with the shared secret of env servers and their clients,
+# which is kept out of command lines and saved experiment configs
+AUTHKEY_ENV_VAR = "ENV_SERVER_AUTHKEY"
+
+
+def serve_env_workers(host="localhost", port=7000, authkey=None):
+    """
+    Listen for RemoteEnvPool connections on `host:port`, running an env_worker
+    loop in a new process for each of them. Everything received is unpickled,
+    so clients must authenticate with the shared secret `authkey`, which is
+    only optional when listening on a loopback address.
+    """
+    authkey = authkey.encode() if isinstance(authkey, str) else authkey
+    if not authkey and not _is_loopback(host):
+        raise ValueError(
+            "Refusing to serve env workers on {} without an authkey".format(host)
+        )
+    workers = []
+    with mp.connection.Listener((host, port), authkey=authkey) as listener:
+        logger.info("Serving env workers on {}:{}".format(host, port))
+        while True:
+            conn = listener.accept()
+            worker = mp.Process(target=_serve_env_worker, args=(conn,))
+            worker.daemon = True
+            worker.start()
+            conn.close()
+            # Reap the processes of connections which were closed since
+            for finished in [w for w in workers if not w.is_alive()]:
+                finished.join()
+                workers.remove(finished)
+            workers.append(worker)
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except OSError:
+        return False
+
+
+def _serve_env_worker(conn):
+    env_maker, n_envs, info_keys = pickle.loads(conn.recv_bytes())
+    # Latency statistics are only kept on this end
+    stats = EnvStats(n_envs, 1)
+    try:
+        env_worker(
+            env_maker,
+            conn,
+            n_envs,
+            stats.for_worker(0, slice(0, n_envs)),
+            None,
+            info_keys,
+        )
+    finally:
+        stats.unlink()
+
+
+class _RemoteWorker:
+    """Stands in for the worker process of a RemoteEnvPool connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def is_alive(self):
+        return not self.conn.closed
+
+    def terminate(self):
+        self.conn.close()
+
+    kill = terminate
+
+    def join(self):
+        pass
+
+
+class RemoteEnvPool(EnvPool):
+    """
+    EnvPool whose workers run on env servers (see `serve_env_workers`), each
+    one at a `host:port` address of `addresses`, speaking the same command
+    protocol over TCP. The environments are split evenly among the servers,
+    and the environment maker is sent to them with cloudpickle, so it must be
+    importable there. Workers whose connection drops are reconnected as
+    EnvPool would restart them. Frames are always pickled by `get_images`.
+    Clients authenticate with `authkey`, read from the environment variable
+    named by `AUTHKEY_ENV_VAR` if not given.
+    """
+
+    def __init__(
+        self,
+        env_maker,
+        addresses,
+        n_envs=None,
+        timeout=None,
+        info_policy="full",
+        authkey=None,
+    ):
+        self.addresses = list(addresses)
+        authkey = authkey or os.environ.get(AUTHKEY_ENV_VAR)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        super().__init__(
+            env_maker,
+            n_envs=n_envs or len(self.addresses),
+            n_parallel=len(self.addresses),
+            timeout=timeout,
+            info_policy=info_policy,
+        )
+
+    def get_images(self):
+        assert not self.waiting and not self.pending and not self.closed
+        for widx in range(len(self.conns)):
+            self._send(widx, "render", None)
+        imgs = []
+        for widx in range(len(self.conns)):
+            imgs.extend(self._recv(widx))
+        return imgs
+
+    def get_stats(self):
+        return {"EnvRestarts": self.n_restarts}
+
+    def _start_worker(self, widx):
+        beg, end = self.worker_env_seps[widx], self.worker_env_seps[widx + 1]
+        host, port = self.addresses[widx].rsplit(":", 1)
+        conn = mp.connection.Client((host, int(port)), authkey=self.authkey)
+        conn.send_bytes(cloudpickle.dumps((self.env_maker, end - beg, self.info_keys)))
+        self.workers[widx], self.conns[widx] = _RemoteWorker(conn), conn
@@ -56,6 +56,12 @@ def log_reward_statistics(vec_env, num_last_eps=100, prefix=""):
         logger.logkv(prefix + "TotalNEpisodes", len(episode_rewards))
 
 
+def log_env_pool_statistics(vec_env):
+    # Only env pools keep latency statistics of their workers
+    if hasattr(vec_env.unwrapped, "get_stats"):
+        logger.logkvs(vec_env.unwrapped.get_stats())
+
+
 @torch.no_grad()
 def log_val_fn_statistics(values, returns):
     logger.logkv("ValueLoss", torch.nn.MSELoss()(values, returns).item())
@@ -1,10 +1,16 @@
 """
 Placeholder
 """
+import os
+import time
+import queue
 import random
+import threading
 from collections import OrderedDict
 
+import numpy as np
 import torch
+from baselines import logger
 from proj.utils.tqdm_util import trange
 from proj.utils.torch_util import _NP_TO_PT
 
@@ -31,8 +37,48 @@ class ReplayBuffer:
         self.ptr = (self.ptr + 1) % self.capacity
         self.size = min(self.size + 1, self.capacity)
 
+    def store_batch(self, obs1, acts, rews, obs2, dones, resets=None):
+        """
+        Store many transitions (e.g., a step of a vectorized environment or
+        several of them) at once, as arrays or tensors with any number of
+        leading batch dimensions. Each field is written with at most two slice
+        assignments, wrapping around the end of the buffer. `resets` flags the
+        environments reset after each transition (i.e., the dones before
+        masking out time limits), and is only used by buffers which share
+        observations between consecutive transitions.
+        """
+        bufs = (
+            self.all_obs1,
+            self.all_acts,
+            self.all_rews,
+            self.all_obs2,
+            self.all_dones,
+        )
+        items = [
+            torch.as_tensor(item).reshape((-1,) + buf.shape[1:])
+            for buf, item in zip(bufs, (obs1, acts, rews, obs2, dones))
+        ]
+        n_items = len(items[2])
+        if n_items > self.capacity:
+            # Only the most recent transitions would be kept anyway
+            self.ptr = (self.ptr + n_items - self.capacity) % self.capacity
+            items = [item[-self.capacity :] for item in items]
+            n_items = self.capacity
+
+        n_first = min(n_items, self.capacity - self.ptr)
+        for buf, item in zip(bufs, items):
+            buf[self.ptr : self.ptr + n_first] = item[:n_first]
+            buf[: n_items - n_first] = item[n_first:]
+        self.ptr = (self.ptr + n_items) % self.capacity
+        self.size = min(self.size + n_items, self.capacity)
+
+    def can_sample(self, mb_size):
+        return self.size >= mb_size
+
     def sample(self, mb_size):
-        idxs = random.sample(range(self.size), mb_size)
+        return self._get(random.sample(range(self.size), mb_size))
+
+    def _get(self, idxs):
         return (
             self.all_obs1[idxs],
             self.all_acts[idxs],
@@ -51,8 +97,514 @@ class ReplayBuffer:
         self.__dict__.update(state_dict)
 
 
+class CompactReplayBuffer:
+    """
+    Same interface as ReplayBuffer, but keeps observations and actions in their
+    native dtypes and stores each observation only once, in sequence order.
+    Transitions must be stored a vectorized step of `n_envs` environments at a
+    time, and the next observation of each is looked up as the first one of
+    the same environment's following transition. Only at episode boundaries,
+    where those differ, is the next observation kept apart, and only if it's
+    needed for bootstrapping (i.e., the transition isn't terminal).
+    """
+
+    def __init__(self, capacity, ob_space, ac_space, n_envs=1):
+        self.n_envs, self.n_rows = n_envs, max(capacity // n_envs, 2)
+        ob_dtype = _NP_TO_PT[ob_space.dtype.type]
+        self.all_obs = torch.empty(
+            (self.n_rows, n_envs) + self._stored_shape(ob_space.shape),
+            dtype=ob_dtype,
+        )
+        self.all_acts = torch.empty(
+            (self.n_rows, n_envs) + ac_space.shape,
+            dtype=_NP_TO_PT[ac_space.dtype.type],
+        )
+        self.all_rews = torch.empty(self.n_rows, n_envs)
+        self.all_dones = torch.empty(self.n_rows, n_envs, dtype=torch.bool)
+        # Whether the next observation of a transition isn't the first one of
+        # the following row, and those among them still needed by flat index
+        self.all_bounds = torch.zeros(self.n_rows, n_envs, dtype=torch.bool)
+        self.boundary_obs = {}
+        # Next observations of the last row, until the following one arrives,
+        # and whether their environments were reset after it
+        self.next_obs = torch.empty((n_envs,) + ob_space.shape, dtype=ob_dtype)
+        self.next_resets = torch.zeros(n_envs, dtype=torch.bool)
+        self.ptr, self.size, self.capacity = 0, 0, capacity
+
+    def store(self, ob1, act, rew, ob2, done):
+        assert self.n_envs == 1, "Use store_batch with multiple environments"
+        self.store_batch(ob1, act, rew, ob2, done)
+
+    def store_batch(self, obs1, acts, rews, obs2, dones, resets=None):
+        """
+        Store one or more vectorized steps, as arrays or tensors with leading
+        (n_envs,) or (steps, n_envs) dimensions. Environments are assumed to be
+        reset after terminal transitions, and after those flagged in `resets`.
+        """
+        obs_shape, acts_shape = self.next_obs.shape, self.all_acts.shape[1:]
+        obs1 = torch.as_tensor(obs1).reshape((-1,) + obs_shape).to(self.next_obs)
+        acts = torch.as_tensor(acts).reshape((-1,) + acts_shape).to(self.all_acts)
+        rews = torch.as_tensor(rews).reshape(-1, self.n_envs)
+        obs2 = torch.as_tensor(obs2).reshape((-1,) + obs_shape).to(self.next_obs)
+        dones = torch.as_tensor(dones).reshape(-1, self.n_envs).bool()
+        resets = dones if resets is None else torch.as_tensor(resets)
+        resets = resets.reshape(-1, self.n_envs).bool() | dones
+        for row in zip(obs1, acts, rews, obs2, dones, resets):
+            self._store_row(*row)
+
+    def _store_row(self, obs1, acts, rews, obs2, dones, resets):
+        # Observations which follow a reset or differ from the next ones of the
+        # previous row start a new episode. Auto-reset environments may return
+        # the first observation of the next episode as the next one of the last,
+        # so that only the reset flags tell them apart.
+        starts = torch.ones(self.n_envs, dtype=torch.bool)
+        if self.size:
+            last = (self.ptr - 1) % self.n_rows
+            bounds = (self.next_obs != obs1).reshape(self.n_envs, -1).any(dim=1)
+            self.all_bounds[last] = bounds
+            for env in (bounds & ~self.all_dones[last]).nonzero().flatten().tolist():
+                self.boundary_obs[last * self.n_envs + env] = self.next_obs[env].clone()
+            starts = bounds | self.next_resets
+
+        # Forget the next observations kept for the row being overwritten
+        for env in self.all_bounds[self.ptr].nonzero().flatten().tolist():
+            self.boundary_obs.pop(self.ptr * self.n_envs + env, None)
+        self.all_bounds[self.ptr] = False
+
+        self._write_obs(obs1, starts)
+        self.all_acts[self.ptr] = acts
+        self.all_rews[self.ptr] = rews
+        self.all_dones[self.ptr] = dones
+        self.next_obs.copy_(obs2)
+        self.next_resets.copy_(resets)
+        self.ptr = (self.ptr + 1) % self.n_rows
+        self.size = min(self.size + self.n_envs, self.n_rows * self.n_envs)
+
+    def can_sample(self, mb_size):
+        return self.size >= mb_size
+
+    def sample(self, mb_size):
+        idxs = self._sample_idxs(mb_size)
+        rows, envs = idxs // self.n_envs, idxs % self.n_envs
+        obs1 = self._gather_obs(rows, envs)
+        obs2 = self._gather_obs((rows + 1) % self.n_rows, envs)
+        last = rows == (self.ptr - 1) % self.n_rows
+        obs2[last] = self.next_obs[envs[last]]
+        for idx in self.all_bounds[rows, envs].nonzero().flatten().tolist():
+            # Terminal transitions are masked, so any observation will do
+            obs2[idx] = self.boundary_obs.get(idxs[idx].item(), obs1[idx])
+        return (
+            obs1.float(),
+            self.all_acts[rows, envs].float(),
+            self.all_rews[rows, envs],
+            obs2.float(),
+            self.all_dones[rows, envs].float(),
+        )
+
+    def state_dict(self):
+        return self.__dict__.copy()
+
+    def load_state_dict(self, state_dict):
+        assert (
+            self.capacity == state_dict["capacity"]
+            and self.n_envs == state_dict["n_envs"]
+        ), "Trying to load state between incompatible replay buffers in size"
+        self.__dict__.update(state_dict)
+
+    def _stored_shape(self, ob_shape):
+        return ob_shape
+
+    def _write_obs(self, obs1, starts):
+        self.all_obs[self.ptr] = obs1
+
+    def _sample_idxs(self, mb_size):
+        # Flat indices of transitions, i.e., row * n_envs + env
+        return torch.as_tensor(random.sample(range(self.size), mb_size))
+
+    def _gather_obs(self, rows, envs):
+        return self.all_obs[rows, envs]
+
+
+class FrameStackReplayBuffer(CompactReplayBuffer):
+    """
+    CompactReplayBuffer for observations made of the last `stack` frames along
+    their last axis (see baselines.common.vec_env.vec_frame_stack), which only
+    stores the newest frame of each and rebuilds the stacks when sampling.
+    Frames from before the start of an episode are zeroed, as VecFrameStack
+    does, so that stacks never cross resets.
+    """
+
+    def __init__(self, capacity, ob_space, ac_space, n_envs=1, stack=4):
+        self.stack = stack
+        super().__init__(capacity, ob_space, ac_space, n_envs=n_envs)
+        self.all_starts = torch.zeros(self.n_rows, n_envs, dtype=torch.bool)
+
+    def _stored_shape(self, ob_shape):
+        assert ob_shape[-1] % self.stack == 0, "Observations aren't frame stacks"
+        return ob_shape[:-1] + (ob_shape[-1] // self.stack,)
+
+    def _write_obs(self, obs1, starts):
+        self.all_obs[self.ptr] = obs1[..., -self.all_obs.shape[-1] :]
+        self.all_starts[self.ptr] = starts
+
+    def can_sample(self, mb_size):
+        return self._n_sampleable() >= mb_size
+
+    def _n_sampleable(self):
+        if self.size < self.n_rows * self.n_envs:
+            return self.size
+        # The stacks of the oldest rows may need frames already overwritten
+        return self.size - (self.stack - 1) * self.n_envs
+
+    def _sample_idxs(self, mb_size):
+        n_items = self.n_rows * self.n_envs
+        if self.size < n_items:
+            return super()._sample_idxs(mb_size)
+        n_sampleable = self._n_sampleable()
+        idxs = torch.as_tensor(random.sample(range(n_sampleable), mb_size))
+        return (idxs + self.ptr * self.n_envs + n_items - n_sampleable) % n_items
+
+    def _gather_obs(self, rows, envs):
+        # Rows of the frames of each stack, oldest first
+        offsets = torch.arange(self.stack - 1, -1, -1)
+        frame_rows = (rows[:, None] - offsets) % self.n_rows
+        frames = self.all_obs[frame_rows, envs[:, None]]
+        # Frames followed by the start of an episode belong to a previous one
+        starts = self.all_starts[frame_rows, envs[:, None]].long()
+        frames[starts.flip(1).cumsum(1).flip(1) - starts > 0] = 0
+        # (batch, stack, ..., channels) -> (batch, ..., stack * channels)
+        ndim = frames.dim()
+        frames = frames.permute(0, *range(2, ndim - 1), 1, ndim - 1)
+        return frames.reshape(frames.shape[:-2] + (-1,))
+
+
+class MemmapReplayBuffer:
+    """
+    Same interface as ReplayBuffer, but backed by np.memmap files under `path`
+    (one .npy file per field, in native dtypes), so that its capacity is only
+    bounded by disk space and its contents are paged in and out by the OS.
+    Batches are written as contiguous slices and minibatches gathered in file
+    order. Existing files of matching shape are opened in place, so that a
+    resumed experiment only has to restore the small `state_dict`. Loading the
+    state of a buffer kept elsewhere copies its files' contents instead, so
+    that the other buffer isn't written to.
+    """
+
+    def __init__(self, capacity, ob_space, ac_space, path):
+        self.specs = OrderedDict(
+            obs1=(ob_space.shape, ob_space.dtype),
+            acts=(ac_space.shape, ac_space.dtype),
+            rews=((), np.dtype(np.float32)),
+            obs2=(ob_space.shape, ob_space.dtype),
+            dones=((), np.dtype(np.bool_)),
+        )
+        self.ptr, self.size, self.capacity = 0, 0, capacity
+        self._open(path)
+
+    def _open(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path, self.arrays = path, []
+        for name, (shape, dtype) in self.specs.items():
+            filename = os.path.join(path, name + ".npy")
+            shape = (self.capacity,) + shape
+            if os.path.exists(filename):
+                array = np.lib.format.open_memmap(filename, mode="r+")
+                if array.shape == shape and array.dtype == dtype:
+                    self.arrays.append(array)
+                    continue
+            self.arrays.append(
+                np.lib.format.open_memmap(filename, mode="w+", shape=shape, dtype=dtype)
+            )
+
+    def store(self, ob1, act, rew, ob2, done):
+        self.store_batch(*(np.asarray(x)[None] for x in (ob1, act, rew, ob2, done)))
+
+    def store_batch(self, obs1, acts, rews, obs2, dones, resets=None):
+        """
+        Store many transitions at once, as with ReplayBuffer.store_batch.
+        """
+        items = [
+            np.asarray(item).reshape((-1,) + array.shape[1:])
+            for array, item in zip(self.arrays, (obs1, acts, rews, obs2, dones))
+        ]
+        n_items = len(items[2])
+        if n_items > self.capacity:
+            self.ptr = (self.ptr + n_items - self.capacity) % self.capacity
+            items = [item[-self.capacity :] for item in items]
+            n_items = self.capacity
+
+        n_first = min(n_items, self.capacity - self.ptr)
+        for array, item in zip(self.arrays, items):
+            array[self.ptr : self.ptr + n_first] = item[:n_first]
+            array[: n_items - n_first] = item[n_first:]
+        self.ptr = (self.ptr + n_items) % self.capacity
+        self.size = min(self.size + n_items, self.capacity)
+
+    def can_sample(self, mb_size):
+        return self.size >= mb_size
+
+    def sample(self, mb_size):
+        # Sorted indices make each gather a forward pass through its file
+        idxs = np.sort(random.sample(range(self.size), mb_size))
+        return tuple(torch.as_tensor(array[idxs]).float() for array in self.arrays)
+
+    def state_dict(self):
+        for array in self.arrays:
+            array.flush()
+        return dict(
+            path=self.path, ptr=self.ptr, size=self.size, capacity=self.capacity
+        )
+
+    def load_state_dict(self, state_dict):
+        assert (
+            self.capacity == state_dict["capacity"]
+        ), "Trying to load state between incompatible replay buffers in size"
+        if os.path.abspath(state_dict["path"]) != os.path.abspath(self.path):
+            for name, array in zip(self.specs, self.arrays):
+                filename = os.path.join(state_dict["path"], name + ".npy")
+                array[...] = np.lib.format.open_memmap(filename, mode="r")
+        self.ptr, self.size = state_dict["ptr"], state_dict["size"]
+
+
+class SumTree:
+    """
+    Binary tree stored in an array, whose leaves hold the priorities of
+    `capacity` items and whose inner nodes hold the sums of their children.
+    Updates and lookups are vectorized over batches of items, walking the tree
+    one level at a time.
+    """
+
+    def __init__(self, capacity):
+        self.n_leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.n_leaves.bit_length() - 1
+        self.nodes = np.zeros(2 * self.n_leaves)
+
+    @property
+    def total(self):
+        return self.nodes[1]
+
+    def __getitem__(self, idxs):
+        return self.nodes[np.asarray(idxs) + self.n_leaves]
+
+    def update(self, idxs, priorities):
+        nodes = np.asarray(idxs) + self.n_leaves
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Return the indices of the items at which the cumulative sums of the
+        priorities reach `values`.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            # Subtrees without priority are never entered, despite rounding
+            right = (values > self.nodes[left]) | (self.nodes[left] <= 0)
+            right &= self.nodes[left + 1] > 0
+            values -= self.nodes[left] * right
+            nodes = left + right
+        return nodes - self.n_leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer sampling transitions with probability proportional to their
+    priority, i.e., their last absolute TD error plus `eps` to the power of
+    `alpha` (Schaul et al., 2015), kept in a SumTree. New transitions get the
+    highest priority seen so far. Besides the transitions, `sample` returns
+    their importance sampling weights with exponent `beta`, normalized by the
+    largest one, and their indices for `update_priorities`. Since these only
+    fully correct the bias of prioritized sampling for `beta` = 1, `anneal_beta`
+    moves it there from its initial value over the course of training.
+    """
+
+    def __init__(self, capacity, ob_space, ac_space, alpha=0.6, beta=0.4, eps=1e-6):
+        super().__init__(capacity, ob_space, ac_space)
+        self.alpha, self.beta, self.eps = alpha, beta, eps
+        self.initial_beta = beta
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def store(self, ob1, act, rew, ob2, done):
+        self.tree.update([self.ptr], self.max_priority ** self.alpha)
+        super().store(ob1, act, rew, ob2, done)
+
+    def store_batch(self, obs1, acts, rews, obs2, dones, resets=None):
+        super().store_batch(obs1, acts, rews, obs2, dones)
+        n_items = min(np.size(rews), self.capacity)
+        idxs = (self.ptr - np.arange(1, n_items + 1)) % self.capacity
+        self.tree.update(idxs, self.max_priority ** self.alpha)
+
+    def sample(self, mb_size):
+        # Stratified, drawing one transition from each of `mb_size` equal
+        # segments of the total priority
+        bounds = np.linspace(0, self.tree.total, mb_size + 1)
+        idxs = self.tree.find(np.random.uniform(bounds[:-1], bounds[1:]))
+        probs = self.tree[idxs] / self.tree.total
+        weights = (self.size * probs) ** -self.beta
+        weights = torch.as_tensor(weights / weights.max(), dtype=torch.float32)
+        return self._get(idxs) + (weights, idxs)
+
+    def anneal_beta(self, progress):
+        """
+        Set `beta` linearly between its initial value and 1 for the fraction
+        `progress` of training done.
+        """
+        progress = min(max(progress, 0.0), 1.0)
+        self.beta = self.initial_beta + progress * (1.0 - self.initial_beta)
+
+    def update_priorities(self, idxs, td_errors):
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(idxs, priorities ** self.alpha)
+
+    def state_dict(self):
+        # Expose the tree as its node array, so that it is saved like the rest
+        return {**super().state_dict(), "tree": self.tree.nodes}
+
+    def load_state_dict(self, state_dict):
+        state_dict = state_dict.copy()
+        nodes = state_dict.pop("tree")
+        super().load_state_dict(state_dict)
+        self.tree = SumTree(self.capacity)
+        self.tree.nodes = np.asarray(nodes, dtype=np.float64)
+
+
+REPLAY_BUFFERS = (
+    "ReplayBuffer",
+    "CompactReplayBuffer",
+    "FrameStackReplayBuffer",
+    "MemmapReplayBuffer",
+    "PrioritizedReplayBuffer",
+)
+
+
+def make_replay_buffer(name, capacity, ob_space, ac_space, n_envs=1, path=None):
+    """
+    Create a replay buffer of the class named `name` (one of `REPLAY_BUFFERS`)
+    for transitions of `n_envs` environments stepped together. Memory-mapped
+    buffers keep their files in the folder at `path`, which must be given and
+    shouldn't be used by anything else.
+    """
+    assert name in REPLAY_BUFFERS, "Unknown replay buffer: {}".format(name)
+    if name == "CompactReplayBuffer":
+        return CompactReplayBuffer(capacity, ob_space, ac_space, n_envs=n_envs)
+    if name == "FrameStackReplayBuffer":
+        return FrameStackReplayBuffer(capacity, ob_space, ac_space, n_envs=n_envs)
+    if name == "MemmapReplayBuffer":
+        assert path is not None, "Memory-mapped replay buffers need a path"
+        return MemmapReplayBuffer(capacity, ob_space, ac_space, path)
+    if name == "PrioritizedReplayBuffer":
+        return PrioritizedReplayBuffer(capacity, ob_space, ac_space)
+    return ReplayBuffer(capacity, ob_space, ac_space)
+
+
+class BatchPrefetcher:
+    """
+    Samples minibatches of `mb_size` transitions from `replay` on a background
+    thread, keeping up to `n_batches` of them ready while the caller runs its
+    update on the current one. Minibatches are copied into preallocated
+    tensors, page-locked if `pin_memory` is set, which are recycled once the
+    next minibatch is requested. With `n_batches=0`, minibatches are sampled
+    on the calling thread instead.
+
+    The replay buffer must not be stored into while `batches` runs. Priority
+    updates go through `update_priorities`, so that they don't interleave with
+    sampling, and only affect minibatches sampled afterwards.
+    """
+
+    def __init__(self, replay, mb_size, n_batches=2, pin_memory=False):
+        self.replay, self.mb_size = replay, mb_size
+        self.n_batches, self.pin_memory = n_batches, pin_memory
+        self.slots = None
+        self.lock = threading.Lock()
+        self.wait_time, self.depths = 0.0, []
+
+    def batches(self, n_updates):
+        """
+        Yield `n_updates` minibatches, each valid until the next one is
+        requested.
+        """
+        if not self.n_batches:
+            for _ in range(n_updates):
+                start = time.perf_counter()
+                batch = self.replay.sample(self.mb_size)
+                self.wait_time += time.perf_counter() - start
+                self.depths.append(0)
+                yield batch
+            return
+
+        free, ready = queue.Queue(), queue.Queue()
+        for slot in range(self.n_batches + 1):
+            free.put(slot)
+        thread = threading.Thread(
+            target=self._produce, args=(n_updates, free, ready), daemon=True
+        )
+        thread.start()
+        try:
+            for _ in range(n_updates):
+                self.depths.append(ready.qsize())
+                start = time.perf_counter()
+                slot = ready.get()
+                self.wait_time += time.perf_counter() - start
+                if isinstance(slot, Exception):
+                    raise slot
+                yield self.slots[slot]
+                free.put(slot)
+        finally:
+            # Unblock the producer in case the caller stopped early
+            free.put(None)
+            thread.join()
+
+    def update_priorities(self, idxs, td_errors):
+        with self.lock:
+            self.replay.update_priorities(idxs, td_errors)
+
+    def get_stats(self):
+        """
+        Mean number of minibatches ready when one was requested and total time
+        spent waiting for them since the last call.
+        """
+        depth = np.mean(self.depths) if self.depths else 0.0
+        stats = {"PrefetchQueueDepth": depth, "PrefetchWaitTime": self.wait_time}
+        self.wait_time, self.depths = 0.0, []
+        return stats
+
+    def _produce(self, n_updates, free, ready):
+        try:
+            for _ in range(n_updates):
+                slot = free.get()
+                if slot is None:
+                    return
+                with self.lock:
+                    batch = self.replay.sample(self.mb_size)
+                if self.slots is None:
+                    self.slots = [
+                        tuple(map(self._empty_like, batch))
+                        for _ in range(self.n_batches + 1)
+                    ]
+                for dst, src in zip(self.slots[slot], batch):
+                    if isinstance(dst, torch.Tensor):
+                        dst.copy_(torch.as_tensor(src))
+                    else:
+                        np.copyto(dst, src)
+                ready.put(slot)
+        except Exception as e:
+            ready.put(e)
+
+    def _empty_like(self, item):
+        if not isinstance(item, torch.Tensor):
+            return np.empty_like(item)
+        buf = torch.empty_like(item)
+        return buf.pin_memory() if self.pin_memory else buf
+
+
 @torch.no_grad()
-def parallel_samples_collector(vec_env, policy, steps):
+def parallel_samples_collector(vec_env, policy, steps, double_buffer=False):
     """
     Collect trajectories in parallel using a vectorized environment.
     Actions are computed using the provided policy. For each worker,
@@ -62,37 +614,187 @@ def parallel_samples_collector(vec_env, policy, steps):
     :param vec_env: An instance of baselines.common.vec_env.VecEnv.
     :param policy: An instance of proj.common.models.Policy.
     :param steps: The number of steps to take in each environment.
+    :param double_buffer: Whether to overlap policy inference with
+        environment stepping. See `double_buffered_samples_collector`.
     :return: An OrderedDict with all observations, actions, rewards
-        and done flags as matrixes of size (steps, vec_envs).
+        and done flags as matrixes of size (steps, vec_envs). If the
+        environments keep the true last observations of finished
+        episodes (see `terminal_source`), it also holds the (steps,
+        vec_envs) mask of time limit truncations and the terminal
+        observations of those, for `compute_pg_vars` to bootstrap from.
     """
+    if double_buffer:
+        yield from double_buffered_samples_collector(vec_env, policy, steps)
+        return
+
     ob_space = vec_env.observation_space
-    obs = torch.as_tensor(vec_env.reset(), dtype=_NP_TO_PT[ob_space.dtype.type])
+    torch_api = getattr(vec_env, "torch_api", False)
+    terminals = terminal_source(vec_env)
+    env_ids = np.arange(vec_env.num_envs)
+    obs_shape = (steps + 1, vec_env.num_envs) + ob_space.shape
+    obs = vec_env.reset()
     while True:
-        all_obs, all_acts, all_rews, all_dones = [], [], [], []
-        for _ in trange(steps, unit="step", leave=False, desc="Sampling"):
-            actions = policy.actions(obs)
-            next_obs, rews, dones, _ = vec_env.step(actions.numpy())
-            all_obs.append(obs)
+        # Observations are copied straight into a preallocated buffer, since
+        # vectorized environments may return views of their internal storage
+        all_obs = torch.empty(obs_shape, dtype=_NP_TO_PT[ob_space.dtype.type])
+        all_acts, all_rews, all_dones = [], [], []
+        truncations = {}
+        _copy_obs(all_obs[0], obs)
+        for step in trange(steps, unit="step", leave=False, desc="Sampling"):
+            actions = policy.actions(all_obs[step])
+            next_obs, rews, dones, _ = vec_env.step(
+                actions if torch_api else actions.numpy()
+            )
             all_acts.append(actions)
-            all_rews.append(torch.as_tensor(rews.astype("f")))
-            all_dones.append(torch.from_numpy(dones.astype("f")))
-            obs = torch.as_tensor(next_obs, dtype=_NP_TO_PT[ob_space.dtype.type])
+            all_rews.append(torch.as_tensor(rews, dtype=torch.float32))
+            all_dones.append(torch.as_tensor(dones, dtype=torch.float32))
+            _copy_obs(all_obs[step + 1], next_obs)
+            if terminals is not None:
+                _record_truncations(terminals, step, env_ids, truncations)
 
-        all_obs.append(obs)
-        yield OrderedDict(
-            observations=torch.stack(all_obs),
+        obs = all_obs[-1]
+        trajs = OrderedDict(
+            observations=all_obs,
             actions=torch.stack(all_acts),
             rewards=torch.stack(all_rews),
             dones=torch.stack(all_dones),
         )
+        if terminals is not None:
+            _add_truncations(trajs, truncations)
+        yield trajs
+
+
+@torch.no_grad()
+def double_buffered_samples_collector(vec_env, policy, steps):
+    """
+    Same as `parallel_samples_collector`, but splits the environments in two
+    groups which take turns: while one group steps in the workers, actions
+    are computed for the other.
+
+    :param vec_env: A vectorized environment supporting the asynchronous
+        `send`/`recv` interface of proj.common.env_pool (e.g., an EnvPool
+        wrapped by proj.common.env_makers.VecMonitor) with at least two
+        workers.
+    :param policy: An instance of proj.common.models.Policy.
+    :param steps: The number of steps to take in each environment.
+    :return: Same as `parallel_samples_collector`.
+    """
+    ob_space, n_envs = vec_env.observation_space, vec_env.num_envs
+    terminals = terminal_source(vec_env)
+    # Split along worker boundaries so that groups never share a worker
+    env_groups = vec_env.unwrapped.env_workers % 2
+    groups = [np.flatnonzero(env_groups == g) for g in range(2)]
+    assert all(map(len, groups)), "Double buffering requires at least two workers"
+    obs_shape = (steps + 1, n_envs) + ob_space.shape
+    obs = vec_env.reset()
+    while True:
+        all_obs = torch.empty(obs_shape, dtype=_NP_TO_PT[ob_space.dtype.type])
+        all_acts = None
+        all_rews = torch.empty(steps, n_envs)
+        all_dones = torch.empty(steps, n_envs)
+        np.copyto(all_obs[0].numpy(), obs)
+        group_steps, pending = [0, 0], [0, 0]
+        truncations = {}
+
+        def send(group):
+            nonlocal all_acts
+            ids, step = groups[group], group_steps[group]
+            actions = policy.actions(all_obs[step, ids])
+            if all_acts is None:
+                all_acts = actions.new_empty((steps, n_envs) + actions.shape[1:])
+            all_acts[step, ids] = actions
+            vec_env.send(actions.numpy(), ids)
+            pending[group] = len(ids)
+
+        def recv(group):
+            # Results from the other group may arrive first and are stored too
+            while pending[group]:
+                env_ids, next_obs, rews, dones, _ = vec_env.recv()
+                for other in range(2):
+                    mask = env_groups[env_ids] == other
+                    if not mask.any():
+                        continue
+                    ids, step = env_ids[mask], group_steps[other]
+                    all_obs[step + 1, ids] = torch.as_tensor(next_obs[mask]).to(all_obs)
+                    all_rews[step, ids] = torch.as_tensor(rews[mask].astype("f"))
+                    all_dones[step, ids] = torch.as_tensor(dones[mask].astype("f"))
+                    if terminals is not None:
+                        _record_truncations(terminals, step, ids, truncations)
+                    pending[other] -= len(ids)
+                    if not pending[other]:
+                        group_steps[other] += 1
+
+        send(0)
+        for step in trange(steps, unit="step", leave=False, desc="Sampling"):
+            send(1)
+            recv(0)
+            if step + 1 < steps:
+                send(0)
+            recv(1)
+
+        obs = all_obs[-1].numpy()
+        trajs = OrderedDict(
+            observations=all_obs,
+            actions=all_acts,
+            rewards=all_rews,
+            dones=all_dones,
+        )
+        if terminals is not None:
+            _add_truncations(trajs, truncations)
+        yield trajs
+
+
+def terminal_source(vec_env):
+    """
+    Return the vectorized environment wrapped by `vec_env` if it keeps the true
+    last observations of finished episodes in `terminal_obs` and their time
+    limit flags in `truncated` (e.g., the pools of proj.common.env_pool), and
+    the wrappers in between don't change observations. Otherwise, return None.
+    """
+    venv = vec_env.unwrapped
+    if not hasattr(venv, "truncated"):
+        return None
+    if venv.observation_space != vec_env.observation_space:
+        # e.g., frame stacking
+        return None
+    return venv
+
+
+def _copy_obs(dst, obs):
+    if isinstance(obs, torch.Tensor):
+        dst.copy_(obs)
+    else:
+        np.copyto(dst.numpy(), obs)
+
+
+def _record_truncations(terminals, step, env_ids, truncations):
+    # Copied, since terminal observations may be views of internal storage
+    for env_id in env_ids[np.asarray(terminals.truncated[env_ids])]:
+        ob = torch.as_tensor(terminals.terminal_obs[env_id]).clone()
+        truncations[step, env_id] = ob
+
+
+def _add_truncations(trajs, truncations):
+    all_truncs = torch.zeros_like(trajs["rewards"])
+    for step, env_id in truncations:
+        all_truncs[step, env_id] = 1
+    # Sorted by step and environment, as are the entries of the mask
+    keys = sorted(truncations)
+    trajs["truncations"] = all_truncs
+    trajs["terminal_obs"] = (
+        torch.stack([truncations[key] for key in keys])
+        if keys
+        else trajs["observations"][:0, 0]
+    )
 
 
 def samples_generator(vec_env, policy, k, compute_dists_vals):
     """
     Placeholder
     """
+    torch_api = getattr(vec_env, "torch_api", False)
     obs = vec_env.reset()
-    dists, vals = compute_dists_vals(torch.from_numpy(obs))
+    dists, vals = compute_dists_vals(torch.as_tensor(obs))
 
     n_envs = vec_env.num_envs
     while True:
@@ -106,14 +808,14 @@ def samples_generator(vec_env, policy, k, compute_dists_vals):
             with torch.no_grad():
                 acts = dists.sample()
 
-            next_obs, rews, dones, _ = vec_env.step(acts.numpy())
+            next_obs, rews, dones, _ = vec_env.step(acts if torch_api else acts.numpy())
             all_acts[i] = acts
-            all_rews[i] = torch.from_numpy(rews)
-            all_dones[i] = torch.from_numpy(dones.astype("f"))
+            all_rews[i] = torch.as_tensor(rews)
+            all_dones[i] = torch.as_tensor(dones, dtype=torch.float32)
             all_dists[i] = dists.flat_params
             all_vals[i] = vals
 
-            dists, vals = compute_dists_vals(torch.from_numpy(next_obs))
+            dists, vals = compute_dists_vals(torch.as_tensor(next_obs))
 
         all_dists = policy.pdtype.from_flat(all_dists.reshape(k * n_envs, -1))
         yield all_acts, all_rews, all_dones, all_dists, all_vals, vals.detach()
@@ -132,18 +834,29 @@ def compute_pg_vars(trajs, val_fn, gamma, gaelam):
 
     :param trajs: An OrderedDict with observations, actions, rewards
         and done flags. Assumes all have the same batch size except
-        observations with one more.
+        observations with one more. Time limit truncations and their
+        terminal observations, if present, are used for bootstrapping
+        and removed.
     :param val_fn: An instance of proj.common.models.ValueFunction
     :return: A tuple of all advantages, values and returns computed
     """
+    truncations = trajs.pop("truncations", None)
+    terminal_obs = trajs.pop("terminal_obs", None)
     observations, _, rewards, dones = trajs.values()
     masks = (1 - dones).to(rewards)
-    returns = rewards.clone()
 
     # values_shape = torch.cat((rewards, rewards[:1])).shape
     n_steps, n_envs = rewards.shape
     observations = observations.reshape(n_steps + 1, n_envs, -1)
     values = val_fn(observations).reshape(n_steps + 1, n_envs)
+    if truncations is not None and len(terminal_obs):
+        # Episodes cut short by a time limit didn't reach a terminal state, so
+        # their last reward is bootstrapped with the value of their true last
+        # observation (the next one is already from the following episode)
+        terminal_vals = val_fn(terminal_obs.reshape(len(terminal_obs), -1))
+        rewards = rewards.clone()
+        rewards[truncations.bool()] += gamma * terminal_vals.reshape(-1)
+    returns = rewards.clone()
     deltas = rewards + gamma * (masks * values[1:]) - values[:-1]
     returns[-1] += gamma * (masks[-1] * values[-1])
     gaemul = gamma * gaelam
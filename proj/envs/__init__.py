@@ -1,3 +1,29 @@
 # pylint: disable=unused-import
-from proj.envs.random_cartpole import RandomCartPoleEnv
-from proj.envs.cartpole_swingup import CartPoleSwingUpEnv
+from proj.envs.random_cartpole import (
+    RandomCartPoleEnv,
+    RandomCartPoleVecEnv,
+    RandomCartPoleTorchVecEnv,
+)
+from proj.envs.cartpole_swingup import (
+    CartPoleSwingUpEnv,
+    CartPoleSwingUpVecEnv,
+    CartPoleSwingUpTorchVecEnv,
+)
+
+# Natively vectorized implementations of registered environments
+VEC_ENVS = {"CartPoleSwingUp-v0": CartPoleSwingUpVecEnv}
+VEC_ENVS.update(
+    {
+        "Gauss{}CartPole-v1".format(stddev): RandomCartPoleVecEnv
+        for stddev in (0.0, 0.5, 1.0, 1.5)
+    }
+)
+
+# Natively vectorized implementations of registered environments in PyTorch
+TORCH_VEC_ENVS = {"CartPoleSwingUp-v0": CartPoleSwingUpTorchVecEnv}
+TORCH_VEC_ENVS.update(
+    {
+        "Gauss{}CartPole-v1".format(stddev): RandomCartPoleTorchVecEnv
+        for stddev in (0.0, 0.5, 1.0, 1.5)
+    }
+)
@@ -9,6 +9,9 @@ import numpy as np
 import gym
 from gym import spaces
 from gym.utils import seeding
+import torch
+from proj.envs.numpy_vec_env import NumpyVecEnv
+from proj.envs.torch_vec_env import TorchVecEnv
 
 
 Physics = namedtuple("Physics", "gravity forcemag deltat friction")
@@ -128,6 +131,191 @@ class CartPoleSwingUpEnv(gym.Env):
         return np.array([x_pos, x_dot, np.cos(theta), np.sin(theta), theta_dot])
 
 
+class CartPoleSwingUpVecEnv(NumpyVecEnv):
+    """
+    Natively vectorized version of CartPoleSwingUpEnv, which keeps the states
+    of all carts in a (n_envs, 4) array and steps them at once with NumPy.
+    """
+
+    metadata = CartPoleSwingUpEnv.metadata
+    physics = CartPoleSwingUpEnv.physics
+    cart = CartPoleSwingUpEnv.cart
+    pole = CartPoleSwingUpEnv.pole
+    thresholds = CartPoleSwingUpEnv.thresholds
+
+    def __init__(self, n_envs, max_episode_steps=None):
+        env = CartPoleSwingUpEnv()
+        self.state = np.zeros((n_envs, 4))
+        self.viewers = None
+        super().__init__(
+            n_envs,
+            env.observation_space,
+            env.action_space,
+            max_episode_steps=max_episode_steps,
+        )
+
+    def get_images(self):
+        if self.viewers is None:
+            self.viewers = [
+                CartPoleSwingUpViewer(self.cart, self.pole, world_width=5)
+                for _ in range(self.num_envs)
+            ]
+        imgs = []
+        for viewer, state in zip(self.viewers, self.state):
+            viewer.update(State(*state), self.pole)
+            imgs.append(viewer.render(return_rgb_array=True))
+        return imgs
+
+    def close_extras(self):
+        if self.viewers:
+            for viewer in self.viewers:
+                viewer.close()
+            self.viewers = None
+
+    def _step(self, actions):
+        physics, pole = self.physics, self.pole
+        action = np.clip(actions, -1.0, 1.0)[:, 0] * physics.forcemag
+        x_pos, x_dot, theta, theta_dot = self.state.T
+
+        sin_theta = np.sin(theta)
+        cos_theta = np.cos(theta)
+
+        m_p_l = pole.mass * pole.length
+        masstotal = self.cart.mass + pole.mass
+        xdot_update = (
+            -2 * m_p_l * (theta_dot ** 2) * sin_theta
+            + 3 * pole.mass * physics.gravity * sin_theta * cos_theta
+            + 4 * action
+            - 4 * physics.friction * x_dot
+        ) / (4 * masstotal - 3 * pole.mass * cos_theta ** 2)
+        thetadot_update = (
+            -3 * m_p_l * (theta_dot ** 2) * sin_theta * cos_theta
+            + 6 * masstotal * physics.gravity * sin_theta
+            + 6 * (action - physics.friction * x_dot) * cos_theta
+        ) / (4 * pole.length * masstotal - 3 * m_p_l * cos_theta ** 2)
+
+        self.state = np.stack(
+            [
+                x_pos + x_dot * physics.deltat,
+                x_dot + xdot_update * physics.deltat,
+                theta + theta_dot * physics.deltat,
+                theta_dot + thetadot_update * physics.deltat,
+            ],
+            axis=-1,
+        )
+        x_pos, theta = self.state[:, 0], self.state[:, 2]
+
+        reward_theta = (np.cos(theta) + 1.0) / 2.0
+        reward_x = np.cos((x_pos / self.thresholds["x_pos"]) * (np.pi / 2.0))
+        dones = (x_pos < -self.thresholds["x_pos"]) | (x_pos > self.thresholds["x_pos"])
+        return reward_theta * reward_x, dones
+
+    def _reset(self, mask):
+        self.state[mask] = self.np_random.normal(
+            loc=np.array([0.0, 0.0, np.pi, 0.0]),
+            scale=np.array([0.2, 0.2, 0.2, 0.2]),
+            size=(np.count_nonzero(mask), 4),
+        )
+
+    def _observe(self):
+        x_pos, x_dot, theta, theta_dot = self.state.T
+        return np.stack(
+            [x_pos, x_dot, np.cos(theta), np.sin(theta), theta_dot], axis=-1
+        )
+
+
+class CartPoleSwingUpTorchVecEnv(TorchVecEnv):
+    """
+    Port of CartPoleSwingUpVecEnv to PyTorch, which takes and returns tensors.
+    """
+
+    metadata = CartPoleSwingUpEnv.metadata
+    physics = CartPoleSwingUpEnv.physics
+    cart = CartPoleSwingUpEnv.cart
+    pole = CartPoleSwingUpEnv.pole
+    thresholds = CartPoleSwingUpEnv.thresholds
+
+    def __init__(self, n_envs, max_episode_steps=None):
+        env = CartPoleSwingUpEnv()
+        self.state = torch.zeros(n_envs, 4, dtype=torch.float64)
+        self.viewers = None
+        super().__init__(
+            n_envs,
+            env.observation_space,
+            env.action_space,
+            max_episode_steps=max_episode_steps,
+        )
+
+    def get_images(self):
+        if self.viewers is None:
+            self.viewers = [
+                CartPoleSwingUpViewer(self.cart, self.pole, world_width=5)
+                for _ in range(self.num_envs)
+            ]
+        imgs = []
+        for viewer, state in zip(self.viewers, self.state.numpy()):
+            viewer.update(State(*state), self.pole)
+            imgs.append(viewer.render(return_rgb_array=True))
+        return imgs
+
+    def close_extras(self):
+        if self.viewers:
+            for viewer in self.viewers:
+                viewer.close()
+            self.viewers = None
+
+    def _step(self, actions):
+        physics, pole = self.physics, self.pole
+        action = actions.to(self.state).clamp(-1.0, 1.0)[:, 0] * physics.forcemag
+        x_pos, x_dot, theta, theta_dot = self.state.unbind(-1)
+
+        sin_theta = torch.sin(theta)
+        cos_theta = torch.cos(theta)
+
+        m_p_l = pole.mass * pole.length
+        masstotal = self.cart.mass + pole.mass
+        xdot_update = (
+            -2 * m_p_l * (theta_dot ** 2) * sin_theta
+            + 3 * pole.mass * physics.gravity * sin_theta * cos_theta
+            + 4 * action
+            - 4 * physics.friction * x_dot
+        ) / (4 * masstotal - 3 * pole.mass * cos_theta ** 2)
+        thetadot_update = (
+            -3 * m_p_l * (theta_dot ** 2) * sin_theta * cos_theta
+            + 6 * masstotal * physics.gravity * sin_theta
+            + 6 * (action - physics.friction * x_dot) * cos_theta
+        ) / (4 * pole.length * masstotal - 3 * m_p_l * cos_theta ** 2)
+
+        self.state = torch.stack(
+            [
+                x_pos + x_dot * physics.deltat,
+                x_dot + xdot_update * physics.deltat,
+                theta + theta_dot * physics.deltat,
+                theta_dot + thetadot_update * physics.deltat,
+            ],
+            dim=-1,
+        )
+        x_pos, theta = self.state[:, 0], self.state[:, 2]
+
+        reward_theta = (torch.cos(theta) + 1.0) / 2.0
+        reward_x = torch.cos((x_pos / self.thresholds["x_pos"]) * (np.pi / 2.0))
+        dones = (x_pos < -self.thresholds["x_pos"]) | (x_pos > self.thresholds["x_pos"])
+        return reward_theta * reward_x, dones
+
+    def _reset(self, mask):
+        loc = self.state.new_tensor([0.0, 0.0, np.pi, 0.0])
+        noise = torch.randn(
+            (int(mask.sum()), 4), dtype=self.state.dtype, generator=self.generator
+        )
+        self.state[mask] = loc + 0.2 * noise
+
+    def _observe(self):
+        x_pos, x_dot, theta, theta_dot = self.state.unbind(-1)
+        return torch.stack(
+            [x_pos, x_dot, torch.cos(theta), torch.sin(theta), theta_dot], dim=-1
+        )
+
+
 class CartPoleSwingUpViewer:
     screen = Screen(width=600, height=400)
 
@@ -233,7 +421,7 @@ class CartPoleSwingUpViewer:
         )
 
     def render(self, *args, **kwargs):
-        self.viewer.render(*args, **kwargs)
+        return self.viewer.render(*args, **kwargs)
 
     def close(self):
         self.viewer.close()
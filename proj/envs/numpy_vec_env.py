@@ -0,0 +1,96 @@
+"""
+Base class for natively vectorized environments implemented with NumPy.
+"""
+import numpy as np
+from gym import spaces
+from baselines.common.vec_env import VecEnv
+
+
+class NumpyVecEnv(VecEnv):
+    """
+    Keeps the states of all environment copies in NumPy arrays and steps them
+    at once. Subclasses implement the dynamics by overriding `_step`, `_reset`
+    and `_observe`.
+
+    Environments are automatically reset when done. If `max_episode_steps` is
+    given, episodes are truncated after as many steps and the relative
+    timestep is appended to the observations, mimicking the TimeLimit and
+    AddRelativeTimestep wrappers applied by proj.common.env_makers.EnvMaker.
+    The true last observations of finished episodes and whether they were
+    truncated are kept in `terminal_obs` and `truncated`, as in the pools of
+    proj.common.env_pool.
+    """
+
+    def __init__(self, n_envs, ob_space, ac_space, max_episode_steps=None):
+        if max_episode_steps is not None:
+            ob_space = spaces.Box(
+                low=np.append(ob_space.low, -1.0),
+                high=np.append(ob_space.high, 1.0),
+                dtype=ob_space.dtype,
+            )
+        super().__init__(n_envs, ob_space, ac_space)
+
+        self.max_episode_steps = max_episode_steps
+        self.elapsed_steps = np.zeros(n_envs, dtype=np.int64)
+        self.terminal_obs = np.zeros((n_envs,) + ob_space.shape, ob_space.dtype)
+        self.truncated = np.zeros(n_envs, dtype=bool)
+        self.actions = None
+
+        # set initial seeds
+        self.seed(np.random.randint(low=0, high=np.iinfo(np.int32).max, size=n_envs))
+
+    def seed(self, seeds=None):
+        if seeds is not None:
+            seeds = np.asarray(seeds, dtype=np.uint32)
+        self.np_random = np.random.RandomState(seeds)
+
+    def reset(self):
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        rews, dones = self._step(np.asarray(self.actions))
+        infos = [{} for _ in range(self.num_envs)]
+
+        self.elapsed_steps += 1
+        if self.max_episode_steps is not None:
+            truncated = self.elapsed_steps >= self.max_episode_steps
+            self.truncated = truncated & ~dones
+            for idx in np.flatnonzero(self.truncated):
+                infos[idx]["TimeLimit.truncated"] = True
+            dones = dones | truncated
+
+        if dones.any():
+            # Keep the true last observations, which the reset overwrites
+            self.terminal_obs = self._get_obs()
+        self._reset_envs(dones)
+        return self._get_obs(), rews, dones, infos
+
+    def _reset_envs(self, mask):
+        self._reset(mask)
+        self.elapsed_steps[mask] = 0
+
+    def _get_obs(self):
+        obs = self._observe()
+        if self.max_episode_steps is not None:
+            timestep = -1 + (self.elapsed_steps / self.max_episode_steps) * 2
+            obs = np.concatenate([obs, timestep[:, None]], axis=-1)
+        return obs.astype(self.observation_space.dtype)
+
+    def _step(self, actions):
+        """
+        Advance the states of all environments, returning the rewards and
+        done flags as arrays.
+        """
+        raise NotImplementedError
+
+    def _reset(self, mask):
+        """Sample initial states for the environments selected by `mask`."""
+        raise NotImplementedError
+
+    def _observe(self):
+        """Compute the (n_envs, *obs_shape) observations of the current states."""
+        raise NotImplementedError
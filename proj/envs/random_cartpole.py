@@ -2,6 +2,9 @@ import math
 import numpy as np
 from gym import logger
 from gym.envs.classic_control.cartpole import CartPoleEnv
+import torch
+from proj.envs.numpy_vec_env import NumpyVecEnv
+from proj.envs.torch_vec_env import TorchVecEnv
 
 
 class RandomCartPoleEnv(CartPoleEnv):
@@ -65,3 +68,190 @@ class RandomCartPoleEnv(CartPoleEnv):
             reward = 0.0
 
         return np.array(self.state), reward, done, {}
+
+
+class RandomCartPoleVecEnv(NumpyVecEnv):
+    """
+    Natively vectorized version of RandomCartPoleEnv, which keeps the states
+    of all carts in a (n_envs, 4) array and steps them at once with NumPy.
+    """
+
+    metadata = RandomCartPoleEnv.metadata
+
+    def __init__(self, n_envs, noise_scale=0.1, max_episode_steps=None):
+        # Physical constants, spaces and rendering are borrowed from single
+        # environment instances
+        self.env = RandomCartPoleEnv(noise_scale=noise_scale)
+        self.noise_scale = noise_scale
+        self.state = np.zeros((n_envs, 4))
+        self.steps_beyond_done = np.full(n_envs, -1)
+        self.render_envs = None
+        super().__init__(
+            n_envs,
+            self.env.observation_space,
+            self.env.action_space,
+            max_episode_steps=max_episode_steps,
+        )
+
+    def get_images(self):
+        if self.render_envs is None:
+            self.render_envs = [
+                RandomCartPoleEnv(noise_scale=self.noise_scale)
+                for _ in range(self.num_envs)
+            ]
+        imgs = []
+        for env, state in zip(self.render_envs, self.state):
+            env.state = tuple(state)
+            imgs.append(env.render(mode="rgb_array"))
+        return imgs
+
+    def close_extras(self):
+        if self.render_envs:
+            for env in self.render_envs:
+                env.close()
+            self.render_envs = None
+        self.env.close()
+
+    def _step(self, actions):
+        env = self.env
+        x_pos, x_dot, theta, theta_dot = self.state.T
+        force = np.where(actions == 1, env.force_mag, -env.force_mag)
+        force += force * self.np_random.normal(scale=self.noise_scale, size=len(force))
+
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+        temp = (
+            force + env.polemass_length * theta_dot * theta_dot * sintheta
+        ) / env.total_mass
+        thetaacc = (env.gravity * sintheta - costheta * temp) / (
+            env.length
+            * (4.0 / 3.0 - env.masspole * costheta * costheta / env.total_mass)
+        )
+        x_acc = temp - env.polemass_length * thetaacc * costheta / env.total_mass
+        if env.kinematics_integrator == "euler":
+            x_pos = x_pos + env.tau * x_dot
+            x_dot = x_dot + env.tau * x_acc
+            theta = theta + env.tau * theta_dot
+            theta_dot = theta_dot + env.tau * thetaacc
+        else:  # semi-implicit euler
+            x_dot = x_dot + env.tau * x_acc
+            x_pos = x_pos + env.tau * x_dot
+            theta_dot = theta_dot + env.tau * thetaacc
+            theta = theta + env.tau * theta_dot
+        self.state = np.stack([x_pos, x_dot, theta, theta_dot], axis=-1)
+        dones = (
+            (x_pos < -env.x_threshold)
+            | (x_pos > env.x_threshold)
+            | (theta < -env.theta_threshold_radians)
+            | (theta > env.theta_threshold_radians)
+        )
+
+        # Same bookkeeping as RandomCartPoleEnv: no reward after the pole fell
+        rews = np.where(self.steps_beyond_done < 0, 1.0, 0.0)
+        self.steps_beyond_done[dones & (self.steps_beyond_done < 0)] = 0
+        return rews, dones
+
+    def _reset(self, mask):
+        self.state[mask] = self.np_random.uniform(
+            low=-0.05, high=0.05, size=(np.count_nonzero(mask), 4)
+        )
+        self.steps_beyond_done[mask] = -1
+
+    def _observe(self):
+        return self.state
+
+
+class RandomCartPoleTorchVecEnv(TorchVecEnv):
+    """
+    Port of RandomCartPoleVecEnv to PyTorch, which takes and returns tensors.
+    """
+
+    metadata = RandomCartPoleEnv.metadata
+
+    def __init__(self, n_envs, noise_scale=0.1, max_episode_steps=None):
+        # Physical constants, spaces and rendering are borrowed from single
+        # environment instances
+        self.env = RandomCartPoleEnv(noise_scale=noise_scale)
+        self.noise_scale = noise_scale
+        self.state = torch.zeros(n_envs, 4, dtype=torch.float64)
+        self.steps_beyond_done = torch.full((n_envs,), -1, dtype=torch.long)
+        self.render_envs = None
+        super().__init__(
+            n_envs,
+            self.env.observation_space,
+            self.env.action_space,
+            max_episode_steps=max_episode_steps,
+        )
+
+    def get_images(self):
+        if self.render_envs is None:
+            self.render_envs = [
+                RandomCartPoleEnv(noise_scale=self.noise_scale)
+                for _ in range(self.num_envs)
+            ]
+        imgs = []
+        for env, state in zip(self.render_envs, self.state.numpy()):
+            env.state = tuple(state)
+            imgs.append(env.render(mode="rgb_array"))
+        return imgs
+
+    def close_extras(self):
+        if self.render_envs:
+            for env in self.render_envs:
+                env.close()
+            self.render_envs = None
+        self.env.close()
+
+    def _step(self, actions):
+        env = self.env
+        x_pos, x_dot, theta, theta_dot = self.state.unbind(-1)
+        force = torch.where(
+            actions == 1,
+            self.state.new_tensor(env.force_mag),
+            self.state.new_tensor(-env.force_mag),
+        )
+        noise = torch.randn(len(force), dtype=force.dtype, generator=self.generator)
+        force = force + force * noise * self.noise_scale
+
+        costheta = torch.cos(theta)
+        sintheta = torch.sin(theta)
+        temp = (
+            force + env.polemass_length * theta_dot * theta_dot * sintheta
+        ) / env.total_mass
+        thetaacc = (env.gravity * sintheta - costheta * temp) / (
+            env.length
+            * (4.0 / 3.0 - env.masspole * costheta * costheta / env.total_mass)
+        )
+        x_acc = temp - env.polemass_length * thetaacc * costheta / env.total_mass
+        if env.kinematics_integrator == "euler":
+            x_pos = x_pos + env.tau * x_dot
+            x_dot = x_dot + env.tau * x_acc
+            theta = theta + env.tau * theta_dot
+            theta_dot = theta_dot + env.tau * thetaacc
+        else:  # semi-implicit euler
+            x_dot = x_dot + env.tau * x_acc
+            x_pos = x_pos + env.tau * x_dot
+            theta_dot = theta_dot + env.tau * thetaacc
+            theta = theta + env.tau * theta_dot
+        self.state = torch.stack([x_pos, x_dot, theta, theta_dot], dim=-1)
+        dones = (
+            (x_pos < -env.x_threshold)
+            | (x_pos > env.x_threshold)
+            | (theta < -env.theta_threshold_radians)
+            | (theta > env.theta_threshold_radians)
+        )
+
+        # Same bookkeeping as RandomCartPoleEnv: no reward after the pole fell
+        rews = (self.steps_beyond_done < 0).to(self.state)
+        self.steps_beyond_done[dones & (self.steps_beyond_done < 0)] = 0
+        return rews, dones
+
+    def _reset(self, mask):
+        noise = torch.rand(
+            (int(mask.sum()), 4), dtype=self.state.dtype, generator=self.generator
+        )
+        self.state[mask] = noise * 0.1 - 0.05
+        self.steps_beyond_done[mask] = -1
+
+    def _observe(self):
+        return self.state
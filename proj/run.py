@@ -119,7 +119,13 @@ if __name__ == "__main__":
         "td3",
         "sac",
     ]
-    valid_utils = ["viskit/frontend", "plot", "sim_policy", "record_policy"]
+    valid_utils = [
+        "viskit/frontend",
+        "plot",
+        "sim_policy",
+        "record_policy",
+        "env_server",
+    ]
     valid_cmds = valid_algos + valid_utils
     assert (
         cmd in valid_cmds
@@ -0,0 +1,23 @@
+import click
+from proj.common.env_pool import serve_env_workers, AUTHKEY_ENV_VAR
+
+
+@click.command()
+@click.option("--host", default="localhost", help="Address to listen on")
+@click.option("--port", type=int, default=7000, help="Port to listen on")
+@click.option(
+    "--authkey",
+    envvar=AUTHKEY_ENV_VAR,
+    default=None,
+    help="Shared secret clients must authenticate with (required unless listening "
+    "on a loopback address)",
+)
+def main(host, port, authkey):
+    """
+    Hosts environment workers for RemoteEnvPool clients.
+    """
+    serve_env_workers(host, port, authkey)
+
+
+if __name__ == "__main__":
+    main()
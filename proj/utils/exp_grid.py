@@ -84,12 +84,15 @@ def create_experiment(
         import numpy as np
         from baselines import logger
         from proj.utils.tqdm_util import tqdm_out
+        from proj.common.env_pool import allowed_cpus
 
         np.random.seed(seed)
         random.seed(seed)
         torch.manual_seed(seed)
 
-        torch.set_num_threads(4)
+        # Env pools created with pin_cpus=True place the learner's threads
+        # on cores disjoint from their workers'
+        torch.set_num_threads(min(4, len(allowed_cpus())))
 
         with tqdm_out(), logger.scoped_configure(log_dir, format_strs):
             from proj.common.log_utils import save_config
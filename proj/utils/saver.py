@@ -2,8 +2,11 @@
 Utility for pickling, saving and reloading snapshots
 """
 import os
-import torch
+import zlib
 import copy
+import pickle
+import numpy as np
+import torch
 import cloudpickle.cloudpickle as cpkl
 
 
@@ -27,19 +30,29 @@ class SnapshotSaver(object):
     def snapshots_folder(self):
         return os.path.join(self.path, "snapshots")
 
+    @property
+    def replay_folder(self):
+        return os.path.join(self.path, "replay_ckpt")
+
     def get_snapshot_path(self, index):
         return os.path.join(
             self.snapshots_folder,
             "latest.pkl" if self.latest_only else "%d.pkl" % index,
         )
 
+    def should_save(self, index):
+        return index == 1 or index % self.save_interval == 0
+
     def save_state(self, index, state):
-        if index == 1 or index % self.save_interval == 0:
+        """Save `state` if due at `index`, returning whether it was saved."""
+        if self.should_save(index):
             state = (self.config, state)
             file_path = self.get_snapshot_path(index)
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             with open(file_path, "wb") as f:
                 torch.save(state, f, pickle_module=cpkl, pickle_protocol=-1)
+            return True
+        return False
 
     def get_state(self, index=None, device="cpu"):
         device = torch.device(device)
@@ -56,7 +69,9 @@ class SnapshotSaver(object):
             except EOFError:
                 pass
         else:
-            snapshot_files = os.listdir(self.snapshots_folder)
+            snapshot_files = [
+                x for x in os.listdir(self.snapshots_folder) if x.endswith(".pkl")
+            ]
             snapshot_files = sorted(snapshot_files, key=lambda x: int(x.split(".")[0]))[
                 ::-1
             ]
@@ -67,3 +82,97 @@ class SnapshotSaver(object):
                         return torch.load(f, map_location=device)
                 except EOFError:
                     pass
+
+
+class ReplayCheckpointer(object):
+    """
+    Incrementally saves the state of a replay buffer under `path`. Arrays are
+    split along their first axis into chunks of about `chunk_bytes`, which are
+    compressed with zlib and only written if their checksum changed since the
+    last save. Everything else is pickled in a small manifest, which is
+    replaced last so that an interrupted save leaves the previous one intact.
+    """
+
+    def __init__(self, path, chunk_bytes=1 << 22, level=1):
+        self.path, self.chunk_bytes, self.level = path, chunk_bytes, level
+        self.manifest = None
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "rb") as f:
+                self.manifest = pickle.load(f)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.path, "manifest.pkl")
+
+    def save(self, replay):
+        """
+        Save the state of `replay` and return the number of bytes written.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        prev = self.manifest["arrays"] if self.manifest else {}
+        arrays, others, n_bytes = {}, {}, 0
+        for key, value in replay.state_dict().items():
+            if isinstance(value, (torch.Tensor, np.ndarray)) and value.ndim > 0:
+                arrays[key], written = self._save_array(
+                    key, _as_numpy(value), prev.get(key)
+                )
+                n_bytes += written
+            else:
+                others[key] = value
+
+        manifest = dict(arrays=arrays, others=others)
+        data = pickle.dumps(manifest, protocol=-1)
+        _write_atomic(self.manifest_path, data)
+        self.manifest = manifest
+
+        # Drop chunks superseded by this save
+        chunks = {name for spec in arrays.values() for name in spec["chunks"]}
+        for name in os.listdir(self.path):
+            if name.endswith(".z") and name not in chunks:
+                os.remove(os.path.join(self.path, name))
+        return n_bytes + len(data)
+
+    def restore(self, replay):
+        """
+        Load the saved state into `replay`, decompressing one chunk at a time
+        directly into its storage before calling its `load_state_dict`.
+        """
+        assert self.manifest is not None, "No replay checkpoint in " + self.path
+        state = replay.state_dict()
+        for key, spec in self.manifest["arrays"].items():
+            array, rows = _as_numpy(state[key]), spec["rows"]
+            assert array.shape == spec["shape"] and array.dtype.str == spec["dtype"], (
+                "Trying to restore incompatible replay buffer array " + key
+            )
+            for idx, name in enumerate(spec["chunks"]):
+                chunk = array[idx * rows : (idx + 1) * rows]
+                with open(os.path.join(self.path, name), "rb") as f:
+                    data = zlib.decompress(f.read())
+                chunk[...] = np.frombuffer(data, array.dtype).reshape(chunk.shape)
+        state.update(self.manifest["others"])
+        replay.load_state_dict(state)
+
+    def _save_array(self, key, array, prev):
+        rows = max(self.chunk_bytes // max(array[0].nbytes, 1), 1)
+        saved = set(prev["chunks"]) if prev and prev["rows"] == rows else set()
+        chunks, n_bytes = [], 0
+        for idx, beg in enumerate(range(0, len(array), rows)):
+            chunk = np.ascontiguousarray(array[beg : beg + rows])
+            name = "{}.{}.{:08x}.z".format(key, idx, zlib.crc32(chunk))
+            if name not in saved:
+                data = zlib.compress(chunk, self.level)
+                _write_atomic(os.path.join(self.path, name), data)
+                n_bytes += len(data)
+            chunks.append(name)
+        spec = dict(dtype=array.dtype.str, shape=array.shape, rows=rows, chunks=chunks)
+        return spec, n_bytes
+
+
+def _as_numpy(value):
+    return value.numpy() if isinstance(value, torch.Tensor) else value
+
+
+def _write_atomic(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
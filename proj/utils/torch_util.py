@@ -121,6 +121,16 @@ def update_polyak(from_module, to_module, polyak):
         target.data.mul_(polyak).add_(1 - polyak, source.data)
 
 
+def weighted_mse_loss(input, target, weights=None):
+    """
+    Mean squared error, with each squared error scaled by `weights` (e.g.,
+    importance sampling weights) if given.
+    """
+    if weights is None:
+        return nn.functional.mse_loss(input, target)
+    return torch.mean(weights * (input - target).pow(2))
+
+
 # ==============================
 # Transforms
 # ==============================
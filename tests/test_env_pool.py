@@ -0,0 +1,130 @@
+"""
+Tests for the subprocess based pools of proj.common.env_pool.
+"""
+
+import os
+import time
+
+import numpy as np
+import gym
+import pytest
+from gym import spaces
+from proj.common.env_pool import EnvPool, ShmEnvPool
+from proj.common.env_makers import DummyVecEnv
+
+
+class CountEnv(gym.Env):
+    """
+    Episodes of 3 + seed % 2 steps, observing the seed, step and last action.
+    """
+
+    observation_space = spaces.Box(-np.inf, np.inf, (3,), np.float32)
+    action_space = spaces.Box(-1, 1, (1,), np.float32)
+
+    def __init__(self):
+        self.seed_, self.t = 0, 0
+
+    def seed(self, seed=None):
+        self.seed_ = seed or 0
+
+    def reset(self):
+        self.t = 0
+        return np.array([self.seed_, 0, 0], np.float32)
+
+    def step(self, action):
+        self.t += 1
+        ob = np.array([self.seed_, self.t, action[0]], np.float32)
+        done = self.t >= 3 + self.seed_ % 2
+        return ob, float(action[0]) * self.t, done, {"t": self.t}
+
+
+class CrashingEnv(CountEnv):
+    """CountEnv whose worker dies on action 99 and hangs on action 42."""
+
+    def step(self, action):
+        if action[0] == 99:
+            os._exit(1)
+        if action[0] == 42:
+            time.sleep(60)
+        return super().step(action)
+
+
+def rollout(vec_env, n_steps=8):
+    results = []
+    try:
+        vec_env.seed(np.arange(vec_env.num_envs))
+        results.append(np.array(vec_env.reset()))
+        for step in range(n_steps):
+            actions = np.linspace(-1, 1, vec_env.num_envs)[:, None] * (step % 3)
+            obs, rews, dones, infos = vec_env.step(actions.astype(np.float32))
+            results += [np.array(obs), rews, dones, [info["t"] for info in infos]]
+    finally:
+        vec_env.close()
+    return results
+
+
+@pytest.mark.parametrize(
+    "make_pool",
+    [
+        lambda: EnvPool(CountEnv, n_envs=5, n_parallel=2),
+        lambda: ShmEnvPool(CountEnv, n_envs=5, n_parallel=2),
+        lambda: ShmEnvPool(CountEnv, n_envs=5, n_parallel=2, shared_step=False),
+    ],
+)
+def test_pool_matches_dummy_vec_env(make_pool):
+    expected = rollout(DummyVecEnv([CountEnv] * 5))
+    for result, exp in zip(rollout(make_pool()), expected):
+        np.testing.assert_allclose(result, exp)
+
+
+@pytest.mark.parametrize("shared_step", [True, False])
+def test_shm_pool_send_recv(shared_step):
+    pool = ShmEnvPool(CountEnv, n_envs=4, n_parallel=4, shared_step=shared_step)
+    try:
+        pool.seed(np.arange(4))
+        pool.reset()
+        pool.send(np.full((2, 1), 0.5, np.float32), env_ids=np.array([1, 3]))
+        env_ids, obs, rews, dones, _ = pool.recv(min_ready=2)
+        order = np.argsort(env_ids)
+        assert env_ids[order].tolist() == [1, 3]
+        assert obs[order].tolist() == [[1, 1, 0.5], [3, 1, 0.5]]
+        assert rews.tolist() == [0.5, 0.5] and not dones.any()
+    finally:
+        pool.close()
+
+
+POOLS = {
+    "EnvPool": lambda **kwargs: EnvPool(CrashingEnv, **kwargs),
+    "ShmEnvPool": lambda **kwargs: ShmEnvPool(CrashingEnv, **kwargs),
+    "ShmEnvPool-pipes": lambda **kwargs: ShmEnvPool(
+        CrashingEnv, shared_step=False, **kwargs
+    ),
+}
+
+
+@pytest.mark.parametrize("name", list(POOLS))
+def test_dead_and_hung_workers_restart(name):
+    pool = POOLS[name](n_envs=4, n_parallel=2, timeout=1.0)
+    try:
+        pool.reset()
+        for n_restarts, action in enumerate([99, 42], 1):
+            actions = np.zeros((4, 1), np.float32)
+            actions[1] = action
+            obs, rews, dones, infos = pool.step(actions)
+            assert pool.n_restarts == n_restarts
+            # Both environments of the first worker were reset
+            assert dones.tolist() == [True, True, False, False]
+            assert rews[:2].tolist() == [0.0, 0.0]
+            assert [info.get("worker_restart") for info in infos[:2]] == [True] * 2
+            assert not pool.truncated[:2].any()
+            assert (pool.terminal_obs[:2] == obs[:2]).all()
+            assert obs[:2, 1].tolist() == [0.0, 0.0]
+
+        pool.send(np.full((1, 1), 99, np.float32), env_ids=np.array([2]))
+        env_ids, _, _, dones, infos = pool.recv()
+        assert env_ids.tolist() == [2] and dones.tolist() == [True]
+        assert infos[0].get("worker_restart") and pool.n_restarts == 3
+        _, _, dones, _ = pool.step(np.zeros((4, 1), np.float32))
+        assert not dones.any()
+    finally:
+        pool.close()
@@ -0,0 +1,283 @@
+"""
+Tests for the replay buffers of proj.common.sampling.
+"""
+
+import random
+import threading
+
+import numpy as np
+import pytest
+import torch
+from gym import spaces
+from proj.common.sampling import (
+    BatchPrefetcher,
+    CompactReplayBuffer,
+    FrameStackReplayBuffer,
+    MemmapReplayBuffer,
+    PrioritizedReplayBuffer,
+    ReplayBuffer,
+    SumTree,
+    make_replay_buffer,
+)
+
+OB_SPACE = spaces.Box(-1, 1, (3,), np.float32)
+AC_SPACE = spaces.Box(-1, 1, (2,), np.float32)
+
+
+def numbered_transitions(beg, end):
+    """Transitions whose fields are all filled with their number."""
+    idxs = np.arange(beg, end, dtype=np.float32)
+    return (
+        np.repeat(idxs[:, None], 3, axis=1),
+        np.repeat(idxs[:, None], 2, axis=1),
+        idxs,
+        np.repeat(idxs[:, None], 3, axis=1) + 0.5,
+        idxs % 2 == 0,
+    )
+
+
+def episodic_steps(n_steps, ep_lengths, terminal):
+    """
+    Steps of environments observing [env, 10 * episode + step], whose episodes
+    end in terminal transitions or time limits according to `terminal`. The
+    true last observation of each episode is returned as its next one.
+    """
+    n_envs = len(ep_lengths)
+    episodes, steps = [0] * n_envs, [0] * n_envs
+    for row in range(n_steps):
+        obs1 = np.array(
+            [[env, 10 * episodes[env] + steps[env]] for env in range(n_envs)]
+        )
+        obs2, dones, resets = (
+            obs1 + [0, 1],
+            np.zeros(n_envs, bool),
+            np.zeros(n_envs, bool),
+        )
+        for env in range(n_envs):
+            steps[env] += 1
+            if steps[env] == ep_lengths[env]:
+                dones[env], resets[env] = terminal[env], True
+                episodes[env], steps[env] = episodes[env] + 1, 0
+        acts = np.full((n_envs, 1), row % 3, np.float32)
+        rews = row + np.arange(n_envs) / n_envs
+        yield obs1.astype(np.uint8), acts, rews, obs2.astype(np.uint8), dones, resets
+
+
+def stacked_steps(n_envs, n_steps, stack, ep_lengths):
+    """
+    Transitions of `n_envs` environments whose frames are 10 * episode + step,
+    stacked the way VecFrameStack does: the stacks of auto-reset environments
+    are zeroed, so that their next observation is the first of the new episode.
+    """
+    stacks = np.zeros((n_envs, stack), np.float32)
+    episodes, steps = [0] * n_envs, [0] * n_envs
+    for env in range(n_envs):
+        stacks[env, -1] = 1
+    for _ in range(n_steps):
+        obs1 = stacks.copy()
+        dones = np.zeros(n_envs, np.bool_)
+        for env in range(n_envs):
+            steps[env] += 1
+            stacks[env] = np.roll(stacks[env], -1)
+            if steps[env] == ep_lengths[env]:
+                dones[env] = True
+                episodes[env] += 1
+                steps[env] = 0
+                stacks[env] = 0
+            stacks[env, -1] = 10 * episodes[env] + steps[env] + 1
+        yield obs1, np.zeros((n_envs, 1), np.float32), np.ones(n_envs), stacks, dones
+
+
+def test_store_batch_wraps_around():
+    replay = ReplayBuffer(8, OB_SPACE, AC_SPACE)
+    replay.store_batch(*numbered_transitions(0, 6))
+    replay.store_batch(*numbered_transitions(6, 11))
+    assert (replay.ptr, replay.size) == (3, 8)
+    assert replay.all_rews.tolist() == [8, 9, 10, 3, 4, 5, 6, 7]
+    assert (replay.all_obs1[:, 2] == replay.all_rews).all()
+    assert (replay.all_obs2[:, 0] == replay.all_rews + 0.5).all()
+
+    # Only the most recent of more transitions than fit are kept, whatever
+    # their leading dimensions
+    items = numbered_transitions(11, 31)
+    replay.store_batch(*(item.reshape((5, 4) + item.shape[1:]) for item in items))
+    assert (replay.ptr, replay.size) == (7, 8)
+    assert replay.all_rews.tolist() == [24, 25, 26, 27, 28, 29, 30, 23]
+
+    single = ReplayBuffer(8, OB_SPACE, AC_SPACE)
+    for transition in zip(*numbered_transitions(0, 31)):
+        single.store(*(torch.tensor(x, dtype=torch.float32) for x in transition))
+    assert single.ptr == replay.ptr
+    for name in ("all_obs1", "all_acts", "all_rews", "all_obs2", "all_dones"):
+        assert getattr(single, name).tolist() == getattr(replay, name).tolist()
+
+
+@pytest.mark.parametrize("capacity", [64, 20])
+def test_compact_next_observations_at_boundaries(capacity):
+    # The first environment's episodes end in terminal transitions, and the
+    # second's in time limits, whose next observations must be kept
+    ob_space = spaces.Box(0, 255, (2,), np.uint8)
+    ac_space = spaces.Box(-1, 1, (1,), np.float32)
+    replay = CompactReplayBuffer(capacity, ob_space, ac_space, n_envs=2)
+    assert replay.all_obs.dtype == torch.uint8
+    transitions, n_truncated = [], []
+    for obs1, acts, rews, obs2, dones, resets in episodic_steps(15, [3, 4], [1, 0]):
+        replay.store_batch(obs1, acts, rews, obs2, dones, resets=resets)
+        for ob1, act, rew, ob2, done in zip(obs1, acts, rews, obs2, dones):
+            ob2 = None if done else ob2.tolist()
+            transitions.append((ob1.tolist(), act.tolist(), rew, ob2, done))
+        n_truncated.append((resets & ~dones).sum())
+
+    n_items = replay.size
+    assert n_items == min(capacity, 30)
+    random.seed(0)
+    obs1, acts, rews, obs2, dones = replay.sample(n_items)
+    sampled = [
+        (ob1, act, rew, None if done else ob2, bool(done))
+        for ob1, act, rew, ob2, done in zip(
+            obs1.tolist(), acts.tolist(), rews.tolist(), obs2.tolist(), dones.tolist()
+        )
+    ]
+    assert sorted(sampled) == sorted(transitions[-n_items:])
+    # Only next observations of time limits before the last row are kept apart
+    n_rows = n_items // 2
+    assert len(replay.boundary_obs) == sum(n_truncated[-n_rows:-1])
+
+
+@pytest.mark.parametrize("capacity", [64, 24])
+def test_frame_stacks_dont_cross_resets(capacity):
+    n_envs, stack = 2, 4
+    ob_space = spaces.Box(0, 255, (stack,), np.float32)
+    ac_space = spaces.Box(-1, 1, (1,), np.float32)
+    replay = FrameStackReplayBuffer(capacity, ob_space, ac_space, n_envs, stack)
+    transitions = []
+    for obs1, acts, rews, obs2, dones in stacked_steps(n_envs, 20, stack, [5, 3]):
+        replay.store_batch(obs1, acts, rews, obs2.copy(), dones)
+        transitions.extend(zip(obs1.tolist(), obs2.tolist(), dones.tolist()))
+
+    n_items = replay._n_sampleable()
+    assert replay.can_sample(n_items) and not replay.can_sample(n_items + 1)
+    random.seed(0)
+    obs1, _, _, obs2, dones = replay.sample(n_items)
+    sampled = sorted(zip(obs1.tolist(), obs2.tolist(), dones.bool().tolist()))
+    assert sampled == sorted(transitions[-n_items:])
+    # Including the first observations of episodes, made of a single frame
+    assert any(ob[:-1] == [0.0] * (stack - 1) for ob in obs1.tolist())
+
+
+def test_frame_stacks_dont_cross_time_limits():
+    # Truncated episodes aren't terminal, but still reset their environment
+    stack = 2
+    ob_space = spaces.Box(0, 255, (stack,), np.float32)
+    ac_space = spaces.Box(-1, 1, (1,), np.float32)
+    replay = FrameStackReplayBuffer(16, ob_space, ac_space, 1, stack)
+    acts, rews, no = torch.zeros(1, 1), torch.ones(1), torch.zeros(1)
+    replay.store_batch([[0, 1]], acts, rews, [[1, 2]], no)
+    replay.store_batch([[1, 2]], acts, rews, [[0, 11]], no, resets=[True])
+    replay.store_batch([[0, 11]], acts, rews, [[11, 12]], no)
+    obs1, _, _, obs2, _ = replay.sample(3)
+    assert sorted(obs1.tolist()) == [[0, 1], [0, 11], [1, 2]]
+    assert sorted(obs2.tolist()) == [[0, 11], [1, 2], [11, 12]]
+
+
+def test_memmap_replay_buffer(tmp_path):
+    path = str(tmp_path / "replay")
+    with pytest.raises(AssertionError):
+        make_replay_buffer("MemmapReplayBuffer", 8, OB_SPACE, AC_SPACE)
+    replay = make_replay_buffer("MemmapReplayBuffer", 8, OB_SPACE, AC_SPACE, path=path)
+    replay.store_batch(*numbered_transitions(0, 6))
+    replay.store_batch(*numbered_transitions(6, 11))
+    assert (replay.ptr, replay.size) == (3, 8)
+
+    obs1, acts, rews, obs2, dones = replay.sample(8)
+    assert sorted(rews.tolist()) == list(range(3, 11))
+    assert (obs1[:, 0] == rews).all() and (acts[:, 1] == rews).all()
+    assert (obs2[:, 2] == rews + 0.5).all()
+    assert (dones == (rews % 2 == 0).float()).all()
+
+    # A resumed experiment reopens the files in place
+    state = replay.state_dict()
+    resumed = MemmapReplayBuffer(8, OB_SPACE, AC_SPACE, path)
+    resumed.load_state_dict(state)
+    assert (resumed.ptr, resumed.size) == (3, 8)
+    assert sorted(resumed.sample(8)[2].tolist()) == list(range(3, 11))
+
+
+def test_sum_tree_find_and_update():
+    tree = SumTree(5)
+    tree.update([0, 1, 2, 3, 4], [1.0, 0.0, 2.0, 3.0, 4.0])
+    assert tree.total == 10.0 and tree[[2, 4]].tolist() == [2.0, 4.0]
+    values = [0.0, 0.5, 1.0, 1.5, 3.0, 3.5, 6.0, 6.5, 10.0]
+    assert tree.find(values).tolist() == [0, 0, 0, 2, 2, 3, 3, 4, 4]
+
+    tree.update([0, 3], [0.0, 0.5])
+    assert tree.total == 6.5
+    assert tree.find([0.0, 2.0, 2.2, 2.6, 6.5]).tolist() == [2, 2, 3, 4, 4]
+
+
+def test_prioritized_weights():
+    replay = PrioritizedReplayBuffer(8, OB_SPACE, AC_SPACE, alpha=1.0, beta=0.5)
+    replay.store_batch(*numbered_transitions(0, 4))
+    replay.update_priorities([0, 1, 2, 3], [1.0, 1.0, 2.0, 4.0])
+    np.random.seed(0)
+    *_, weights, idxs = replay.sample(8)
+    # Stratified sampling draws each transition in proportion to its priority
+    assert sorted(idxs.tolist()) == [0, 1, 2, 2, 3, 3, 3, 3]
+    probs = np.array([1.0, 1.0, 2.0, 4.0])[idxs] / 8.0
+    expected = (4 * probs) ** -0.5
+    np.testing.assert_allclose(weights.numpy(), expected / expected.max(), 1e-6)
+
+    replay.anneal_beta(0.5)
+    assert replay.beta == 0.75
+    replay.anneal_beta(2.0)
+    *_, weights, idxs = replay.sample(8)
+    np.testing.assert_allclose(weights.numpy(), probs.min() / probs, 1e-6)
+    # New transitions get the highest priority seen so far
+    replay.store_batch(*numbered_transitions(4, 5))
+    assert replay.tree[[4]].tolist() == [4.0 + replay.eps]
+
+
+def prefetched(prefetcher, n_updates):
+    # Minibatches are only valid until the next one is requested
+    return [[x.clone() for x in batch] for batch in prefetcher.batches(n_updates)]
+
+
+@pytest.mark.parametrize("n_batches", [0, 2])
+def test_batch_prefetcher(n_batches):
+    replay = ReplayBuffer(64, OB_SPACE, AC_SPACE)
+    replay.store_batch(*numbered_transitions(0, 64))
+    prefetcher = BatchPrefetcher(replay, 16, n_batches=n_batches)
+    random.seed(0)
+    batches = prefetched(prefetcher, 5)
+    random.seed(0)
+    expected = [replay.sample(16) for _ in range(5)]
+    assert len(batches) == 5
+    for batch, exp in zip(batches, expected):
+        assert [x.tolist() for x in batch] == [x.tolist() for x in exp]
+
+    stats = prefetcher.get_stats()
+    assert 0 <= stats["PrefetchQueueDepth"] <= n_batches
+    assert stats["PrefetchWaitTime"] >= 0
+    assert prefetcher.get_stats() == {
+        "PrefetchQueueDepth": 0.0,
+        "PrefetchWaitTime": 0.0,
+    }
+
+    # Stopping early doesn't leave the producer behind
+    n_threads = threading.active_count()
+    batches = prefetcher.batches(100)
+    next(batches)
+    batches.close()
+    assert threading.active_count() == n_threads
+
+
+def test_batch_prefetcher_errors_and_priorities():
+    replay = PrioritizedReplayBuffer(64, OB_SPACE, AC_SPACE, alpha=1.0)
+    replay.store_batch(*numbered_transitions(0, 8))
+    prefetcher = BatchPrefetcher(replay, 16, n_batches=2)
+    with pytest.raises(ValueError):
+        prefetched(BatchPrefetcher(ReplayBuffer(64, OB_SPACE, AC_SPACE), 16), 2)
+
+    for *_, idxs in prefetcher.batches(3):
+        prefetcher.update_priorities(idxs, np.zeros(len(idxs)))
+    assert replay.tree[idxs].tolist() == [replay.eps] * len(idxs)
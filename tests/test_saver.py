@@ -0,0 +1,99 @@
+"""
+Tests for snapshots and replay buffer checkpoints.
+"""
+
+import os
+import random
+
+import numpy as np
+import pytest
+import torch
+from gym import spaces
+from proj.common.sampling import make_replay_buffer
+from proj.utils.saver import ReplayCheckpointer, SnapshotSaver
+
+OB_SPACE = spaces.Box(-1, 1, (6,), np.float32)
+AC_SPACE = spaces.Box(-1, 1, (2,), np.float32)
+
+
+def fill(replay, beg, end, n_envs=2):
+    for t in range(beg, end):
+        obs = np.full((n_envs, 6), t, np.float32) + np.arange(n_envs)[:, None]
+        acts = np.full((n_envs, 2), t % 3, np.float32)
+        dones = np.arange(n_envs) == t % 7
+        replay.store_batch(obs, acts, np.full(n_envs, t), obs + 1, dones)
+
+
+def samples(replay, mb_size, seed=0):
+    random.seed(seed)
+    np.random.seed(seed)
+    return [x.tolist() for x in replay.sample(mb_size)]
+
+
+@pytest.mark.parametrize(
+    "name", ["ReplayBuffer", "CompactReplayBuffer", "PrioritizedReplayBuffer"]
+)
+def test_checkpoint_round_trip(tmp_path, name):
+    replay = make_replay_buffer(name, 512, OB_SPACE, AC_SPACE, n_envs=2)
+    fill(replay, 0, 300)
+    if name == "PrioritizedReplayBuffer":
+        replay.update_priorities([1, 2, 3], [5.0, 6.0, 7.0])
+    ReplayCheckpointer(str(tmp_path), chunk_bytes=1 << 10).save(replay)
+
+    restored = make_replay_buffer(name, 512, OB_SPACE, AC_SPACE, n_envs=2)
+    ReplayCheckpointer(str(tmp_path)).restore(restored)
+    assert (restored.ptr, restored.size) == (replay.ptr, replay.size)
+    assert samples(restored, 64) == samples(replay, 64)
+
+
+def chunk_names(checkpointer):
+    return {k: spec["chunks"] for k, spec in checkpointer.manifest["arrays"].items()}
+
+
+def test_checkpoint_saves_incrementally(tmp_path):
+    replay = make_replay_buffer("ReplayBuffer", 4096, OB_SPACE, AC_SPACE)
+    fill(replay, 0, 2048)
+    checkpointer = ReplayCheckpointer(str(tmp_path), chunk_bytes=1 << 12)
+    checkpointer.save(replay)
+    before = chunk_names(checkpointer)
+    # Nothing changed, so only the manifest is rewritten
+    n_bytes = checkpointer.save(replay)
+    assert n_bytes == os.path.getsize(checkpointer.manifest_path)
+    # Overwriting the first rows only rewrites the first chunk of each array
+    fill(replay, 2048, 2058)
+    checkpointer.save(replay)
+    after = chunk_names(checkpointer)
+    for key, chunks in after.items():
+        assert len(chunks) > 1 and chunks[1:] == before[key][1:]
+        assert chunks[0] != before[key][0]
+    chunks = {name for names in after.values() for name in names}
+    assert {n for n in os.listdir(str(tmp_path)) if n.endswith(".z")} == chunks
+
+    restored = make_replay_buffer("ReplayBuffer", 4096, OB_SPACE, AC_SPACE)
+    ReplayCheckpointer(str(tmp_path)).restore(restored)
+    assert samples(restored, 100) == samples(replay, 100)
+
+
+def test_memmap_warm_start_copies_files(tmp_path):
+    source_path, path = str(tmp_path / "source"), str(tmp_path / "resumed")
+    source = make_replay_buffer(
+        "MemmapReplayBuffer", 64, OB_SPACE, AC_SPACE, path=source_path
+    )
+    fill(source, 0, 20)
+    ReplayCheckpointer(str(tmp_path / "ckpt")).save(source)
+    before = samples(source, 40)
+
+    replay = make_replay_buffer("MemmapReplayBuffer", 64, OB_SPACE, AC_SPACE, path=path)
+    ReplayCheckpointer(str(tmp_path / "ckpt")).restore(replay)
+    assert replay.path == path and samples(replay, 40) == before
+    fill(replay, 20, 40)
+    assert samples(source, 40) == before
+
+
+def test_get_state_skips_other_entries(tmp_path):
+    saver = SnapshotSaver(str(tmp_path), latest_only=False)
+    assert not saver.replay_folder.startswith(saver.snapshots_folder)
+    os.makedirs(os.path.join(saver.snapshots_folder, "replay"))
+    for index in (3, 12):
+        torch.save((None, {"index": index}), saver.get_snapshot_path(index))
+    assert saver.get_state()[1] == {"index": 12}
@@ -0,0 +1,130 @@
+"""
+Tests for the true last observations kept by vectorized environments.
+"""
+
+import numpy as np
+import gym
+import pytest
+from gym import spaces
+from proj.common.env_pool import EnvPool, ShmEnvPool, ThreadVecEnv
+from proj.common.env_makers import DummyVecEnv
+
+
+class DictEnv(gym.Env):
+    """
+    Episodes of environments with even seeds end after 3 steps, while those of
+    odd seeds are cut short by a time limit after 2 steps.
+    """
+
+    observation_space = spaces.Dict(
+        {
+            "img": spaces.Box(0, 255, (2, 2, 3), np.uint8),
+            "pos": spaces.Box(-np.inf, np.inf, (2,), np.float32),
+        }
+    )
+    action_space = spaces.Discrete(2)
+
+    def __init__(self):
+        self.seed_, self.t = 0, 0
+
+    def seed(self, seed=None):
+        self.seed_ = seed or 0
+
+    def reset(self):
+        self.t = 0
+        return self._ob()
+
+    def step(self, action):
+        self.t += 1
+        if self.seed_ % 2:
+            done = self.t >= 2
+            return self._ob(), 1.0, done, {"TimeLimit.truncated": True} if done else {}
+        return self._ob(), 1.0, self.t >= 3, {}
+
+    def _ob(self):
+        return {
+            "img": np.full((2, 2, 3), self.t, np.uint8),
+            "pos": np.full(2, 10 * self.seed_ + self.t, np.float32),
+        }
+
+
+class OldTimeLimit:
+    """
+    Time limit wrapper like gym 0.12's, which doesn't flag truncation in infos.
+    """
+
+    def __init__(self, env, max_episode_steps):
+        self.env, self._max_episode_steps = env, max_episode_steps
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        self._elapsed_steps = 0
+
+    def seed(self, seed=None):
+        self.env.seed(seed)
+
+    def reset(self):
+        self._elapsed_steps = 0
+        return self.env.reset()
+
+    def step(self, action):
+        ob, rew, done, info = self.env.step(action)
+        self._elapsed_steps += 1
+        return ob, rew, done or self._elapsed_steps >= self._max_episode_steps, info
+
+    def close(self):
+        self.env.close()
+
+
+def time_limited_env():
+    return OldTimeLimit(DictEnv(), max_episode_steps=2)
+
+
+VEC_ENVS = {
+    "DummyVecEnv": lambda env_fn: DummyVecEnv([env_fn, env_fn]),
+    "EnvPool": lambda env_fn: EnvPool(env_fn, n_envs=2, n_parallel=2),
+    "ShmEnvPool": lambda env_fn: ShmEnvPool(env_fn, n_envs=2, n_parallel=2),
+    "ThreadVecEnv": lambda env_fn: ThreadVecEnv(env_fn, n_envs=2, n_parallel=2),
+}
+
+
+@pytest.mark.parametrize("name", list(VEC_ENVS))
+def test_dict_terminal_obs(name):
+    vec_env = VEC_ENVS[name](DictEnv)
+    try:
+        vec_env.seed([0, 1])
+        vec_env.reset()
+        actions = np.zeros(2, dtype=np.int64)
+
+        _, _, dones, _ = vec_env.step(actions)
+        assert not dones.any()
+        _, _, dones, _ = vec_env.step(actions)
+        assert dones.tolist() == [False, True]
+        assert vec_env.truncated.tolist() == [False, True]
+        assert vec_env.terminal_obs["pos"][1].tolist() == [12.0, 12.0]
+        assert (vec_env.terminal_obs["img"][1] == 2).all()
+
+        obs, _, dones, _ = vec_env.step(actions)
+        assert dones.tolist() == [True, False]
+        assert vec_env.truncated.tolist() == [False, False]
+        assert vec_env.terminal_obs["pos"][0].tolist() == [3.0, 3.0]
+        assert (vec_env.terminal_obs["img"][0] == 3).all()
+        # The returned observations are the first ones of the next episodes
+        assert obs["pos"][0].tolist() == [0.0, 0.0]
+    finally:
+        vec_env.close()
+
+
+@pytest.mark.parametrize("name", list(VEC_ENVS))
+def test_unflagged_time_limits(name):
+    vec_env = VEC_ENVS[name](time_limited_env)
+    try:
+        vec_env.seed([0, 2])
+        vec_env.reset()
+        actions = np.zeros(2, dtype=np.int64)
+        vec_env.step(actions)
+        _, _, dones, _ = vec_env.step(actions)
+        assert dones.tolist() == [True, True]
+        assert vec_env.truncated.tolist() == [True, True]
+        assert vec_env.terminal_obs["pos"][:, 0].tolist() == [2.0, 22.0]
+    finally:
+        vec_env.close()